@@ -0,0 +1,47 @@
+"""
+Benchmarks for django-history-triggers. These use the test project settings (so set
+`TEST_ENGINE=sqlite` to run against SQLite), and create and destroy a test database for
+each run. Run them from the repository root, for example:
+
+    uv run python -m benchmarks.concurrency
+"""
+
+import contextlib
+import os
+
+
+def setup():
+    os.environ.setdefault("DJANGO_SETTINGS_MODULE", "testapp.settings")
+    import django
+
+    django.setup()
+
+
+@contextlib.contextmanager
+def test_database(verbosity=0):
+    from django.test.utils import setup_databases, teardown_databases
+
+    old_config = setup_databases(verbosity, interactive=False)
+    try:
+        yield
+    finally:
+        teardown_databases(old_config, verbosity)
+
+
+@contextlib.contextmanager
+def triggers(**settings):
+    from django.core.management import call_command
+    from django.test.utils import override_settings
+
+    with override_settings(**settings):
+        call_command("triggers", "--quiet", "--clear", "enable")
+        try:
+            yield
+        finally:
+            call_command("triggers", "--quiet", "--clear", "disable")
+
+
+def report(label, count, elapsed, unit="rows"):
+    print(
+        "{:<30} {:>10.3f}s {:>12.0f} {}/s".format(label, elapsed, count / elapsed, unit)
+    )
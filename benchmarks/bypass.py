@@ -0,0 +1,52 @@
+"""
+Compares loading rows with history recorded, paused (the triggers still run, and return
+early), and bypassed (the triggers don't run at all). Pausing other models shows the
+cost of per-model pausing for tables that are still recorded.
+
+    uv run python -m benchmarks.bypass --rows 20000
+"""
+
+import argparse
+import contextlib
+import time
+
+from benchmarks import report, setup, test_database, triggers
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("-r", "--rows", type=int, default=20000)
+    parser.add_argument("-b", "--batch-size", type=int, default=1000)
+    args = parser.parse_args()
+    setup()
+    from django.db import transaction
+
+    from history import get_backend
+    from testapp.models import Author, Book
+
+    with test_database():
+        with triggers(HISTORY_MODEL="testapp.CustomHistory"):
+            with get_backend().session(username="benchmark") as session:
+                modes = {
+                    "recorded": contextlib.nullcontext,
+                    "paused": session.paused,
+                    "paused (other models)": lambda: session.paused(models=[Book]),
+                    "bypass (all)": session.bypass,
+                    "bypass (models)": lambda: session.bypass(models=[Author]),
+                }
+                # Warm up (connection, statement caches) before timing anything.
+                Author.objects.bulk_create(
+                    [Author(name=str(n)) for n in range(args.batch_size)]
+                )
+                for label, mode in modes.items():
+                    start = time.perf_counter()
+                    with transaction.atomic(), mode():
+                        Author.objects.bulk_create(
+                            [Author(name=str(n)) for n in range(args.rows)],
+                            batch_size=args.batch_size,
+                        )
+                    report(label, args.rows, time.perf_counter() - start)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,74 @@
+"""
+Measures history insert throughput with many concurrent writers, comparing the default
+history table against `AbstractAppendOnlyObjectHistory` with the "append" storage
+profile. PostgreSQL only.
+
+    uv run python -m benchmarks.concurrency --writers 64 --rows 500
+"""
+
+import argparse
+import threading
+import time
+
+from benchmarks import report, setup, test_database, triggers
+
+CONFIGURATIONS = [
+    ("default", {"HISTORY_MODEL": "testapp.CustomHistory"}),
+    (
+        "append-optimized",
+        {
+            "HISTORY_MODEL": "testapp.AppendHistory",
+            "HISTORY_STORAGE_PROFILE": "append",
+        },
+    ),
+]
+
+
+def writer(rows, barrier):
+    from django.db import connection
+
+    from history import get_backend
+    from testapp.models import Author
+
+    try:
+        with get_backend().session(username="benchmark"):
+            barrier.wait()
+            for num in range(rows):
+                Author.objects.create(name="Author {}".format(num))
+    finally:
+        connection.close()
+
+
+def run(label, writers, rows, settings):
+    with triggers(**settings):
+        barrier = threading.Barrier(writers + 1)
+        threads = [
+            threading.Thread(target=writer, args=(rows, barrier))
+            for _ in range(writers)
+        ]
+        for t in threads:
+            t.start()
+        barrier.wait()
+        start = time.perf_counter()
+        for t in threads:
+            t.join()
+        report(label, writers * rows, time.perf_counter() - start)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("-w", "--writers", type=int, default=64)
+    parser.add_argument("-r", "--rows", type=int, default=200)
+    args = parser.parse_args()
+    setup()
+    from django.db import connection
+
+    if connection.vendor != "postgresql":
+        parser.exit(1, "The concurrency benchmark requires PostgreSQL.\n")
+    with test_database():
+        for label, settings in CONFIGURATIONS:
+            run(label, args.writers, args.rows, settings)
+
+
+if __name__ == "__main__":
+    main()
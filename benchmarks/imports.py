@@ -0,0 +1,91 @@
+"""
+Measures startup cost: the time to run `django.setup()` (with the test project) in a
+fresh interpreter, how much of the import time (from `python -X importtime`) is spent
+in `history` modules, and the cost of reading settings through `history.conf`.
+
+    uv run python -m benchmarks.imports --runs 20
+"""
+
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+import time
+
+from benchmarks import report, setup
+
+CHILD = """
+import time
+start = time.perf_counter()
+import django
+django.setup()
+print(time.perf_counter() - start)
+"""
+
+
+def run_child(*args):
+    env = {**os.environ, "DJANGO_SETTINGS_MODULE": "testapp.settings"}
+    return subprocess.run(
+        [sys.executable, *args, "-c", CHILD],
+        env=env,
+        capture_output=True,
+        text=True,
+        check=True,
+    )
+
+
+def history_import_time(result):
+    """
+    Returns the total self time (in seconds) of `history` modules, from the
+    `-X importtime` output of a child process.
+    """
+    total = 0
+    for line in result.stderr.splitlines():
+        if not line.startswith("import time:"):
+            continue
+        parts = line.split("|")
+        name = parts[-1].strip()
+        if name == "history" or name.startswith("history."):
+            total += int(parts[0].split(":")[1])
+    return total / 1e6
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("-r", "--runs", type=int, default=10)
+    parser.add_argument("-n", "--reads", type=int, default=1000000)
+    args = parser.parse_args()
+
+    setups = []
+    history_imports = []
+    for _ in range(args.runs):
+        setups.append(float(run_child().stdout))
+        history_imports.append(history_import_time(run_child("-X", "importtime")))
+    print(
+        json.dumps(
+            {
+                "django.setup() (median)": "{:.1f}ms".format(
+                    statistics.median(setups) * 1000
+                ),
+                "history imports (median)": "{:.1f}ms".format(
+                    statistics.median(history_imports) * 1000
+                ),
+            },
+            indent=2,
+        )
+    )
+
+    setup()
+    from history import conf
+
+    start = time.perf_counter()
+    for _ in range(args.reads):
+        conf.SNAPSHOTS
+        conf.MIDDLEWARE_IGNORE
+    report("conf reads", args.reads * 2, time.perf_counter() - start, "reads")
+
+
+if __name__ == "__main__":
+    main()
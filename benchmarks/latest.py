@@ -0,0 +1,60 @@
+"""
+Compares annotating objects with their latest change (`LatestHistory`) from the history
+table and from the `HISTORY_LATEST` summary table, along with the cost of maintaining
+the summary table on updates.
+
+    uv run python -m benchmarks.latest --objects 2000 --updates 20
+"""
+
+import argparse
+import time
+
+from benchmarks import report, setup, test_database, triggers
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("-o", "--objects", type=int, default=2000)
+    parser.add_argument("-u", "--updates", type=int, default=20)
+    parser.add_argument("-r", "--reads", type=int, default=20)
+    args = parser.parse_args()
+    setup()
+    from history import get_backend
+    from history.models import LatestHistory
+    from testapp.models import Author
+
+    with test_database():
+        for latest in (False, True):
+            label = "summary" if latest else "history"
+            with triggers(HISTORY_MODEL="testapp.CustomHistory", HISTORY_LATEST=latest):
+                with get_backend().session(username="benchmark"):
+                    Author.objects.all().delete()
+                    Author.objects.bulk_create(
+                        [Author(name=str(n)) for n in range(args.objects)]
+                    )
+                    ids = list(Author.objects.values_list("pk", flat=True))
+                    start = time.perf_counter()
+                    for num in range(args.updates):
+                        for pk in ids:
+                            Author.objects.filter(pk=pk).update(name=str(num))
+                    count = len(ids) * args.updates
+                    report(
+                        "update ({})".format(label), count, time.perf_counter() - start
+                    )
+                    authors = Author.objects.annotate(
+                        modified_by=LatestHistory("username"),
+                        modified=LatestHistory("session_date"),
+                    )
+                    start = time.perf_counter()
+                    for _ in range(args.reads):
+                        list(authors.values_list("pk", "modified_by", "modified"))
+                    count = len(ids) * args.reads
+                    report(
+                        "annotate ({})".format(label),
+                        count,
+                        time.perf_counter() - start,
+                    )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,49 @@
+"""
+Measures rebuilding many-to-many relations (`book.authors.set(...)`) with history
+recorded per link row (`HISTORY_M2M="rows"`) and on the parent object
+(`HISTORY_M2M="parent"`), and the number of history rows written.
+
+    uv run python -m benchmarks.m2m --books 200 --authors 100
+"""
+
+import argparse
+import time
+
+from benchmarks import report, setup, test_database, triggers
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("-b", "--books", type=int, default=200)
+    parser.add_argument("-a", "--authors", type=int, default=100)
+    args = parser.parse_args()
+    setup()
+    from history import get_backend
+    from testapp.models import Author, Book
+
+    with test_database():
+        authors = Author.objects.bulk_create(
+            [Author(name=str(n)) for n in range(args.authors * 2)]
+        )
+        books = Book.objects.bulk_create(
+            [Book(title=str(n)) for n in range(args.books)]
+        )
+        half = len(authors) // 2
+        for mode in ("rows", "parent"):
+            with triggers(HISTORY_MODEL="testapp.CustomHistory", HISTORY_M2M=mode):
+                with get_backend().session(username="benchmark") as session:
+                    start = time.perf_counter()
+                    for book in books:
+                        book.authors.set(authors[:half])
+                    for book in books:
+                        book.authors.set(authors[half:])
+                    elapsed = time.perf_counter() - start
+                    links = args.books * args.authors * 3
+                    report("set ({})".format(mode), links, elapsed, "links")
+                    print("history rows ({}): {}".format(mode, session.history.count()))
+                    for book in books:
+                        book.authors.clear()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,58 @@
+"""
+Compares counting changes per day, model, change type, and user by grouping the history
+table against reading the `HistoryRollup` table, and measures `rollup()`.
+Requires `history.contrib.rollups` in `INSTALLED_APPS` (as in the test project).
+
+    uv run python -m benchmarks.rollup --sessions 500 --rows 200
+"""
+
+import argparse
+import time
+
+from benchmarks import report, setup, test_database, triggers
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("-s", "--sessions", type=int, default=500)
+    parser.add_argument("-r", "--rows", type=int, default=200)
+    parser.add_argument("-q", "--queries", type=int, default=20)
+    args = parser.parse_args()
+    setup()
+    from django.db.models import Count
+    from django.db.models.functions import TruncDate
+
+    from history import get_backend, get_history_model
+    from history.contrib.rollups.models import HistoryRollup
+    from history.contrib.rollups.utils import rollup
+    from testapp.models import Author
+
+    with test_database():
+        with triggers(HISTORY_FEED=True):
+            for num in range(args.sessions):
+                with get_backend().session(user=num % 20):
+                    Author.objects.bulk_create(
+                        [Author(name=str(n)) for n in range(args.rows)]
+                    )
+            count = args.sessions * args.rows
+            start = time.perf_counter()
+            rollup(batch_size=5000)
+            report("rollup", count, time.perf_counter() - start)
+            keys = ("day", "content_type", "change_type", "user")
+            history = get_history_model().objects.values(
+                "content_type", "change_type", "user", day=TruncDate("session_date")
+            )
+            start = time.perf_counter()
+            for _ in range(args.queries):
+                list(history.annotate(total=Count("id")).order_by(*keys))
+            report(
+                "group history", args.queries, time.perf_counter() - start, "queries"
+            )
+            start = time.perf_counter()
+            for _ in range(args.queries):
+                list(HistoryRollup.objects.totals(*keys))
+            report("read rollups", args.queries, time.perf_counter() - start, "queries")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,71 @@
+"""
+Compares recording history with session context on every row (`CustomHistory`) and in
+a separate session table (`SessionHistory`, see `AbstractHistorySession`), including
+the size of the history tables on PostgreSQL.
+
+    uv run python -m benchmarks.sessions --sessions 200 --rows 200
+"""
+
+import argparse
+import time
+
+from benchmarks import report, setup, test_database, triggers
+
+
+def table_size(connection, *tables):
+    if connection.vendor != "postgresql":
+        return None
+    with connection.cursor() as cursor:
+        cursor.execute(
+            "SELECT sum(pg_total_relation_size(t)) FROM unnest(%s::regclass[]) t",
+            [list(tables)],
+        )
+        return cursor.fetchone()[0]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("-s", "--sessions", type=int, default=200)
+    parser.add_argument("-r", "--rows", type=int, default=200)
+    args = parser.parse_args()
+    setup()
+    from django.db import connection
+
+    from history import get_backend
+    from testapp.models import Author
+
+    modes = {
+        "per row": ("testapp.CustomHistory", ["custom_history"]),
+        "session table": (
+            "testapp.SessionHistory",
+            ["session_history", "history_session"],
+        ),
+    }
+    with test_database():
+        for label, (model, tables) in modes.items():
+            with triggers(HISTORY_MODEL=model):
+                start = time.perf_counter()
+                for num in range(args.sessions):
+                    context = {
+                        "username": "user{}@example.com".format(num % 10),
+                        "extra": "Mozilla/5.0 (X11; Linux x86_64) 192.0.2.{}".format(
+                            num % 250
+                        ),
+                    }
+                    with get_backend().session(**context):
+                        Author.objects.bulk_create(
+                            [Author(name=str(n)) for n in range(args.rows)]
+                        )
+                count = args.sessions * args.rows
+                report(label, count, time.perf_counter() - start)
+                with connection.cursor() as cursor:
+                    cursor.execute("ANALYZE")
+                size = table_size(connection, *tables)
+                if size:
+                    print("{:<30} {:>10.1f} bytes/row".format(label, size / count))
+                with get_backend().session(username="benchmark"):
+                    Author.objects.all().delete()
+
+
+if __name__ == "__main__":
+    main()
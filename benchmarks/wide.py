@@ -0,0 +1,69 @@
+"""
+Measures update throughput on a wide table (many tracked columns), where computing the
+changes for each updated row dominates the cost of recording history.
+
+    TEST_ENGINE=sqlite uv run python -m benchmarks.wide --columns 80 --rows 2000
+
+On SQLite 3.45+, `--jsonb` stores history as JSONB (see `HISTORY_SQLITE_JSONB`).
+"""
+
+import argparse
+import time
+
+from benchmarks import report, setup, test_database, triggers
+
+
+def wide_model(columns):
+    from django.db import models
+
+    attrs = {
+        "__module__": "testapp.models",
+        "Meta": type("Meta", (), {"app_label": "testapp", "db_table": "wide"}),
+    }
+    for num in range(columns):
+        if num % 2:
+            attrs["text{}".format(num)] = models.CharField(max_length=50, default="")
+        else:
+            attrs["number{}".format(num)] = models.IntegerField(default=0)
+    return type("Wide", (models.Model,), attrs)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("-c", "--columns", type=int, default=80)
+    parser.add_argument("-r", "--rows", type=int, default=2000)
+    parser.add_argument("--jsonb", action="store_true")
+    args = parser.parse_args()
+    setup()
+    from history import get_backend
+
+    # Defined before the test database is set up, which creates its table.
+    Wide = wide_model(args.columns)
+    with test_database():
+        with triggers(
+            HISTORY_MODEL="testapp.CustomHistory", HISTORY_SQLITE_JSONB=args.jsonb
+        ):
+            with get_backend().session(username="benchmark") as session:
+                Wide.objects.bulk_create([Wide() for _ in range(args.rows)])
+                ids = list(Wide.objects.values_list("pk", flat=True))
+                # One changed column per update, the common case.
+                start = time.perf_counter()
+                for pk in ids:
+                    Wide.objects.filter(pk=pk).update(number0=pk)
+                report("update (1 changed)", len(ids), time.perf_counter() - start)
+                text = [f.name for f in Wide._meta.fields if f.name.startswith("text")]
+                start = time.perf_counter()
+                for pk in ids:
+                    Wide.objects.filter(pk=pk).update(
+                        **{name: str(pk) for name in text}
+                    )
+                report("update (half changed)", len(ids), time.perf_counter() - start)
+                start = time.perf_counter()
+                count = sum(
+                    1 for _ in session.history.values_list("snapshot", "changes")
+                )
+                report("read", count, time.perf_counter() - start)
+
+
+if __name__ == "__main__":
+    main()
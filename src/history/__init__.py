@@ -1,14 +1,34 @@
-import importlib.metadata
+import importlib
 
 from django.conf import settings
+from django.core.signals import setting_changed
 
-from .backends import get_backend, session  # noqa
-from .utils import get_history_model  # noqa
+# These are imported on first access, so that importing `history` (which Django does
+# for every process, when loading INSTALLED_APPS) stays cheap.
+_exports = {
+    "get_backend": "history.backends",
+    "session": "history.backends",
+    "statement": "history.backends",
+    "get_history_model": "history.utils",
+    "get_history_models": "history.utils",
+}
 
-__version__ = importlib.metadata.version("django-history-triggers")
-__version_info__ = tuple(
-    int(num) if num.isdigit() else num for num in __version__.split(".")
-)
+
+def _version_info(version):
+    return tuple(int(num) if num.isdigit() else num for num in version.split("."))
+
+
+def __getattr__(name):
+    if name in _exports:
+        return getattr(importlib.import_module(_exports[name]), name)
+    if name in ("__version__", "__version_info__"):
+        # Looking up package metadata scans sys.path, so only do it when asked.
+        from importlib import metadata
+
+        version = metadata.version("django-history-triggers")
+        globals().update(__version__=version, __version_info__=_version_info(version))
+        return globals()[name]
+    raise AttributeError("module {!r} has no attribute {!r}".format(__name__, name))
 
 
 class _Configuration:
@@ -17,10 +37,18 @@ class _Configuration:
         self.defaults = defaults
 
     def __getattr__(self, name):
+        # Only called the first time a setting is read, after which the value is set
+        # on the instance until the settings change (see `reset`).
         if name not in self.defaults:
             raise AttributeError(name)
         setting_name = "{}_{}".format(self.prefix, name).upper()
-        return getattr(settings, setting_name, self.defaults[name])
+        value = getattr(settings, setting_name, self.defaults[name])
+        setattr(self, name, value)
+        return value
+
+    def reset(self):
+        for name in self.defaults:
+            self.__dict__.pop(name, None)
 
 
 conf = _Configuration(
@@ -34,4 +62,27 @@ conf = _Configuration(
     MIGRATE_CONTEXT={},
     LOADDATA_CONTEXT={},
     INCLUDE_UNMANAGED=True,
+    DEFERRED=False,
+    STORAGE_PROFILE=None,
+    ROUTES={},
+    BACKEND=None,
+    COMPRESSION=None,
+    MAX_VALUE_SIZE=None,
+    CHANGES_INDEX=None,
+    MODEL="history.ObjectHistory",
+    MIDDLEWARE_DATABASES=None,
+    SQLITE_JSONB=False,
+    SQLITE_ATTACH=None,
+    M2M="rows",
+    FEED=False,
+    FEED_NOTIFY=False,
+    LATEST=False,
 )
+
+
+def _reset_configuration(setting, **kwargs):
+    if setting.startswith("{}_".format(conf.prefix.upper())):
+        conf.reset()
+
+
+setting_changed.connect(_reset_configuration)
@@ -5,11 +5,10 @@ from django.core.exceptions import PermissionDenied
 from django.template.response import TemplateResponse
 from django.utils.translation import gettext_lazy as _
 
-from history import conf, get_history_model
+from history import get_history_model, get_history_models
+from history.models import session_relation
 from history.templatetags.history import format_json
 
-HistoryModel = get_history_model()
-
 
 class HistoryAdminMixin:
     actions = ["show_history"]
@@ -18,13 +17,14 @@ class HistoryAdminMixin:
     def show_history(self, request, queryset, extra_context=None):
         model_class = queryset.model
         ct = ContentType.objects.db_manager(queryset._db).get_for_model(model_class)
-        object_history = (
-            get_history_model()
-            .objects.filter(
-                content_type=ct, object_id__in=queryset.values_list("pk", flat=True)
-            )
-            .order_by("session_date")
-        )
+        HistoryModel = get_history_model(model_class)
+        object_history = HistoryModel.objects.filter(
+            content_type=ct, object_id__in=queryset.values_list("pk", flat=True)
+        ).order_by("session_date")
+        relation = session_relation(HistoryModel)
+        if relation is not None:
+            # Each entry's user is read from its session.
+            object_history = object_history.select_related(relation.name)
 
         context = {
             **self.admin_site.each_context(request),
@@ -73,6 +73,11 @@ class ObjectHistoryAdmin(admin.ModelAdmin):
 
     changes_html.short_description = _("Changes")
 
+    def user(self, obj):
+        return obj.get_user()
+
+    user.short_description = _("User")
+
     def get_readonly_fields(self, request, obj=None):
         fields = [
             "id",
@@ -84,8 +89,10 @@ class ObjectHistoryAdmin(admin.ModelAdmin):
             "snapshot_html",
             "changes_html",
         ]
-        if HistoryModel.USER_FIELD:
-            fields.append(HistoryModel.USER_FIELD)
+        if self.model.USER_FIELD:
+            fields.append(self.model.USER_FIELD)
+        elif session_relation(self.model):
+            fields.append("user")
         if obj and obj.change_type in ("I", "D"):
             fields.remove("changes_html")
         return fields
@@ -100,5 +107,12 @@ class ObjectHistoryAdmin(admin.ModelAdmin):
         return False
 
 
-if conf.ADMIN_ENABLED:
-    admin.site.register(HistoryModel, ObjectHistoryAdmin)
+def register(site=admin.site):
+    """
+    Registers `ObjectHistoryAdmin` for each history model in use. This is called once
+    the app registry is ready (if `HISTORY_ADMIN_ENABLED`), rather than when this
+    module is imported.
+    """
+    for HistoryModel in get_history_models():
+        if not site.is_registered(HistoryModel):
+            site.register(HistoryModel, ObjectHistoryAdmin)
@@ -0,0 +1,13 @@
+from django.apps import AppConfig, apps
+
+
+class HistoryConfig(AppConfig):
+    name = "history"
+
+    def ready(self):
+        from history import backends, conf  # noqa: F401 (connects connection_created)
+
+        if conf.ADMIN_ENABLED and apps.is_installed("django.contrib.admin"):
+            from history.admin import register
+
+            register()
@@ -1,14 +1,118 @@
+import threading
+import weakref
+
 from asgiref.local import Local
 from django.conf import settings
+from django.core.signals import setting_changed
 from django.db import DEFAULT_DB_ALIAS
+from django.db.backends.signals import connection_created
+from django.dispatch import receiver
+from django.utils.module_loading import import_string
 
 backend_cache = Local()
 
+# The current session for each database alias, per thread and per asyncio task.
+current_sessions = Local()
+
+# Statements that don't start a lazy session. Anything else (including CTEs, COPY, and
+# calling procedures) does, but not a SELECT of a function that writes.
+READ_STATEMENTS = ("SELECT", "SAVEPOINT", "RELEASE", "ROLLBACK")
+
+# Connections (which are thread-local) that may be used by sync code called from async
+# sessions, and the number of async sessions waiting for a write on each alias. See
+# `watch_connections`.
+open_connections = weakref.WeakSet()
+waiting_sessions = {}
+waiting_lock = threading.Lock()
+
+
+def is_write(sql):
+    return not sql.lstrip()[:9].upper().startswith(READ_STATEMENTS)
+
+
+def start_session_on_write(execute, sql, params, many, context):
+    """
+    A database execute wrapper for async sessions, which starts the current session (of
+    the calling task) before the first write made with it. Only installed on connections
+    while an async session is waiting for a write, and removes itself after.
+    """
+    conn = context["connection"]
+    if not waiting_sessions.get(conn.alias):
+        with waiting_lock:
+            if not waiting_sessions.get(conn.alias):
+                conn.execute_wrappers.remove(start_session_on_write)
+    else:
+        session = getattr(current_sessions, conn.alias, None)
+        if session is not None:
+            return session.start_on_write(execute, sql, params, many, context)
+    return execute(sql, params, many, context)
+
+
+def watch_connections(alias):
+    """
+    Installs `start_session_on_write` on the connections for `alias` of every thread,
+    since an async session doesn't know which thread its sync code will run in. It is
+    inserted first, so it doesn't get in the way of `connection.execute_wrapper()`
+    blocks in those threads. Each call must be followed by `unwatch_connections`.
+    """
+    with waiting_lock:
+        waiting_sessions[alias] = waiting_sessions.get(alias, 0) + 1
+        for conn in open_connections:
+            if (
+                conn.alias == alias
+                and start_session_on_write not in conn.execute_wrappers
+            ):
+                conn.execute_wrappers.insert(0, start_session_on_write)
+
+
+def unwatch_connections(alias):
+    with waiting_lock:
+        waiting_sessions[alias] -= 1
+
+
+@receiver(connection_created)
+def track_connection(sender, connection, **kwargs):
+    # Any session context is lost when reconnecting.
+    connection.history_session = None
+    with waiting_lock:
+        open_connections.add(connection)
+        if (
+            waiting_sessions.get(connection.alias)
+            and start_session_on_write not in connection.execute_wrappers
+        ):
+            connection.execute_wrappers.insert(0, start_session_on_write)
+
+
+@receiver(connection_created)
+def attach_history_database(sender, connection, **kwargs):
+    # ATTACH is not allowed within a transaction, so is done when connecting.
+    from history import conf
+
+    if connection.vendor == "sqlite" and conf.SQLITE_ATTACH not in (
+        None,
+        connection.alias,
+    ):
+        get_backend(connection.alias).attach(connection)
+
+
+@receiver(setting_changed)
+def reset_backends(setting, **kwargs):
+    # Backends cache things derived from settings, such as the session fields.
+    if setting.startswith("HISTORY_") or setting == "DATABASES":
+        for alias in settings.DATABASES:
+            if hasattr(backend_cache, alias):
+                delattr(backend_cache, alias)
+
 
 def get_backend(alias=DEFAULT_DB_ALIAS, cls=None, cache=True):
     if cache and hasattr(backend_cache, alias):
         return getattr(backend_cache, alias)
 
+    from history import conf
+
+    if cls is None and conf.BACKEND:
+        cls = conf.BACKEND if callable(conf.BACKEND) else import_string(conf.BACKEND)
+
     if cls:
         backend = cls(alias)
     else:
@@ -32,3 +136,13 @@ def get_backend(alias=DEFAULT_DB_ALIAS, cls=None, cache=True):
 
 def session(alias=DEFAULT_DB_ALIAS, **context):
     return get_backend(alias).session(**context)
+
+
+def statement(alias=DEFAULT_DB_ALIAS):
+    """
+    Returns a statement (see `HistorySession.statement`) within the current session.
+    """
+    current = get_backend(alias).current_session
+    if current is None:
+        raise RuntimeError("history.statement() must be used within a session.")
+    return current.statement()
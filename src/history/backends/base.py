@@ -1,46 +1,193 @@
 import contextlib
+import datetime
 import functools
+import json
+import time
 import uuid
 
+from asgiref.sync import iscoroutinefunction, sync_to_async
 from django.apps import apps
-from django.db import connections
+from django.contrib.contenttypes.models import ContentType
+from django.core.exceptions import FieldDoesNotExist, ImproperlyConfigured
+from django.core.serializers.json import DjangoJSONEncoder
+from django.db import connections, models, transaction
 from django.db.backends.utils import split_identifier, truncate_name
 from django.utils import timezone
+from django.utils.functional import cached_property
 from django.utils.module_loading import import_string
 
-from history import conf, get_history_model
-from history.models import AbstractObjectHistory
+from history import conf, get_history_model, get_history_models
+from history.models import (
+    AbstractHistorySession,
+    AbstractObjectHistory,
+    TriggerType,
+    TruncatedValue,
+    session_relation,
+)
+
+from . import current_sessions, is_write, unwatch_connections, watch_connections
+
+
+def pk_fields(model):
+    """
+    Returns the fields of a model's primary key, which has more than one field for
+    composite primary keys (Django 5.2+).
+    """
+    return getattr(model._meta, "pk_fields", [model._meta.pk])
+
+
+def has_field(model, name):
+    """
+    Returns whether `model` has a field called `name`, for the optional history model
+    fields (such as `statement_id`).
+    """
+    try:
+        model._meta.get_field(name)
+    except FieldDoesNotExist:
+        return False
+    return True
+
+
+def is_compatible(pk, object_id):
+    """
+    Returns whether values of the `pk` field can be stored in the `object_id` field of
+    a history model.
+    """
+    if isinstance(object_id, (models.CharField, models.TextField)):
+        return True
+    if pk.is_relation:
+        # Multi-table inheritance children use a parent link as their primary key.
+        pk = pk.target_field
+    if isinstance(object_id, models.IntegerField):
+        return isinstance(pk, models.IntegerField)
+    return pk.get_internal_type() == object_id.get_internal_type()
+
+
+def relation_ops(change):
+    """
+    Yields `(key, value)` for each related ID in a many-to-many change (see
+    `HISTORY_M2M`), where `key` is "removed" or "added", in the order they were applied.
+    """
+    for key in ("removed", "added"):
+        for value in change.get(key, []):
+            yield key, value
+
+
+def context_value(value):
+    """
+    Returns a session context value as it is recorded, using the primary key of model
+    instances.
+    """
+    if hasattr(value, "pk"):
+        # This also covers AnonymousUser, which is not a Model instance.
+        return value.pk
+    if isinstance(value, uuid.UUID):
+        return value.hex
+    return value
 
 
 class HistorySession:
     def __init__(self, backend, **fields):
         self.backend = backend
         self.parent = None
-        self.fields = {}
-        # Sanitize based on session fields in the object history model.
-        for field in backend.session_fields():
-            value = fields.get(field.name)
-            if hasattr(value, "pk"):
-                # This also covers AnonymousUser, which is not a Model instance.
-                value = value.pk
-            elif isinstance(value, uuid.UUID):
-                value = value.hex
+        # Whether the session context has been set on the connection. Lazy sessions are
+        # only started before their first write (see `start_on_write`).
+        self.active = False
+        # Whether the session context was recorded in session models (see `record`).
+        self.recorded = False
+        # The session fields as passed in, which are sanitized lazily (see `fields`).
+        self.context = fields
+        # What is paused, see `update_paused`.
+        self.paused_all = False
+        self.paused_types = set()
+        if self.context.get("session_id") is None:
+            self.context["session_id"] = uuid.uuid4().hex
+        if self.context.get("session_date") is None:
+            self.context["session_date"] = timezone.now().isoformat()
+
+    @cached_property
+    def fields(self):
+        # Sanitize based on session fields in the object history model. This is done
+        # lazily, so that evaluating a lazy `request.user` happens when the session is
+        # started, which is always in a synchronous context.
+        fields = {}
+        for field in self.backend.session_fields():
+            value = context_value(self.context.get(field.name))
             if value is not None:
-                self.fields[field.name] = value
-        self.fields.setdefault("session_id", uuid.uuid4().hex)
-        self.fields.setdefault("session_date", timezone.now().isoformat())
+                fields[field.name] = value
+        return fields
 
     @property
     def session_id(self):
-        return uuid.UUID(self.fields["session_id"])
+        value = self.context["session_id"]
+        return value if isinstance(value, uuid.UUID) else uuid.UUID(value)
+
+    @property
+    def statement_id(self):
+        value = self.context.get("statement_id")
+        if value is None or isinstance(value, uuid.UUID):
+            return value
+        return uuid.UUID(value)
+
+    def filter_history(self, qs):
+        qs = qs.filter(session_id=self.session_id)
+        if self.statement_id:
+            if not has_field(qs.model, "statement_id"):
+                raise ImproperlyConfigured(
+                    "{} has no statement_id field (see StatementHistoryMixIn).".format(
+                        qs.model._meta.label
+                    )
+                )
+            qs = qs.filter(statement_id=self.statement_id)
+        return qs
 
     @property
     def history(self):
-        return (
-            get_history_model()
+        """
+        History recorded in this session, in the default history model. A queryset only
+        covers one table, so history for models routed elsewhere (see `HISTORY_ROUTES`)
+        is returned by `history_for`.
+        """
+        return self.filter_history(
+            get_history_model().objects.using(self.backend.alias)
+        )
+
+    def history_for(self, model):
+        """
+        Returns history recorded in this session for the specified model, from the
+        history model it is routed to.
+        """
+        ct = ContentType.objects.db_manager(self.backend.alias).get_for_model(model)
+        return self.filter_history(
+            get_history_model(model)
             .objects.using(self.backend.alias)
-            .filter(session_id=self.session_id)
+            .filter(content_type=ct)
+        )
+
+    def revert(self, **context):
+        """
+        Reverts the changes recorded in this session (see `HistoryBackend.revert`).
+        """
+        return self.backend.revert(
+            *(
+                self.filter_history(HistoryModel.objects.using(self.backend.alias))
+                for HistoryModel in get_history_models()
+            ),
+            **context,
+        )
+
+    def statement(self):
+        """
+        Returns a nested session with the same context (and session_id) as this one,
+        that tags the history recorded within it with a new statement_id. Updates within
+        a statement only record changes, not snapshots.
+        """
+        statement = self.backend.session(
+            **{**self.context, "statement_id": uuid.uuid4()}
         )
+        # The shared context only needs to be recorded once.
+        statement.recorded = self.recorded
+        return statement
 
     def start_sql(self):
         raise NotImplementedError()
@@ -48,39 +195,182 @@ class HistorySession:
     def stop_sql(self):
         raise NotImplementedError()
 
+    @cached_property
+    def start_statement(self):
+        # Bound once, since a parent session is restarted after each nested session.
+        return self.start_sql()
+
+    @cached_property
+    def stop_statement(self):
+        return self.stop_sql()
+
     def start(self):
-        self.backend.execute(*self.start_sql())
+        if not self.backend.conn.needs_rollback:
+            self.backend.execute(*self.start_statement)
 
     def stop(self):
-        self.backend.execute(*self.stop_sql())
+        # Nothing can run in a transaction that failed, but session settings changed
+        # within it are reverted when it is rolled back, which restores those of any
+        # parent session.
+        if not self.backend.conn.needs_rollback:
+            self.backend.execute(*self.stop_statement)
+
+    def activate(self):
+        conn = connections[self.backend.alias]
+        # Set first, so statements run while starting don't start it again.
+        conn.history_session = self
+        try:
+            self.start()
+            if not self.recorded:
+                self.record()
+                self.recorded = True
+        except Exception:
+            conn.history_session = None
+            raise
+        self.active = True
+
+    def start_on_write(self, execute, sql, params, many, context):
+        """
+        A database execute wrapper that starts this session, if it is the current one,
+        right before the first statement made with it that may write. Tasks may share a
+        connection, so it is also restarted if another one was started on it since.
+        """
+        conn = context["connection"]
+        if (
+            getattr(conn, "history_session", None) is not self
+            and self.backend.current_session is self
+            and is_write(sql)
+        ):
+            self.activate()
+        return execute(sql, params, many, context)
+
+    def deactivate(self):
+        self.stop()
+        self.active = False
+        conn = connections[self.backend.alias]
+        if getattr(conn, "history_session", None) is self:
+            conn.history_session = None
 
-    def pause(self):
+    def pause(self, models=None):
         raise NotImplementedError()
 
-    def resume(self):
+    def resume(self, models=None):
         raise NotImplementedError()
 
     @contextlib.contextmanager
-    def paused(self):
+    def paused(self, models=None):
+        """
+        Pauses recording history (for `models`, or all models) within the block.
+        """
         try:
-            yield self.pause()
+            yield self.pause(models)
         finally:
-            self.resume()
+            self.resume(models)
 
-    def __enter__(self):
+    def update_paused(self, models, paused):
+        """
+        Pauses (or resumes) `models`, or all models if None, and returns either True if
+        all models are paused, or the set of paused content type IDs.
+        """
+        if models is None:
+            self.paused_all = paused
+        else:
+            content_types = ContentType.objects.db_manager(
+                self.backend.alias
+            ).get_for_models(*models)
+            ct_ids = {ct.pk for ct in content_types.values()}
+            if paused:
+                self.paused_types |= ct_ids
+            else:
+                self.paused_types -= ct_ids
+        return True if self.paused_all else self.paused_types
+
+    @contextlib.contextmanager
+    def bypass(self, models=None):
+        """
+        Disables the history triggers of `models` (or of all models) within the block,
+        so writes don't invoke them at all. The block runs in a transaction (or a
+        savepoint), so the triggers are also restored if it fails.
+        """
+        with transaction.atomic(using=self.backend.alias):
+            restore = self.backend.disable_triggers(models)
+            yield
+            for sql, params in restore:
+                self.backend.execute(sql, params)
+
+    def enter(self, lazy=False):
         self.parent = self.backend.current_session
         self.backend.current_session = self
-        self.start()
+        if not lazy:
+            self.activate()
+
+    def exit(self):
+        self.backend.current_session = self.parent
+
+    def record(self):
+        """
+        Records the session context in session models (see `AbstractHistorySession`),
+        when the session is first started. This session is made current while doing so,
+        so the insert doesn't start a parent session.
+        """
+        parent = self.backend.current_session
+        self.backend.current_session = self
+        try:
+            self.backend.record_session(self)
+        finally:
+            self.backend.current_session = parent
+
+    def restore(self):
+        self.deactivate()
+        if self.parent and self.parent.active:
+            # Restart the parent session that we were nested within.
+            self.parent.activate()
+
+    def __enter__(self):
+        self.enter()
         return self
 
+    @contextlib.contextmanager
+    def lazily(self):
+        """
+        Enters this session without starting it. It is started right before the first
+        write made on its database connection within the block, if any.
+        """
+        self.enter(lazy=True)
+        try:
+            with connections[self.backend.alias].execute_wrapper(self.start_on_write):
+                yield self
+        finally:
+            self.__exit__()
+
     def __exit__(self, *exc_details):
-        self.stop()
-        if self.parent:
-            # Restart the parent session that we were nested within.
-            self.parent.start()
-        self.backend.current_session = self.parent
+        self.exit()
+        if self.active:
+            self.restore()
+
+    async def __aenter__(self):
+        # The connection this task's sync code will use is not known yet.
+        watch_connections(self.backend.alias)
+        self.enter(lazy=True)
+        return self
+
+    async def __aexit__(self, *exc_details):
+        self.exit()
+        unwatch_connections(self.backend.alias)
+        if self.active:
+            # Only hop to a thread when there was a write to clean up after.
+            await sync_to_async(self.restore)()
 
     def __call__(self, func):
+        if iscoroutinefunction(func):
+
+            @functools.wraps(func)
+            async def awrapped(*args, **kwargs):
+                async with self:
+                    return await func(*args, **kwargs)
+
+            return awrapped
+
         @functools.wraps(func)
         def wrapped(*args, **kwargs):
             with self:
@@ -91,14 +381,31 @@ class HistorySession:
 
 class HistoryBackend:
     session_class = HistorySession
+    # How the database formats JSON arrays as text, used for composite object IDs.
+    json_separators = (", ", ": ")
+    # Maximum number of rows per statement when reverting.
+    revert_batch_size = 1000
+    # Rough size (in bytes) of a history row, not counting the snapshot or changes.
+    history_row_size = 100
 
     def __init__(self, alias):
         self.alias = alias
-        self.current_session = None
+        self.captured = None
+        self._session_fields = {}
+        self._session_models = None
+        self._models = None
         self.filter = (
             conf.FILTER if callable(conf.FILTER) else import_string(conf.FILTER)
         )
 
+    @property
+    def current_session(self):
+        return getattr(current_sessions, self.alias, None)
+
+    @current_session.setter
+    def current_session(self, session):
+        setattr(current_sessions, self.alias, session)
+
     @property
     def conn(self):
         c = connections[self.alias]
@@ -106,26 +413,530 @@ class HistoryBackend:
         return c
 
     def install(self):
-        pass
+        for HistoryModel in get_history_models():
+            self.create_statement_index(HistoryModel)
 
     def remove(self):
         pass
 
+    def create_statement_index(self, HistoryModel):
+        """
+        Creates a partial index on statement_id, which is only set for history recorded
+        in a statement (see `HistorySession.statement`), if `HistoryModel` has one.
+        """
+        if not has_field(HistoryModel, "statement_id"):
+            return
+        table = HistoryModel._meta.db_table
+        self.execute(
+            "CREATE INDEX IF NOT EXISTS {name} ON {table} ({column}) "
+            "WHERE {column} IS NOT NULL;".format(
+                name=truncate_name("{}_statement".format(split_identifier(table)[1])),
+                table=table,
+                column=HistoryModel._meta.get_field("statement_id").column,
+            )
+        )
+
+    def flush(self):
+        """
+        Writes any history that has been captured but not yet recorded in the current
+        transaction. Only meaningful for backends that support `HISTORY_DEFERRED`.
+        """
+        pass
+
+    def rollup_models(self):
+        """
+        Returns the models of `history.contrib.rollups`, if it is installed.
+        """
+        if not apps.is_installed("history.contrib.rollups"):
+            return []
+        return list(apps.get_app_config("history_rollups").get_models())
+
     def clear(self):
-        get_history_model().objects.using(self.alias).all().delete()
+        for HistoryModel in get_history_models():
+            HistoryModel.objects.using(self.alias).all().delete()
+        for model in self.rollup_models():
+            model.objects.using(self.alias).all().delete()
 
-    def get_models(self):
+    def history_chunk(self, HistoryModel, before, after_id=0, limit=1000):
+        """
+        Returns up to `limit` IDs of `HistoryModel` rows recorded before `before`, in
+        order, starting after `after_id`. Must be called in a transaction; where
+        supported, the rows are locked, skipping any that are already locked.
+        """
+        qs = (
+            HistoryModel.objects.using(self.alias)
+            .filter(id__gt=after_id, session_date__lt=before)
+            .order_by("id")
+        )
+        if self.conn.features.has_select_for_update_skip_locked:
+            qs = qs.select_for_update(skip_locked=True)
+        return list(qs.values_list("id", flat=True)[:limit])
+
+    def feed(self, HistoryModel=None, position=None, batch_size=1000, wait=None):
+        """
+        Yields `(entries, position)` for batches of `HistoryModel` rows recorded after
+        `position`, in commit order; `position` is where to resume from after the batch.
+        Stops once caught up, unless `wait` is set, in which case it waits (up to `wait`
+        seconds between polls) for more history.
+        """
+        HistoryModel = HistoryModel or get_history_model()
+        position = position or (0, 0)
+        if wait is not None:
+            self.listen()
+        while True:
+            entries = self.feed_chunk(HistoryModel, position, batch_size)
+            if entries:
+                position = self.feed_position(entries[-1])
+                yield entries, position
+            if len(entries) < batch_size:
+                if wait is None:
+                    return
+                self.wait_for_history(wait)
+
+    def feed_chunk(self, HistoryModel, position=(0, 0), limit=1000):
+        """
+        Returns up to `limit` `HistoryModel` rows recorded after `position`, in commit
+        order.
+        """
+        return list(self.feed_queryset(HistoryModel, position)[:limit])
+
+    def feed_queryset(self, HistoryModel, position=(0, 0)):
+        """
+        Returns the `HistoryModel` rows recorded after `position`, in commit order. By
+        default, writes are assumed to be serialized (as on SQLite), so IDs are assigned
+        in commit order.
+        """
+        return (
+            HistoryModel.objects.using(self.alias)
+            .filter(id__gt=position[1])
+            .order_by("id")
+        )
+
+    def feed_position(self, entry):
+        """
+        Returns the feed position of a history row, as a `(transaction_id, id)` tuple.
+        """
+        return (0, entry.id)
+
+    def listen(self):
+        """
+        Starts listening for notifications of new history, where supported.
+        """
+        pass
+
+    def wait_for_history(self, timeout):
+        """
+        Waits up to `timeout` seconds for new history to be recorded.
+        """
+        time.sleep(timeout)
+
+    def create_archive_table(self, HistoryModel, table):
+        raise NotImplementedError()
+
+    def archive_chunk(self, HistoryModel, ids, table=None, file=None):
+        """
+        Moves the `HistoryModel` rows with the specified IDs into an archive `table`
+        (see `create_archive_table`), or writes them as JSON lines to `file`.
+        """
+        qs = HistoryModel.objects.using(self.alias).filter(id__in=ids)
+        objects = None
+        if conf.LATEST:
+            objects = set(qs.values_list("content_type_id", "object_id"))
+        if table:
+            sql = "INSERT INTO {archive} SELECT * FROM {table} WHERE id IN ({ids});"
+            self.execute(
+                sql.format(
+                    archive=table,
+                    table=HistoryModel._meta.db_table,
+                    ids=", ".join(["%s"] * len(ids)),
+                ),
+                ids,
+            )
+        if file:
+            for row in qs.order_by("id").values():
+                row["model"] = HistoryModel._meta.label_lower
+                file.write(json.dumps(row, cls=DjangoJSONEncoder) + "\n")
+        qs.delete()
+        if objects:
+            self.refresh_latest(HistoryModel, objects=objects)
+
+    def compact_chunk(self, HistoryModel, ids, before):
+        """
+        Collapses the history (recorded before `before`) of each object with history in
+        `ids` into a single row, and returns the number of rows removed. The most recent
+        row is kept, with the latest snapshot and the net changes.
+        """
+        qs = HistoryModel.objects.using(self.alias)
+        objects = set(qs.filter(id__in=ids).values_list("content_type_id", "object_id"))
+        rows = {}
+        for entry in (
+            qs.filter(
+                session_date__lt=before,
+                content_type_id__in={ct for ct, _ in objects},
+                object_id__in={obj for _, obj in objects},
+            )
+            .order_by("id")
+            .select_for_update()
+        ):
+            key = (entry.content_type_id, entry.object_id)
+            if key in objects:
+                rows.setdefault(key, []).append(entry)
+        kept = []
+        removed = []
+        for entries in rows.values():
+            if len(entries) < 2:
+                continue
+            first, last = entries[0], entries[-1]
+            changes = {}
+            relations = {}
+            for entry in entries:
+                for name, change in (entry.changes or {}).items():
+                    if isinstance(change, dict):
+                        # Related IDs added or removed (see `HISTORY_M2M`).
+                        net = relations.setdefault(name, {})
+                        for key, value in relation_ops(change):
+                            if net.get(value, key) == key:
+                                net[value] = key
+                            else:
+                                del net[value]
+                    else:
+                        changes.setdefault(name, list(change))[1] = change[1]
+            if last.change_type != TriggerType.DELETE:
+                last.change_type = first.change_type
+            snapshot = None
+            for entry in entries:
+                if entry.snapshot is not None:
+                    snapshot = dict(entry.snapshot)
+                elif snapshot is not None:
+                    # Updates in a statement only record changes, which are applied to
+                    # the last full snapshot.
+                    for name, change in (entry.changes or {}).items():
+                        if not isinstance(change, dict):
+                            snapshot[name] = change[1]
+            last.snapshot = snapshot
+            last.changes = None
+            if last.change_type == TriggerType.UPDATE:
+                last.changes = {
+                    name: values
+                    for name, values in changes.items()
+                    if values[0] != values[1]
+                }
+                for name, net in relations.items():
+                    change = {}
+                    for value, key in net.items():
+                        change.setdefault(key, []).append(value)
+                    if change:
+                        last.changes[name] = change
+                last.changes = last.changes or None
+            kept.append(last)
+            removed.extend(entry.pk for entry in entries[:-1])
+        if kept:
+            qs.bulk_update(kept, ["change_type", "snapshot", "changes"])
+            qs.filter(id__in=removed).delete()
+            if conf.LATEST:
+                self.refresh_latest(
+                    HistoryModel,
+                    objects=[(e.content_type_id, e.object_id) for e in kept],
+                )
+        return len(removed)
+
+    def replication_lag(self):
+        """
+        Returns the replay lag (in seconds) of the furthest behind replica, or None if
+        it can't be determined.
+        """
+        return None
+
+    def revert(self, *querysets, **context):
+        """
+        Reverts each object with history in `querysets` to its state before the
+        earliest of those changes, using a few bulk statements per table. The changes
+        are made (and recorded) in a new session with `context`, which is returned.
+        """
+        states = self.revert_states(*querysets)
+        with self.session(**context) as session:
+            # Reverted updates are tagged as a statement, and only record changes.
+            with session.statement(), transaction.atomic(using=self.alias):
+                for ct_id, objects in states.items():
+                    model = (
+                        ContentType.objects.db_manager(self.alias)
+                        .get_for_id(ct_id)
+                        .model_class()
+                    )
+                    self.apply_revert(model, objects)
+        return session
+
+    def revert_states(self, *querysets):
+        """
+        Walks the history in `querysets` backwards, undoing each change, and returns
+        `{content_type_id: {object_id: (existed, exists, values, relations)}}`, where
+        `values` are the column values to restore, and `relations` maps many-to-many
+        fields (see `HISTORY_M2M`) to the related IDs to add or remove.
+        """
+        states = {}
+        for qs in querysets:
+            rows = (
+                qs.order_by("-session_date", "-id")
+                .annotate(
+                    # Only deletes need their snapshot.
+                    deleted=models.Case(
+                        models.When(change_type=TriggerType.DELETE, then="snapshot"),
+                        output_field=qs.model._meta.get_field("snapshot"),
+                    )
+                )
+                .values_list(
+                    "content_type_id", "object_id", "change_type", "deleted", "changes"
+                )
+            )
+            for ct_id, object_id, change_type, snapshot, changes in rows.iterator(
+                chunk_size=self.revert_batch_size
+            ):
+                objects = states.setdefault(ct_id, {})
+                if object_id not in objects:
+                    exists = change_type != TriggerType.DELETE
+                    objects[object_id] = (exists, exists, {}, {})
+                existed, _exists, values, relations = objects[object_id]
+                if change_type == TriggerType.INSERT:
+                    objects[object_id] = (existed, False, {}, {})
+                elif change_type == TriggerType.DELETE:
+                    if snapshot is None:
+                        raise ValueError(
+                            "Deleted objects can only be reverted with snapshots."
+                        )
+                    objects[object_id] = (existed, True, dict(snapshot), relations)
+                else:
+                    for name, change in changes.items():
+                        if isinstance(change, dict):
+                            # Undo added IDs by removing them, and vice versa.
+                            net = relations.setdefault(name, {})
+                            for key, value in reversed(list(relation_ops(change))):
+                                net[value] = "removed" if key == "added" else "added"
+                        else:
+                            values[name] = change[0]
+        return states
+
+    def apply_revert(self, model, objects):
+        """
+        Applies the states computed by `revert_states` for a single model.
+        """
+        fields = {f.column: f for f in model._meta.concrete_fields}
+        pks = pk_fields(model)
+        deletes = []
+        inserts = []
+        updates = {}
+        relations = []
+        for object_id, (existed, exists, values, related) in objects.items():
+            if len(pks) == 1:
+                key = [object_id]
+            else:
+                key = json.loads(object_id)
+            key = [self.decode_value(f, v) for f, v in zip(pks, key)]
+            values = {
+                fields[name]: self.decode_value(fields[name], value)
+                for name, value in values.items()
+                if name in fields and fields[name] not in pks
+            }
+            if existed and not exists:
+                deletes.append(key)
+            elif exists and not existed:
+                obj = model(**{f.attname: v for f, v in values.items()})
+                for f, v in zip(pks, key):
+                    setattr(obj, f.attname, v)
+                inserts.append(obj)
+            elif exists and values:
+                updates.setdefault(tuple(values), []).append(
+                    key + list(values.values())
+                )
+            if exists and related:
+                # Includes re-created rows, which get back the links deleted with them.
+                relations.append((key[0], related))
+        qn = self.conn.ops.quote_name
+        table = qn(model._meta.db_table)
+        join = " AND ".join(
+            "{table}.{col} = _v.{col}".format(table=table, col=qn(f.column))
+            for f in pks
+        )
+        for cols, rows in updates.items():
+            columns = list(pks) + list(cols)
+            for batch in self.batches(columns, rows):
+                self.execute(
+                    "WITH _v ({names}) AS (VALUES {values}) "
+                    "UPDATE {table} SET {assign} FROM _v WHERE {join}".format(
+                        names=", ".join(qn(f.column) for f in columns),
+                        values=self.values_sql(columns, batch),
+                        table=table,
+                        assign=", ".join(
+                            "{col} = _v.{col}".format(col=qn(f.column)) for f in cols
+                        ),
+                        join=join,
+                    ),
+                    self.values_params(columns, batch),
+                )
+        for batch in self.batches(pks, deletes):
+            self.execute(
+                "DELETE FROM {table} WHERE ({names}) IN (VALUES {values})".format(
+                    table=table,
+                    names=", ".join(qn(f.column) for f in pks),
+                    values=self.values_sql(pks, batch),
+                ),
+                self.values_params(pks, batch),
+            )
+        if inserts:
+            model._base_manager.using(self.alias).bulk_create(
+                inserts, batch_size=self.revert_batch_size
+            )
+        for pk, related in relations:
+            for name, net in related.items():
+                field = model._meta.get_field(name)
+                through = field.remote_field.through._base_manager.using(self.alias)
+                source = field.m2m_field_name()
+                target = field.m2m_reverse_field_name()
+                removed = [value for value, key in net.items() if key == "removed"]
+                if removed:
+                    through.filter(
+                        **{source: pk, "{}__in".format(target): removed}
+                    ).delete()
+                through.bulk_create(
+                    [
+                        through.model(
+                            **{"{}_id".format(source): pk, "{}_id".format(target): v}
+                        )
+                        for v, key in net.items()
+                        if key == "added"
+                    ],
+                    ignore_conflicts=True,
+                )
+
+    def batches(self, fields, rows):
+        size = self.revert_batch_size
+        if self.conn.features.max_query_params:
+            size = min(size, max(1, self.conn.features.max_query_params // len(fields)))
+        for idx in range(0, len(rows), size):
+            yield rows[idx : idx + size]
+
+    def placeholder(self, field):
+        return "%s"
+
+    def values_sql(self, fields, rows):
+        row = "({})".format(", ".join(self.placeholder(f) for f in fields))
+        return ", ".join([row] * len(rows))
+
+    def values_params(self, fields, rows):
+        conn = self.conn
         return [
-            model
-            for model in apps.get_models(include_auto_created=True)
-            if not issubclass(model, AbstractObjectHistory)
-            and model._meta.app_label not in conf.IGNORE_APPS
-            and model._meta.label_lower not in conf.IGNORE_MODELS
-            and (model._meta.managed or conf.INCLUDE_UNMANAGED)
+            f.get_db_prep_save(value, conn)
+            for row in rows
+            for f, value in zip(fields, row)
         ]
 
-    def session_fields(self):
-        HistoryModel = get_history_model()
+    def decode_value(self, field, value):
+        """
+        Converts a value recorded in history back to a Python value for `field`.
+        """
+        if value is None:
+            return None
+        if isinstance(value, TruncatedValue):
+            raise ValueError(
+                "{} values were truncated and can not be reverted.".format(field.name)
+            )
+        if isinstance(field, models.BinaryField):
+            return bytes.fromhex(value[2:])
+        if isinstance(field, models.JSONField):
+            return value
+        value = field.to_python(value)
+        if isinstance(value, datetime.datetime) and timezone.is_naive(value):
+            # SQLite records datetimes in UTC, without an offset.
+            value = timezone.make_aware(value, datetime.timezone.utc)
+        return value
+
+    def get_models(self):
+        """
+        Returns the models to record history for, which are computed once per backend.
+        Models whose primary key can't be stored by their history model are skipped
+        (see `skipped_models`).
+        """
+        if self._models is None:
+            self._models = []
+            self._skipped_models = []
+            for model in apps.get_models(include_auto_created=True):
+                if (
+                    issubclass(
+                        model,
+                        (AbstractObjectHistory, AbstractHistorySession),
+                    )
+                    or model in self.rollup_models()
+                    or model._meta.app_label in conf.IGNORE_APPS
+                    or model._meta.label_lower in conf.IGNORE_MODELS
+                    or not (model._meta.managed or conf.INCLUDE_UNMANAGED)
+                ):
+                    continue
+                field = self.m2m_field(model)
+                parent = field.model if field is not None else model
+                error = self.object_id_error(parent, get_history_model(parent))
+                if error:
+                    self._skipped_models.append((model, error))
+                else:
+                    self._models.append(model)
+        return self._models
+
+    def skipped_models(self):
+        """
+        Returns `(model, error)` for each model that `get_models` skipped, because its
+        primary key can't be stored by its history model (see `object_id_error`).
+        """
+        self.get_models()
+        return self._skipped_models
+
+    def session_models(self):
+        """
+        Returns the session models related to history models (see `SessionRelation`).
+        These are computed once per backend.
+        """
+        if self._session_models is None:
+            self._session_models = []
+            for HistoryModel in get_history_models():
+                relation = session_relation(HistoryModel)
+                if relation and relation.related_model not in self._session_models:
+                    self._session_models.append(relation.related_model)
+        return self._session_models
+
+    def record_session(self, session):
+        """
+        Inserts a row for `session` into each session model, from its context, unless
+        one was already recorded.
+        """
+        for SessionModel in self.session_models():
+            values = {}
+            for field in SessionModel._meta.concrete_fields:
+                name = "session_id" if field.primary_key else field.name
+                value = context_value(session.context.get(name))
+                if value is not None:
+                    values[field.attname] = value
+            SessionModel.objects.using(self.alias).bulk_create(
+                [SessionModel(**values)], ignore_conflicts=True
+            )
+
+    def session_fields(self, HistoryModel=None):
+        """
+        Returns the fields of `HistoryModel` that are populated from the session
+        context. If no model is specified, returns the session fields of all routed
+        history models (see `HISTORY_ROUTES`). These are computed once per backend.
+        """
+        if HistoryModel not in self._session_fields:
+            self._session_fields[HistoryModel] = list(
+                self._find_session_fields(HistoryModel)
+            )
+        return self._session_fields[HistoryModel]
+
+    def _find_session_fields(self, HistoryModel):
+        if HistoryModel is None:
+            seen = set()
+            for HistoryModel in get_history_models():
+                for f in self.session_fields(HistoryModel):
+                    if f.name not in seen:
+                        seen.add(f.name)
+                        yield f
+            return
         auto_populated = [
             "id",
             "change_type",
@@ -133,11 +944,88 @@ class HistoryBackend:
             "object_id",
             "snapshot",
             "changes",
+            "transaction_id",
         ]
         for f in HistoryModel._meta.get_fields():
             if f.concrete and f.name not in auto_populated:
                 yield f
 
+    def object_id_error(self, model, HistoryModel):
+        """
+        Returns why the primary key of `model` can't be recorded in the `object_id`
+        column of `HistoryModel`, or None if it can. Composite primary keys need a text
+        `object_id`.
+        """
+        object_id = HistoryModel._meta.get_field("object_id")
+        fields = pk_fields(model)
+        if len(fields) > 1:
+            compatible = is_compatible(models.TextField(), object_id)
+        else:
+            compatible = is_compatible(fields[0], object_id)
+        if compatible:
+            return None
+        return (
+            "The primary key of {} can't be stored in {}.object_id ({}); route it "
+            "to a history model with a compatible object_id using "
+            "HISTORY_ROUTES.".format(
+                model._meta.label,
+                HistoryModel._meta.label,
+                object_id.get_internal_type(),
+            )
+        )
+
+    def check_object_id(self, model, HistoryModel):
+        """
+        Raises ImproperlyConfigured if the primary key of `model` can't be recorded in
+        the `object_id` column of `HistoryModel` (see `object_id_error`).
+        """
+        error = self.object_id_error(model, HistoryModel)
+        if error:
+            raise ImproperlyConfigured(error)
+
+    def refresh_latest(self, HistoryModel, ids=None, objects=None):
+        """
+        Updates the `HISTORY_LATEST` summary table from `HistoryModel` rows (all of
+        them, or only those with the specified IDs), or rebuilds the summary of
+        `objects` (`(content_type_id, object_id)` tuples) after their history was
+        removed or replaced. Only maintained by backends that support it.
+        """
+        pass
+
+    def latest_history(self, obj):
+        """
+        Returns the latest history entry for `obj`, or None.
+        """
+        return obj.history.order_by("-id").first()
+
+    def object_id(self, obj):
+        """
+        Returns the object_id that history for `obj` is recorded with. Composite primary
+        keys are recorded as a JSON array of the key values.
+        """
+        fields = pk_fields(obj.__class__)
+        if len(fields) == 1:
+            return obj.pk
+        conn = connections[self.alias]
+        values = [f.get_db_prep_value(getattr(obj, f.attname), conn) for f in fields]
+        return json.dumps(
+            values,
+            separators=self.json_separators,
+            default=lambda v: v.isoformat() if hasattr(v, "isoformat") else str(v),
+        )
+
+    def m2m_field(self, model):
+        """
+        Returns the many-to-many field of an auto-created through model, if its changes
+        are recorded on the parent object (`HISTORY_M2M = "parent"`).
+        """
+        if conf.M2M != "parent" or not model._meta.auto_created:
+            return None
+        for field in model._meta.auto_created._meta.local_many_to_many:
+            if field.remote_field.through is model:
+                return field
+        return None
+
     def model_fields(self, model, trigger_type):
         for f in model._meta.get_fields(include_parents=False):
             if f.many_to_many or not f.concrete:
@@ -146,9 +1034,40 @@ class HistoryBackend:
                 yield f
 
     def execute(self, sql, params=None):
+        if self.captured is not None:
+            self.captured.append((sql, params))
+            return
         with self.conn.cursor() as cursor:
             cursor.execute(sql, params)
 
+    @contextlib.contextmanager
+    def capture(self):
+        """
+        Collects the `(sql, params)` passed to `execute` within the block (in the
+        yielded list), instead of running them.
+        """
+        self.captured = []
+        try:
+            yield self.captured
+        finally:
+            self.captured = None
+
+    def table_stats(self, model, columns):
+        """
+        Returns `(snapshot_size, writes)` for a model's table, where `snapshot_size` is
+        the estimated size (in bytes) of a JSON snapshot of `columns`, and `writes` is a
+        dictionary of recent writes per day for each TriggerType. Either may be None if
+        the database does not keep statistics.
+        """
+        return None, None
+
+    def disable_triggers(self, models=None):
+        """
+        Disables the history triggers of `models` (or all models) until the end of the
+        transaction, and returns a list of `(sql, params)` that restore them.
+        """
+        raise NotImplementedError()
+
     def session(self, **fields):
         return self.session_class(self, **fields)
 
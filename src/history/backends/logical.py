@@ -0,0 +1,423 @@
+import json
+import re
+import struct
+
+from django.contrib.contenttypes.models import ContentType
+from django.db import NotSupportedError, connections, transaction
+from django.db.backends.utils import split_identifier
+
+from history import conf, get_history_model, get_history_models
+from history.models import TriggerType, truncate_value
+
+from .base import has_field, pk_fields
+from .postgres import PostgresHistoryBackend, is_paused
+
+MESSAGE_PREFIX = "history"
+
+EMIT_FUNCTION_SQL = """
+    CREATE OR REPLACE FUNCTION history_emit() RETURNS trigger AS $BODY$
+    DECLARE
+        _paused text := current_setting('history.__paused', true);
+    BEGIN
+        IF _paused IS DISTINCT FROM 'true' AND
+           nullif(current_setting('history.session_id', true), '') IS NULL THEN
+            RAISE EXCEPTION 'No history session has been started'
+            USING ERRCODE = 'not_null_violation';
+        END IF;
+
+        -- Transactional messages are decoded in order with the changes around them,
+        -- so the consumer applies this context to the changes from this statement.
+        PERFORM pg_logical_emit_message(
+            true,
+            '{prefix}',
+            jsonb_build_object('__paused', _paused, {session_context})::text
+        );
+
+        RETURN NULL;
+    END; $BODY$
+    LANGUAGE 'plpgsql' VOLATILE;
+"""
+
+PEEK_SQL = """
+    SELECT lsn, data
+    FROM pg_logical_slot_peek_binary_changes(
+        %s, NULL, %s,
+        'proto_version', '1',
+        'publication_names', %s,
+        'messages', 'true'
+    )
+"""
+
+# Type OIDs (see pg_type.dat) whose text output needs converting to match to_jsonb.
+BOOL_TYPES = {16}
+NUMBER_TYPES = {20, 21, 23, 26, 700, 701, 1700}
+JSON_TYPES = {114, 3802}
+DATETIME_TYPES = {1114, 1184}
+
+
+def decode_value(value, type_oid):
+    """
+    Converts the text representation of a column value from pgoutput to the same JSON
+    value that to_jsonb would produce for it.
+    """
+    if type_oid in BOOL_TYPES:
+        return value == "t"
+    elif type_oid in NUMBER_TYPES:
+        try:
+            return json.loads(value)
+        except ValueError:
+            # NaN and Infinity are stored as strings by to_jsonb as well.
+            return value
+    elif type_oid in JSON_TYPES:
+        return json.loads(value)
+    elif type_oid in DATETIME_TYPES:
+        value = value.replace(" ", "T", 1)
+        if re.search(r"[+-]\d\d$", value):
+            value += ":00"
+        return value
+    return value
+
+
+class MessageReader:
+    """
+    Reads the fields of a pgoutput (protocol version 1) logical replication message.
+    """
+
+    def __init__(self, data):
+        self.data = data
+        self.pos = 0
+
+    def unpack(self, fmt):
+        values = struct.unpack_from(fmt, self.data, self.pos)
+        self.pos += struct.calcsize(fmt)
+        return values[0]
+
+    def byte(self):
+        return self.unpack("!c")
+
+    def int8(self):
+        return self.unpack("!b")
+
+    def int16(self):
+        return self.unpack("!h")
+
+    def int32(self):
+        return self.unpack("!i")
+
+    def int64(self):
+        return self.unpack("!q")
+
+    def string(self):
+        end = self.data.index(b"\x00", self.pos)
+        value = self.data[self.pos : end].decode()
+        self.pos = end + 1
+        return value
+
+    def read(self, length):
+        value = self.data[self.pos : self.pos + length]
+        self.pos += length
+        return value
+
+    def relation(self):
+        oid = self.int32()
+        namespace = self.string()
+        name = self.string()
+        self.int8()  # Replica identity setting
+        columns = []
+        for _ in range(self.int16()):
+            self.int8()  # Flags (part of the key)
+            column = self.string()
+            type_oid = self.int32()
+            self.int32()  # Type modifier
+            columns.append((column, type_oid))
+        return oid, namespace, name, columns
+
+    def tuple(self, columns):
+        """
+        Returns a tuple's values as a dictionary, leaving out any unchanged TOASTed
+        values (which are not sent).
+        """
+        values = {}
+        for idx in range(self.int16()):
+            kind = self.byte()
+            column, type_oid = columns[idx]
+            if kind == b"n":
+                values[column] = None
+            elif kind == b"t":
+                text = self.read(self.int32()).decode()
+                values[column] = decode_value(text, type_oid)
+        return values
+
+
+def format_lsn(lsn):
+    return "{:X}/{:X}".format(lsn >> 32, lsn & 0xFFFFFFFF)
+
+
+class LogicalHistoryBackend(PostgresHistoryBackend):
+    """
+    Captures changes from a logical replication slot instead of recording history in
+    row triggers. The only trigger work done while writing is a statement-level trigger
+    on each audited table that emits the session context into the WAL. History rows are
+    written later, in batches, by `consume` (see `manage.py triggers consume`).
+
+    Requires `wal_level = logical`, and a user with the REPLICATION attribute.
+    """
+
+    publication_name = "history"
+
+    @property
+    def slot_name(self):
+        # Replication slots are cluster-wide, but only decode a single database.
+        database = connections[self.alias].settings_dict["NAME"] or ""
+        return "history_{}".format(re.sub(r"[^a-z0-9_]", "_", database.lower()))[:63]
+
+    def fetch_value(self, sql, params=None):
+        with self.conn.cursor() as cursor:
+            cursor.execute(sql, params)
+            row = cursor.fetchone()
+            return row[0] if row else None
+
+    def install(self):
+        # The publication must exist before the slot is created, or decoding will not
+        # be able to find it.
+        if not self.fetch_value(
+            "SELECT 1 FROM pg_publication WHERE pubname = %s", [self.publication_name]
+        ):
+            self.execute("CREATE PUBLICATION {};".format(self.publication_name))
+        if not self.fetch_value(
+            "SELECT 1 FROM pg_replication_slots WHERE slot_name = %s", [self.slot_name]
+        ):
+            self.execute(
+                "SELECT pg_create_logical_replication_slot(%s, 'pgoutput');",
+                [self.slot_name],
+            )
+        session_context = [
+            "'{field}', current_setting('history.{field}', true)".format(field=f.name)
+            for f in self.session_fields()
+        ]
+        self.execute(
+            EMIT_FUNCTION_SQL.format(
+                prefix=MESSAGE_PREFIX,
+                session_context=", ".join(session_context),
+            )
+        )
+        for HistoryModel in get_history_models():
+            self.install_table(HistoryModel)
+
+    def remove(self):
+        if self.fetch_value(
+            "SELECT 1 FROM pg_replication_slots WHERE slot_name = %s", [self.slot_name]
+        ):
+            self.execute("SELECT pg_drop_replication_slot(%s);", [self.slot_name])
+        self.execute("DROP PUBLICATION IF EXISTS {};".format(self.publication_name))
+        self.execute("DROP FUNCTION IF EXISTS history_emit() CASCADE;")
+        self.execute("DROP FUNCTION IF EXISTS history_notify() CASCADE;")
+
+    def flush(self):
+        pass
+
+    def is_published(self, model):
+        return self.fetch_value(
+            "SELECT 1 FROM pg_publication_tables WHERE pubname = %s AND tablename = %s",
+            [self.publication_name, split_identifier(model._meta.db_table)[1]],
+        )
+
+    def disable_triggers(self, models=None):
+        raise NotSupportedError(
+            "Changes are captured by logical decoding, not triggers, so they can't be "
+            "bypassed."
+        )
+
+    def create_trigger(self, model, trigger_type):
+        self.check_object_id(model, get_history_model(model))
+        tr_name = self.trigger_name(model, trigger_type)
+        super().drop_trigger(model, trigger_type)
+        field_names = [f.column for f in self.model_fields(model, trigger_type)]
+        if not field_names:
+            return tr_name, []
+        if not self.is_published(model):
+            # Full row images are needed for update changes and delete snapshots.
+            self.execute(
+                "ALTER TABLE {} REPLICA IDENTITY FULL;".format(model._meta.db_table)
+            )
+            self.execute(
+                "ALTER PUBLICATION {} ADD TABLE {};".format(
+                    self.publication_name, model._meta.db_table
+                )
+            )
+        self.execute(
+            """
+            CREATE TRIGGER {tr_name} BEFORE {trans_type} ON {table}
+            FOR EACH STATEMENT EXECUTE PROCEDURE history_emit();
+            """.format(
+                tr_name=tr_name,
+                trans_type=trigger_type.name.upper(),
+                table=model._meta.db_table,
+            )
+        )
+        return tr_name, field_names
+
+    def drop_trigger(self, model, trigger_type):
+        super().drop_trigger(model, trigger_type)
+        # The table is published until the last of its triggers is dropped.
+        remaining = self.fetch_value(
+            "SELECT 1 FROM pg_trigger "
+            "WHERE tgrelid = %s::regclass AND tgname = ANY(%s)",
+            [model._meta.db_table, [self.trigger_name(model, t) for t in TriggerType]],
+        )
+        if not remaining and self.is_published(model):
+            self.execute(
+                "ALTER PUBLICATION {} DROP TABLE {};".format(
+                    self.publication_name, model._meta.db_table
+                )
+            )
+
+    def consume(self, limit=1000):
+        """
+        Records history for (at least) `limit` changes from the replication slot, and
+        returns the number of history rows written. Decoding always stops at the end of
+        a transaction. If recording fails, the slot is not advanced, so changes are
+        recorded at least once.
+        """
+        while True:
+            with self.conn.cursor() as cursor:
+                cursor.execute(PEEK_SQL, [self.slot_name, limit, self.publication_name])
+                rows = cursor.fetchall()
+            if not rows:
+                return 0
+            # Keep going if the batch only had changes that aren't recorded (from paused
+            # sessions, or to tables that are no longer audited).
+            count = self.record_changes(rows)
+            if count is None:
+                # Nothing was committed, so the slot didn't advance.
+                return 0
+            if count:
+                return count
+
+    def record_changes(self, rows):
+        """
+        Records history for the transactions committed in `rows`, and advances the slot
+        past them. Returns the number of history rows written, or None if `rows` had no
+        Commit (in which case nothing is recorded).
+        """
+        tables = {
+            split_identifier(model._meta.db_table)[1]: model
+            for model in self.get_models()
+        }
+        relations = {}
+        context = {}
+        history = {}
+        pending = []
+        end_lsn = None
+        for _lsn, data in rows:
+            reader = MessageReader(bytes(data))
+            kind = reader.byte()
+            if kind == b"B":
+                context = {}
+                pending = []
+            elif kind == b"C":
+                reader.int8()  # Flags
+                reader.int64()  # Commit LSN
+                end_lsn = reader.int64()
+                for entry in pending:
+                    history.setdefault(entry.__class__, []).append(entry)
+                pending = []
+            elif kind == b"M":
+                reader.int8()  # Flags
+                reader.int64()  # LSN
+                prefix = reader.string()
+                content = reader.read(reader.int32())
+                if prefix == MESSAGE_PREFIX:
+                    context = json.loads(content)
+            elif kind == b"R":
+                oid, _namespace, name, columns = reader.relation()
+                relations[oid] = (tables.get(name), columns)
+            elif kind in (b"I", b"U", b"D"):
+                model, columns = relations[reader.int32()]
+                if model is None or is_paused(
+                    context.get("__paused"),
+                    ContentType.objects.db_manager(self.alias).get_for_model(model).pk,
+                ):
+                    continue
+                entry = self.decode_change(model, columns, kind, reader, context)
+                if entry is not None:
+                    pending.append(entry)
+        if end_lsn is None:
+            # Advancing the slot needs the end of a committed transaction.
+            return None
+        with transaction.atomic(using=self.alias):
+            if conf.FEED:
+                # The ORM inserts every column, so the column default isn't used.
+                txid = self.fetch_value("SELECT txid_current();")
+                for HistoryModel, entries in history.items():
+                    if has_field(HistoryModel, "transaction_id"):
+                        for entry in entries:
+                            entry.transaction_id = txid
+            for HistoryModel, entries in history.items():
+                HistoryModel.objects.using(self.alias).bulk_create(entries)
+                if conf.LATEST:
+                    self.refresh_latest(HistoryModel, [entry.pk for entry in entries])
+        self.execute(
+            "SELECT pg_replication_slot_advance(%s, %s::pg_lsn);",
+            [self.slot_name, format_lsn(end_lsn)],
+        )
+        return sum(len(entries) for entries in history.values())
+
+    def decode_change(self, model, columns, kind, reader, context):
+        trigger_type = TriggerType(kind.decode())
+        old = new = None
+        marker = reader.byte()
+        if marker in (b"K", b"O"):
+            old = reader.tuple(columns)
+            if trigger_type == TriggerType.UPDATE:
+                marker = reader.byte()
+        if marker == b"N":
+            new = reader.tuple(columns)
+            if old:
+                # Unchanged TOAST values are only included in the old row image.
+                new = {**old, **new}
+        fields = [f.column for f in self.model_fields(model, trigger_type)]
+        if not fields:
+            return None
+        HistoryModel = get_history_model(model)
+        image = old if trigger_type.snapshot_of == "OLD" else new
+        snapshot = None
+        statement = trigger_type == TriggerType.UPDATE and context.get("statement_id")
+        if conf.SNAPSHOTS and image is not None and not statement:
+            snapshot = {c: image[c] for c in fields if c in image}
+        changes = None
+        if trigger_type.changes and old is not None:
+            changes = {
+                c: [old[c], new[c]]
+                for c in fields
+                if c in old and c in new and old[c] != new[c]
+            } or None
+        if conf.MAX_VALUE_SIZE:
+            size = int(conf.MAX_VALUE_SIZE)
+            if snapshot:
+                snapshot = {c: truncate_value(v, size) for c, v in snapshot.items()}
+            if changes:
+                changes = {
+                    c: [truncate_value(v, size) for v in values]
+                    for c, values in changes.items()
+                }
+        row = old or new
+        object_id = [row.get(f.column) for f in pk_fields(model)]
+        if len(object_id) == 1:
+            object_id = object_id[0]
+        else:
+            object_id = json.dumps(object_id, separators=self.json_separators)
+        entry = HistoryModel(
+            change_type=trigger_type.value,
+            content_type=ContentType.objects.db_manager(self.alias).get_for_model(
+                model
+            ),
+            object_id=HistoryModel._meta.get_field("object_id").to_python(object_id),
+            snapshot=snapshot,
+            changes=changes,
+        )
+        for field in self.session_fields(HistoryModel):
+            value = context.get(field.name)
+            if value not in (None, ""):
+                setattr(entry, field.attname, field.to_python(value))
+        return entry
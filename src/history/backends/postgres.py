@@ -1,26 +1,49 @@
+import functools
+import select
+
 from django.contrib.contenttypes.models import ContentType
+from django.core.exceptions import ImproperlyConfigured
+from django.db.backends.utils import split_identifier, truncate_name
+from django.db.models.expressions import RawSQL
+
+from history import conf, get_history_model, get_history_models
+from history.models import TriggerType
 
-from history import conf, get_history_model
+from .base import HistoryBackend, HistorySession, has_field, pk_fields
 
-from .base import HistoryBackend, HistorySession
+STATS_SQL = """
+    SELECT
+        n_tup_ins,
+        n_tup_upd,
+        n_tup_del,
+        extract(epoch FROM now() - coalesce(d.stats_reset, pg_postmaster_start_time()))
+    FROM pg_stat_user_tables t, pg_stat_database d
+    WHERE t.relid = %s::regclass AND d.datname = current_database()
+"""
 
 TRIGGER_FUNCTION_SQL = """
-    CREATE OR REPLACE FUNCTION history_record() RETURNS trigger AS $BODY$
+    CREATE OR REPLACE FUNCTION {function}() RETURNS trigger AS $BODY$
     DECLARE
         _ctid integer := TG_ARGV[0]::integer;
-        _pk_name text := TG_ARGV[1];
-        _record_snap boolean := TG_ARGV[2]::boolean;
-        _snap_of text := TG_ARGV[3];
-        _fields text[] := TG_ARGV[4:];
+        _record_snap boolean := TG_ARGV[1]::boolean;
+        _snap_of text := TG_ARGV[2];
+        _fields text[] := TG_ARGV[3:];
         _old jsonb := to_jsonb(OLD);
         _new jsonb := to_jsonb(NEW);
+        _object_id {obj_type};
         _snapshot jsonb;
         _changes jsonb;
-        _paused boolean;
+        _paused text := current_setting('history.__paused', true);
     BEGIN
-        IF current_setting('history.__paused', true) IS NOT DISTINCT FROM 'true' THEN
+        IF _paused = 'true' OR strpos(_paused, ',' || _ctid || ',') > 0 THEN
             RETURN NULL;
         END IF;
+{object_id}
+        IF TG_OP = 'UPDATE' AND
+           nullif(current_setting('history.statement_id', true), '') IS NOT NULL THEN
+            -- Updates from a bulk statement only record their changes.
+            _record_snap := false;
+        END IF;
 
         IF _record_snap THEN
             IF _snap_of = 'OLD' THEN
@@ -48,8 +71,8 @@ TRIGGER_FUNCTION_SQL = """
                 n.key = ANY(_fields) AND
                 n.value IS DISTINCT FROM o.value;
         END IF;
-
-        INSERT INTO {table} (
+{shrink}
+        {latest_with}INSERT INTO {table} (
             change_type,
             content_type_id,
             object_id,
@@ -60,73 +83,925 @@ TRIGGER_FUNCTION_SQL = """
         VALUES (
             substr(TG_OP, 1, 1),
             _ctid,
-            coalesce(_old->>_pk_name, _new->>_pk_name)::{obj_type},
+            _object_id,
             _snapshot,
             _changes,
             {session_values}
-        );
+        ){latest_upsert};
+
+        RETURN NULL;
+    END; $BODY$
+    LANGUAGE 'plpgsql' VOLATILE;
+"""
+
+# Records one history row per parent object for each statement on an auto-created
+# many-to-many through table (see HISTORY_M2M), from its transition table.
+M2M_FUNCTION_SQL = """
+    CREATE OR REPLACE FUNCTION {function}() RETURNS trigger AS $BODY$
+    DECLARE
+        _ctid integer := TG_ARGV[0]::integer;
+        _field text := TG_ARGV[1];
+        _source text := TG_ARGV[2];
+        _target text := TG_ARGV[3];
+        _key text := CASE TG_OP WHEN 'INSERT' THEN 'added' ELSE 'removed' END;
+        _paused text := current_setting('history.__paused', true);
+    BEGIN
+        IF _paused = 'true' OR strpos(_paused, ',' || _ctid || ',') > 0 THEN
+            RETURN NULL;
+        END IF;
+
+        {latest_with}INSERT INTO {table} (
+            change_type,
+            content_type_id,
+            object_id,
+            changes,
+            {session_cols}
+        )
+        SELECT
+            'U',
+            _ctid,
+            (r.row->>_source)::{obj_type},
+            jsonb_build_object(
+                _field,
+                jsonb_build_object(
+                    _key, jsonb_agg(r.row->_target ORDER BY r.row->_target)
+                )
+            ),
+            {session_values}
+        FROM (SELECT to_jsonb(t) AS row FROM _rows t) r
+        GROUP BY r.row->>_source{latest_upsert};
+
+        RETURN NULL;
+    END; $BODY$
+    LANGUAGE 'plpgsql' VOLATILE;
+"""
+
+# Reads the primary key of the changed row, from OLD unless inserted, with expressions
+# built for each primary key (see `PostgresHistoryBackend.object_id_sql`).
+OBJECT_ID_SQL = """
+        IF TG_OP = 'INSERT' THEN
+            _object_id := {new};
+        ELSE
+            _object_id := {old};
+        END IF;
+"""
+
+# Large string values are replaced by a marker with a prefix and digest of the value,
+# see history.models.TruncatedValue.
+SHRINK_FUNCTION_SQL = """
+    CREATE OR REPLACE FUNCTION history_shrink(value jsonb, size integer)
+    RETURNS jsonb AS $BODY$
+        SELECT CASE
+            WHEN jsonb_typeof(value) = 'string' AND length(value #>> '{}') > size THEN
+                jsonb_build_object(
+                    '__truncated__', left(value #>> '{}', size),
+                    'md5', md5(value #>> '{}'),
+                    'size', length(value #>> '{}')
+                )
+            ELSE value
+        END
+    $BODY$
+    LANGUAGE 'sql' IMMUTABLE;
+"""
+
+SHRINK_SQL = """
+        SELECT jsonb_object_agg(key, history_shrink(value, {size})) INTO _snapshot
+        FROM jsonb_each(_snapshot);
+        SELECT
+            jsonb_object_agg(
+                key,
+                jsonb_build_array(
+                    history_shrink(value->0, {size}),
+                    history_shrink(value->1, {size})
+                )
+            ) INTO _changes
+        FROM jsonb_each(_changes);
+"""
+
+PENDING_TABLE_SQL = """
+    CREATE UNLOGGED TABLE IF NOT EXISTS history_pending (
+        txid bigint NOT NULL,
+        content_type_id integer NOT NULL,
+        object_id text NOT NULL,
+        target text NOT NULL,
+        first_op char(1) NOT NULL,
+        last_op char(1) NOT NULL,
+        old_row jsonb,
+        new_row jsonb,
+        fields text[] NOT NULL,
+        record_snap boolean NOT NULL,
+        session jsonb NOT NULL,
+        PRIMARY KEY (txid, content_type_id, object_id)
+    );
+"""
+
+BUFFER_FUNCTION_SQL = """
+    CREATE OR REPLACE FUNCTION {function}() RETURNS trigger AS $BODY$
+    DECLARE
+        _ctid integer := TG_ARGV[0]::integer;
+        _record_snap boolean := TG_ARGV[1]::boolean;
+        _fields text[] := TG_ARGV[3:];
+        _old jsonb := to_jsonb(OLD);
+        _new jsonb := to_jsonb(NEW);
+        _object_id text;
+        _paused text := current_setting('history.__paused', true);
+    BEGIN
+        IF _paused = 'true' OR strpos(_paused, ',' || _ctid || ',') > 0 THEN
+            RETURN NULL;
+        END IF;
+{object_id}
+        -- Keep the first OLD image and the latest row image (OLD for deletes) for
+        -- each object in this transaction; history_flush records it at commit. The
+        -- fields are those of the change type that will be recorded: the insert's, the
+        -- delete's, or all the updates'.
+        INSERT INTO history_pending AS p (
+            txid,
+            content_type_id,
+            object_id,
+            target,
+            first_op,
+            last_op,
+            old_row,
+            new_row,
+            fields,
+            record_snap,
+            session
+        )
+        VALUES (
+            txid_current(),
+            _ctid,
+            _object_id,
+            '{target}',
+            substr(TG_OP, 1, 1),
+            substr(TG_OP, 1, 1),
+            _old,
+            coalesce(_new, _old),
+            _fields,
+            _record_snap,
+            jsonb_build_object({session_context})
+        )
+        ON CONFLICT (txid, content_type_id, object_id) DO UPDATE SET
+            last_op = EXCLUDED.last_op,
+            new_row = EXCLUDED.new_row,
+            fields = CASE
+                WHEN p.first_op = 'I' THEN p.fields
+                WHEN EXCLUDED.last_op = 'D' THEN EXCLUDED.fields
+                ELSE ARRAY(SELECT DISTINCT unnest(p.fields || EXCLUDED.fields))
+            END,
+            record_snap = p.record_snap OR EXCLUDED.record_snap,
+            session = EXCLUDED.session;
+
+        RETURN NULL;
+    END; $BODY$
+    LANGUAGE 'plpgsql' VOLATILE;
+"""
+
+FLUSH_FUNCTION_SQL = """
+    CREATE OR REPLACE FUNCTION history_flush() RETURNS trigger AS $BODY$
+    DECLARE
+        _p history_pending%ROWTYPE;
+        _change_type text;
+        _snapshot jsonb;
+        _changes jsonb;
+    BEGIN
+        DELETE FROM history_pending
+        WHERE
+            txid = NEW.txid AND
+            content_type_id = NEW.content_type_id AND
+            object_id = NEW.object_id
+        RETURNING * INTO _p;
+
+        IF NOT FOUND OR (_p.first_op = 'I' AND _p.last_op = 'D') THEN
+            -- Already flushed, or the row never outlived the transaction.
+            RETURN NULL;
+        ELSEIF _p.first_op = 'I' THEN
+            _change_type := 'I';
+        ELSEIF _p.last_op = 'D' THEN
+            _change_type := 'D';
+        ELSE
+            _change_type := 'U';
+        END IF;
+
+        IF _p.record_snap AND NOT (
+            _change_type = 'U' AND nullif(_p.session->>'statement_id', '') IS NOT NULL
+        ) THEN
+            SELECT jsonb_object_agg(key, value) INTO _snapshot
+            FROM jsonb_each(_p.new_row)
+            WHERE key = ANY(_p.fields);
+        END IF;
+
+        IF _change_type = 'U' THEN
+            SELECT
+                jsonb_object_agg(
+                    coalesce(n.key, o.key),
+                    jsonb_build_array(o.value, n.value)
+                ) INTO _changes
+            FROM
+                jsonb_each(_p.old_row) o,
+                jsonb_each(_p.new_row) n
+            WHERE
+                n.key = o.key AND
+                n.key = ANY(_p.fields) AND
+                n.value IS DISTINCT FROM o.value;
+        END IF;
+{shrink}
+        {inserts}
 
         RETURN NULL;
     END; $BODY$
     LANGUAGE 'plpgsql' VOLATILE;
 """
 
+FLUSH_INSERT_SQL = """
+        IF _p.target = '{table}' THEN
+            {latest_with}INSERT INTO {table} (
+                change_type,
+                content_type_id,
+                object_id,
+                snapshot,
+                changes,
+                {session_cols}
+            )
+            VALUES (
+                _change_type,
+                _p.content_type_id,
+                _p.object_id::{obj_type},
+                _snapshot,
+                _changes,
+                {session_values}
+            ){latest_upsert};
+        END IF;
+"""
+
+FLUSH_TRIGGER_SQL = """
+    DROP TRIGGER IF EXISTS history_flush ON history_pending;
+    CREATE CONSTRAINT TRIGGER history_flush AFTER INSERT ON history_pending
+    DEFERRABLE INITIALLY DEFERRED
+    FOR EACH ROW EXECUTE PROCEDURE history_flush();
+"""
+
+# With HISTORY_LATEST, history inserts are wrapped in a CTE that also upserts the latest
+# change to each object into a summary table, keyed by (content_type_id, object_id).
+# History from concurrent (or deferred) transactions may be inserted out of order, so
+# newer changes are never replaced.
+LATEST_WITH_SQL = "WITH _history AS ("
+
+LATEST_UPSERT_SQL = """
+        RETURNING *
+        )
+        INSERT INTO {latest} ({columns})
+        SELECT {columns} FROM _history
+        ON CONFLICT (content_type_id, object_id) DO UPDATE SET {updates}
+        WHERE {latest}.id < EXCLUDED.id"""
+
+# Fills the summary table from existing history (or only the rows with the given IDs),
+# without replacing newer changes.
+LATEST_REFRESH_SQL = """
+    INSERT INTO {latest} ({columns})
+    SELECT DISTINCT ON (content_type_id, object_id) {columns} FROM {table}
+    {where}
+    ORDER BY content_type_id, object_id, id DESC
+    ON CONFLICT (content_type_id, object_id) DO UPDATE SET {updates}
+    WHERE {latest}.id < EXCLUDED.id;
+"""
+
+# Wakes up change feed consumers (see HISTORY_FEED_NOTIFY). Notifications with the same
+# payload are only delivered once per transaction, when it commits.
+NOTIFY_FUNCTION_SQL = """
+    CREATE OR REPLACE FUNCTION history_notify() RETURNS trigger AS $BODY$
+    BEGIN
+        PERFORM pg_notify('{channel}', TG_TABLE_NAME);
+        RETURN NULL;
+    END; $BODY$
+    LANGUAGE 'plpgsql' VOLATILE;
+"""
+
+# Storage tuning presets for HISTORY_STORAGE_PROFILE. History is insert-only, so pages
+# can be packed full, and the table should be vacuumed (to set visibility map bits) and
+# analyzed based on inserts rather than dead tuples. Caching sequence values per backend
+# spreads concurrent inserts across more than just the right-most page of the id index.
+STORAGE_PROFILES = {
+    "append": {
+        "parameters": {
+            "fillfactor": 100,
+            "autovacuum_vacuum_insert_scale_factor": 0.05,
+            "autovacuum_analyze_scale_factor": 0.02,
+        },
+        "sequence_cache": 64,
+    },
+}
+
+
+@functools.cache
+def session_sql(names):
+    """
+    Returns the SQL to start and stop a session with the fields in `names`, which is
+    only built once for each set of session fields.
+    """
+    start = "SELECT {};".format(
+        ", ".join("set_config('history.{}', %s, false)".format(name) for name in names)
+    )
+    stop = "SELECT {};".format(
+        ", ".join("set_config('history.{}', '', false)".format(name) for name in names)
+    )
+    return start, stop
+
+
+def format_paused(paused):
+    """
+    Formats what is paused (see `HistorySession.update_paused`) for the
+    `history.__paused` setting: "true" when all models are paused, otherwise the paused
+    content type IDs, which triggers look for as ",{content_type_id},".
+    """
+    if paused is True:
+        return "true"
+    if not paused:
+        return None
+    return ",{},".format(",".join(str(ct_id) for ct_id in sorted(paused)))
+
+
+def is_paused(paused, ct_id):
+    """
+    Whether changes to the content type are paused, given the `history.__paused` value.
+    """
+    return paused == "true" or ",{},".format(ct_id) in (paused or "")
+
 
 class PostgresHistorySession(HistorySession):
     def start_sql(self):
-        parts = []
-        params = []
-        for name, value in self.fields.items():
-            parts.append("set_config('history.{field}', %s, false)".format(field=name))
-            params.append(str(value))
-        return "SELECT {};".format(", ".join(parts)), params
+        start, _stop = session_sql(tuple(self.fields))
+        return start, [str(value) for value in self.fields.values()]
 
     def stop_sql(self):
-        parts = []
-        for name, value in self.fields.items():
-            parts.append("set_config('history.{field}', '', false)".format(field=name))
-        return "SELECT {};".format(", ".join(parts)), []
+        _start, stop = session_sql(tuple(self.fields))
+        return stop, []
 
-    def pause(self):
-        self.backend.execute("SELECT set_config('history.__paused', 'true', false)")
+    def pause(self, models=None):
+        self.backend.execute(
+            "SELECT set_config('history.__paused', %s, false)",
+            [format_paused(self.update_paused(models, True))],
+        )
 
-    def resume(self):
-        self.backend.execute("SELECT set_config('history.__paused', NULL, false)")
+    def resume(self, models=None):
+        self.backend.execute(
+            "SELECT set_config('history.__paused', %s, false)",
+            [format_paused(self.update_paused(models, False))],
+        )
 
 
 class PostgresHistoryBackend(HistoryBackend):
     session_class = PostgresHistorySession
+    feed_channel = "history_feed"
+
+    def function_name(self, HistoryModel, prefix, key=None):
+        """
+        Returns the name of the trigger function that records history into
+        `HistoryModel`, for tables with the primary `key` columns. The default history
+        model, and tables with an `id` primary key, use unsuffixed names.
+        """
+        name = prefix
+        if HistoryModel is not get_history_model():
+            table_name = split_identifier(HistoryModel._meta.db_table)[1]
+            name = "{}_{}".format(name, table_name)
+        if key and key != ("id",):
+            name = "{}__{}".format(name, "_".join(key))
+        return truncate_name(name, self.conn.ops.max_name_length())
+
+    def primary_keys(self):
+        """
+        Returns the primary key columns of the tables history is recorded for (see
+        `get_models`), for each history model. Row triggers read the key directly from
+        `OLD` or `NEW`, so each primary key gets its own trigger functions.
+        """
+        keys = {}
+        for model in self.get_models():
+            if self.m2m_field(model) is None:
+                key = tuple(f.column for f in pk_fields(model))
+                history_keys = keys.setdefault(get_history_model(model), [])
+                if key not in history_keys:
+                    history_keys.append(key)
+        return keys
+
+    def object_id_sql(self, key):
+        """
+        Returns the PL/pgSQL that sets `_object_id` from the primary `key` columns of
+        the changed row. Composite primary keys are recorded as a JSON array of the key
+        values, in the same format as `HistoryBackend.object_id` produces (the text
+        output of jsonb).
+        """
+        qn = self.conn.ops.quote_name
+
+        def value(row):
+            if len(key) == 1:
+                return "{}.{}".format(row, qn(key[0]))
+            return "jsonb_build_array({})::text".format(
+                ", ".join("{}.{}".format(row, qn(column)) for column in key)
+            )
+
+        return OBJECT_ID_SQL.format(old=value("OLD"), new=value("NEW"))
 
     def install(self):
-        HistoryModel = get_history_model()
-        obj_type = HistoryModel._meta.get_field("object_id").db_type(self.conn)
-        session_cols = []
-        session_values = []
-        for field in self.session_fields():
-            session_cols.append(field.column)
-            session_values.append(
-                "nullif(current_setting('history.{field}', true), '')::{type}".format(
-                    field=field.name,
-                    type=field.rel_db_type(self.conn),
+        flush_inserts = []
+        shrink = ""
+        if conf.MAX_VALUE_SIZE:
+            self.execute(SHRINK_FUNCTION_SQL)
+            shrink = SHRINK_SQL.format(size=int(conf.MAX_VALUE_SIZE))
+        if conf.DEFERRED:
+            self.execute(PENDING_TABLE_SQL)
+        keys = self.primary_keys()
+        for HistoryModel in get_history_models():
+            table = HistoryModel._meta.db_table
+            obj_type = HistoryModel._meta.get_field("object_id").db_type(self.conn)
+            session_cols = []
+            session_values = []
+            session_context = []
+            pending_values = []
+            for field in self.session_fields(HistoryModel):
+                setting = "current_setting('history.{}', true)".format(field.name)
+                field_type = field.rel_db_type(self.conn)
+                session_cols.append(field.column)
+                session_values.append("nullif({}, '')::{}".format(setting, field_type))
+                session_context.append("'{}', {}".format(field.name, setting))
+                pending_values.append(
+                    "nullif(_p.session->>'{}', '')::{}".format(field.name, field_type)
+                )
+            self.install_table(HistoryModel)
+            latest = self.latest_sql(HistoryModel)
+            for key in keys.get(HistoryModel, []):
+                self.execute(
+                    TRIGGER_FUNCTION_SQL.format(
+                        function=self.function_name(
+                            HistoryModel, "history_record", key
+                        ),
+                        object_id=self.object_id_sql(key),
+                        shrink=shrink,
+                        table=table,
+                        obj_type=obj_type,
+                        session_cols=", ".join(session_cols),
+                        session_values=", ".join(session_values),
+                        **latest,
+                    )
+                )
+                if conf.DEFERRED:
+                    self.execute(
+                        BUFFER_FUNCTION_SQL.format(
+                            function=self.function_name(
+                                HistoryModel, "history_buffer", key
+                            ),
+                            object_id=self.object_id_sql(key),
+                            target=table,
+                            session_context=", ".join(session_context),
+                        )
+                    )
+            if conf.M2M == "parent":
+                self.execute(
+                    M2M_FUNCTION_SQL.format(
+                        function=self.function_name(HistoryModel, "history_m2m"),
+                        table=table,
+                        obj_type=obj_type,
+                        session_cols=", ".join(session_cols),
+                        session_values=", ".join(session_values),
+                        **latest,
+                    )
+                )
+            if conf.DEFERRED:
+                flush_inserts.append(
+                    FLUSH_INSERT_SQL.format(
+                        table=table,
+                        obj_type=obj_type,
+                        session_cols=", ".join(session_cols),
+                        session_values=", ".join(pending_values),
+                        **latest,
+                    )
+                )
+        if conf.DEFERRED:
+            self.execute(
+                FLUSH_FUNCTION_SQL.format(
+                    shrink=shrink,
+                    inserts="".join(flush_inserts),
                 )
             )
+            self.execute(FLUSH_TRIGGER_SQL)
+
+    def install_table(self, HistoryModel):
+        """
+        Applies the storage settings, indexes, and tables that `HistoryModel` needs,
+        independent of how history is captured.
+        """
+        self.apply_storage_profile(HistoryModel)
+        self.apply_compression(HistoryModel)
+        self.create_changes_index(HistoryModel)
+        self.create_statement_index(HistoryModel)
+        self.install_feed(HistoryModel)
+        self.install_latest(HistoryModel)
+
+    def apply_storage_profile(self, HistoryModel):
+        profile = conf.STORAGE_PROFILE
+        if not profile:
+            return
+        if isinstance(profile, str):
+            profile = STORAGE_PROFILES[profile]
+        table = HistoryModel._meta.db_table
+        parameters = profile.get("parameters")
+        if parameters:
+            self.execute(
+                "ALTER TABLE {table} SET ({parameters});".format(
+                    table=table,
+                    parameters=", ".join(
+                        "{} = {}".format(name, value)
+                        for name, value in parameters.items()
+                    ),
+                )
+            )
+        cache = profile.get("sequence_cache")
+        if cache:
+            with self.conn.cursor() as cursor:
+                cursor.execute(
+                    "SELECT pg_get_serial_sequence(%s, %s);",
+                    [table, HistoryModel._meta.pk.column],
+                )
+                sequence = cursor.fetchone()[0]
+            if sequence:
+                self.execute("ALTER SEQUENCE {} CACHE {};".format(sequence, int(cache)))
+
+    def apply_compression(self, HistoryModel):
+        """
+        Sets the TOAST compression method (`HISTORY_COMPRESSION`) for the snapshot and
+        changes columns. Only applies to values written afterwards.
+        """
+        if not conf.COMPRESSION:
+            return
+        if self.conn.pg_version < 140000:
+            raise ImproperlyConfigured("HISTORY_COMPRESSION requires PostgreSQL 14+.")
         self.execute(
-            TRIGGER_FUNCTION_SQL.format(
+            "ALTER TABLE {table} {columns};".format(
                 table=HistoryModel._meta.db_table,
-                obj_type=obj_type,
-                session_cols=", ".join(session_cols),
-                session_values=", ".join(session_values),
+                columns=", ".join(
+                    "ALTER COLUMN {} SET COMPRESSION {}".format(
+                        HistoryModel._meta.get_field(name).column, conf.COMPRESSION
+                    )
+                    for name in ("snapshot", "changes")
+                ),
+            )
+        )
+
+    def create_changes_index(self, HistoryModel):
+        """
+        Creates a GIN index on the changes column, using the `HISTORY_CHANGES_INDEX`
+        operator class, for `HistoryQuerySet` lookups. The index is left in place when
+        triggers are removed.
+        """
+        if not conf.CHANGES_INDEX:
+            return
+        table = HistoryModel._meta.db_table
+        name = truncate_name("{}_changes_gin".format(split_identifier(table)[1]))
+        self.execute(
+            "CREATE INDEX IF NOT EXISTS {name} ON {table} "
+            "USING gin ({column} {opclass});".format(
+                name=name,
+                table=table,
+                column=HistoryModel._meta.get_field("changes").column,
+                opclass=conf.CHANGES_INDEX,
+            )
+        )
+
+    def install_feed(self, HistoryModel):
+        """
+        Records the inserting transaction in `transaction_id` (`HISTORY_FEED`), with an
+        index for `feed_queryset`, and optionally notifies feed consumers of new history
+        (`HISTORY_FEED_NOTIFY`). History models without a `transaction_id` field (see
+        `FeedHistoryMixIn`) are skipped. The column default and index are left in place
+        when triggers are removed.
+        """
+        if not conf.FEED or not has_field(HistoryModel, "transaction_id"):
+            return
+        table = HistoryModel._meta.db_table
+        column = HistoryModel._meta.get_field("transaction_id").column
+        self.execute(
+            "ALTER TABLE {table} ALTER COLUMN {column} "
+            "SET DEFAULT txid_current();".format(
+                table=table,
+                column=column,
+            )
+        )
+        self.execute(
+            "CREATE INDEX IF NOT EXISTS {name} ON {table} ({column}, {pk});".format(
+                name=truncate_name("{}_feed".format(split_identifier(table)[1])),
+                table=table,
+                column=column,
+                pk=HistoryModel._meta.pk.column,
             )
         )
+        if conf.FEED_NOTIFY:
+            self.execute(NOTIFY_FUNCTION_SQL.format(channel=self.feed_channel))
+            self.execute(
+                "DROP TRIGGER IF EXISTS history_notify ON {table};"
+                "CREATE TRIGGER history_notify AFTER INSERT ON {table} "
+                "FOR EACH STATEMENT EXECUTE PROCEDURE history_notify();".format(
+                    table=table
+                )
+            )
+
+    def table_exists(self, table):
+        with self.conn.cursor() as cursor:
+            cursor.execute("SELECT to_regclass(%s);", [table])
+            return cursor.fetchone()[0] is not None
+
+    def latest_table(self, HistoryModel):
+        return "{}_latest".format(HistoryModel._meta.db_table)
+
+    def latest_columns(self, HistoryModel):
+        """
+        Returns the columns of the `HISTORY_LATEST` summary table, and the assignments
+        to update them from `EXCLUDED` rows.
+        """
+        columns = [
+            f.column
+            for f in HistoryModel._meta.concrete_fields
+            if f.name not in ("snapshot", "changes")
+        ]
+        updates = [
+            "{0} = EXCLUDED.{0}".format(column)
+            for column in columns
+            if column not in ("content_type_id", "object_id")
+        ]
+        return ", ".join(columns), ", ".join(updates)
+
+    def latest_sql(self, HistoryModel):
+        if not conf.LATEST:
+            return {"latest_with": "", "latest_upsert": ""}
+        columns, updates = self.latest_columns(HistoryModel)
+        return {
+            "latest_with": LATEST_WITH_SQL,
+            "latest_upsert": LATEST_UPSERT_SQL.format(
+                latest=self.latest_table(HistoryModel),
+                columns=columns,
+                updates=updates,
+            ),
+        }
+
+    def install_latest(self, HistoryModel):
+        """
+        Creates the `HISTORY_LATEST` summary table for `HistoryModel`, with the columns
+        of the history table except snapshot and changes, and fills it from existing
+        history. The table is left in place when triggers are removed.
+        """
+        if not conf.LATEST:
+            return
+        latest = self.latest_table(HistoryModel)
+        if self.table_exists(latest):
+            return
+        self.execute(
+            "CREATE TABLE {latest} (LIKE {table});"
+            "ALTER TABLE {latest} DROP COLUMN {snapshot}, DROP COLUMN {changes}, "
+            "ADD PRIMARY KEY (content_type_id, object_id);".format(
+                latest=latest,
+                table=HistoryModel._meta.db_table,
+                snapshot=HistoryModel._meta.get_field("snapshot").column,
+                changes=HistoryModel._meta.get_field("changes").column,
+            )
+        )
+        self.refresh_latest(HistoryModel)
+
+    def refresh_latest(self, HistoryModel, ids=None, objects=None):
+        columns, updates = self.latest_columns(HistoryModel)
+        latest = self.latest_table(HistoryModel)
+        where = ""
+        params = None
+        if ids is not None:
+            where = "WHERE id = ANY(%s)"
+            params = [list(ids)]
+        elif objects is not None:
+            if not objects:
+                return
+            # History for these objects was removed or replaced, so their rows are
+            # rebuilt from what is left.
+            where = "WHERE (content_type_id, object_id) IN ({})".format(
+                ", ".join(["(%s, %s)"] * len(objects))
+            )
+            params = [value for key in objects for value in key]
+            self.execute("DELETE FROM {} {};".format(latest, where), params)
+        self.execute(
+            LATEST_REFRESH_SQL.format(
+                latest=latest,
+                table=HistoryModel._meta.db_table,
+                columns=columns,
+                updates=updates,
+                where=where,
+            ),
+            params,
+        )
+
+    def latest_history(self, obj):
+        if not conf.LATEST:
+            return super().latest_history(obj)
+        HistoryModel = get_history_model(obj.__class__)
+        ct = ContentType.objects.db_manager(self.alias).get_for_model(obj.__class__)
+        # The snapshot and changes are loaded from the history table if accessed.
+        entries = HistoryModel.objects.using(self.alias).raw(
+            "SELECT * FROM {} WHERE content_type_id = %s AND object_id = %s".format(
+                self.latest_table(HistoryModel)
+            ),
+            [ct.pk, self.object_id(obj)],
+        )
+        return next(iter(entries), None)
 
     def remove(self):
-        self.execute("DROP FUNCTION IF EXISTS history_record() CASCADE;")
+        keys = self.primary_keys()
+        for HistoryModel in get_history_models():
+            for key in [None] + keys.get(HistoryModel, []):
+                for prefix in ("history_record", "history_buffer", "history_m2m"):
+                    self.execute(
+                        "DROP FUNCTION IF EXISTS {}() CASCADE;".format(
+                            self.function_name(HistoryModel, prefix, key)
+                        )
+                    )
+        self.execute("DROP TABLE IF EXISTS history_pending;")
+        self.execute("DROP FUNCTION IF EXISTS history_flush() CASCADE;")
+        self.execute("DROP FUNCTION IF EXISTS history_shrink(jsonb, integer);")
+        self.execute("DROP FUNCTION IF EXISTS history_notify() CASCADE;")
+
+    def flush(self):
+        if conf.DEFERRED:
+            self.execute("SET CONSTRAINTS history_flush IMMEDIATE;")
+            self.execute("SET CONSTRAINTS history_flush DEFERRED;")
 
     def clear(self):
-        HistoryModel = get_history_model()
-        self.execute("TRUNCATE {table};".format(table=HistoryModel._meta.db_table))
+        tables = [h._meta.db_table for h in get_history_models()]
+        if conf.LATEST:
+            tables += [
+                self.latest_table(h)
+                for h in get_history_models()
+                if self.table_exists(self.latest_table(h))
+            ]
+        tables += [model._meta.db_table for model in self.rollup_models()]
+        self.execute("TRUNCATE {tables};".format(tables=", ".join(tables)))
+
+    def create_archive_table(self, HistoryModel, table):
+        self.execute(
+            "CREATE TABLE IF NOT EXISTS {archive} (LIKE {table});".format(
+                archive=table,
+                table=HistoryModel._meta.db_table,
+            )
+        )
+
+    def table_stats(self, model, columns):
+        schema, table = split_identifier(model._meta.db_table)
+        with self.conn.cursor() as cursor:
+            cursor.execute(
+                "SELECT attname, avg_width FROM pg_stats "
+                "WHERE schemaname = coalesce(%s, current_schema()) AND tablename = %s",
+                [schema or None, table],
+            )
+            widths = dict(cursor.fetchall())
+            cursor.execute(STATS_SQL, [self.conn.ops.quote_name(model._meta.db_table)])
+            row = cursor.fetchone()
+        snapshot_size = None
+        if widths:
+            # Each value is a JSON key and value, with quotes and separators.
+            snapshot_size = 2 + sum(
+                len(name) + widths.get(name, 0) + 6 for name in columns
+            )
+        writes = None
+        if row and row[3]:
+            days = row[3] / 86400
+            writes = {
+                TriggerType.INSERT: row[0] / days,
+                TriggerType.UPDATE: row[1] / days,
+                TriggerType.DELETE: row[2] / days,
+            }
+        return snapshot_size, writes
+
+    def feed_queryset(self, HistoryModel, position=(0, 0)):
+        if not conf.FEED:
+            raise ImproperlyConfigured(
+                "The history feed requires HISTORY_FEED on PostgreSQL."
+            )
+        if not has_field(HistoryModel, "transaction_id"):
+            raise ImproperlyConfigured(
+                "The history feed requires a transaction_id field on {} (see "
+                "FeedHistoryMixIn).".format(HistoryModel._meta.label)
+            )
+        txid, after_id = position
+        # History is returned in (transaction_id, id) order, only from transactions
+        # older than any still in progress, so rows from transactions that commit later
+        # always sort after the current position.
+        return (
+            HistoryModel.objects.using(self.alias)
+            .filter(
+                transaction_id__gte=txid,
+                transaction_id__lt=RawSQL(
+                    "txid_snapshot_xmin(txid_current_snapshot())", []
+                ),
+            )
+            .exclude(transaction_id=txid, id__lte=after_id)
+            .order_by("transaction_id", "id")
+        )
+
+    def feed_position(self, entry):
+        return (entry.transaction_id, entry.id)
+
+    def listen(self):
+        if conf.FEED_NOTIFY:
+            self.execute("LISTEN {};".format(self.feed_channel))
+
+    def wait_for_history(self, timeout):
+        if not conf.FEED_NOTIFY:
+            return super().wait_for_history(timeout)
+        raw = self.conn.connection
+        if callable(getattr(raw, "notifies", None)):
+            # psycopg 3
+            for _notify in raw.notifies(timeout=timeout, stop_after=1):
+                pass
+        elif raw.notifies or select.select([raw], [], [], timeout)[0]:
+            # psycopg2, which keeps notifications received during other queries.
+            raw.poll()
+            raw.notifies.clear()
+
+    def placeholder(self, field):
+        # VALUES lists need explicit types for anything that isn't text.
+        return "%s::{}".format(field.cast_db_type(self.conn))
+
+    def replication_lag(self):
+        with self.conn.cursor() as cursor:
+            cursor.execute(
+                "SELECT extract(epoch FROM max(replay_lag)) FROM pg_stat_replication;"
+            )
+            lag = cursor.fetchone()[0]
+        return float(lag or 0)
+
+    def disable_triggers(self, models=None):
+        with self.conn.cursor() as cursor:
+            if models is None:
+                # Skips all triggers (including foreign key checks), which requires
+                # superuser or (on PostgreSQL 15+) having been granted SET on this.
+                cursor.execute("SELECT current_setting('session_replication_role')")
+                role = cursor.fetchone()[0]
+                cursor.execute("SET LOCAL session_replication_role = replica")
+                return [
+                    ("SELECT set_config('session_replication_role', %s, true)", [role])
+                ]
+            names = [
+                self.trigger_name(model, trigger_type)
+                for model in models
+                for trigger_type in TriggerType
+            ]
+            cursor.execute(
+                "SELECT tgrelid::regclass::text, tgname FROM pg_trigger "
+                "WHERE tgrelid = ANY(%s::regclass[]) AND tgname = ANY(%s) "
+                "AND tgenabled <> 'D'",
+                [[model._meta.db_table for model in models], names],
+            )
+            triggers = cursor.fetchall()
+        restore = []
+        for table, name in triggers:
+            # Takes an exclusive lock on the table until the end of the transaction, so
+            # other connections can't write to it without history in the meantime.
+            self.execute("ALTER TABLE {} DISABLE TRIGGER {};".format(table, name))
+            restore.append(
+                ("ALTER TABLE {} ENABLE TRIGGER {};".format(table, name), None)
+            )
+        return restore
+
+    def create_m2m_trigger(self, model, trigger_type, field):
+        """
+        Creates a statement trigger on an auto-created through table, which records the
+        related IDs added or removed on the parent object of `field`.
+        """
+        HistoryModel = get_history_model(field.model)
+        self.check_object_id(field.model, HistoryModel)
+        ct = ContentType.objects.db_manager(self.alias).get_for_model(field.model)
+        tr_name = self.trigger_name(model, trigger_type)
+        self.drop_trigger(model, trigger_type)
+        fields = [f.column for f in self.model_fields(model, trigger_type)]
+        if trigger_type == TriggerType.UPDATE or not fields:
+            return tr_name, []
+        self.execute(
+            """
+            CREATE TRIGGER {tr_name} AFTER {trans_type} ON {table}
+            REFERENCING {transition} TABLE AS _rows
+            FOR EACH STATEMENT EXECUTE PROCEDURE
+            {function}({ctid}, '{field}', '{source}', '{target}');
+            """.format(
+                tr_name=tr_name,
+                trans_type=trigger_type.name.upper(),
+                table=model._meta.db_table,
+                transition="NEW" if trigger_type == TriggerType.INSERT else "OLD",
+                function=self.function_name(HistoryModel, "history_m2m"),
+                ctid=ct.pk,
+                field=field.name,
+                source=field.m2m_column_name(),
+                target=field.m2m_reverse_name(),
+            )
+        )
+        return tr_name, fields
 
     def create_trigger(self, model, trigger_type):
+        field = self.m2m_field(model)
+        if field is not None:
+            return self.create_m2m_trigger(model, trigger_type, field)
+        HistoryModel = get_history_model(model)
+        self.check_object_id(model, HistoryModel)
         ct = ContentType.objects.db_manager(self.alias).get_for_model(model)
         tr_name = self.trigger_name(model, trigger_type)
         self.execute(
@@ -142,13 +1017,17 @@ class PostgresHistoryBackend(HistoryBackend):
             """
             CREATE TRIGGER {tr_name} AFTER {trans_type} ON {table}
             FOR EACH ROW EXECUTE PROCEDURE
-            history_record({ctid}, '{pk_col}', {snapshots}, '{snap_of}', {field_list});
+            {function}({ctid}, {snapshots}, '{snap_of}', {field_list});
             """.format(
                 tr_name=tr_name,
                 trans_type=trigger_type.name.upper(),
+                function=self.function_name(
+                    HistoryModel,
+                    "history_buffer" if conf.DEFERRED else "history_record",
+                    tuple(f.column for f in pk_fields(model)),
+                ),
                 table=model._meta.db_table,
                 ctid=ct.pk,
-                pk_col=model._meta.pk.column,
                 snapshots=int(conf.SNAPSHOTS),
                 snap_of=trigger_type.snapshot_of,
                 field_list="'" + "', '".join(field_names) + "'",
@@ -1,9 +1,26 @@
+import hashlib
+import json
+
 from django.contrib.contenttypes.models import ContentType
-from django.db import models
+from django.core.exceptions import ImproperlyConfigured
+from django.db import connections, models
+from django.db.backends.utils import truncate_name
+
+from history import conf, get_history_model, get_history_models
+from history.models import TriggerType
+from history.utils import sqlite_jsonb
+
+from .base import HistoryBackend, HistorySession, has_field, pk_fields
+
+TEXT_FIELDS = (models.CharField, models.TextField)
 
-from history import conf, get_history_model
 
-from .base import HistoryBackend, HistorySession
+def json_key(field):
+    """
+    Returns an SQL string literal of the field's column name as a JSON object key,
+    followed by a colon.
+    """
+    return "'{}:'".format(json.dumps(field.column).replace("'", "''"))
 
 
 def column(field, ref):
@@ -13,53 +30,206 @@ def column(field, ref):
     elif isinstance(field, models.JSONField):
         # Explicitly call json so SQLite won't force it to a string.
         return 'json({}."{}")'.format(ref, field.column)
+    elif conf.MAX_VALUE_SIZE and isinstance(
+        field, (models.CharField, models.TextField)
+    ):
+        # Large values are replaced by a marker with a prefix and digest of the value,
+        # see history.models.TruncatedValue.
+        value = '{}."{}"'.format(ref, field.column)
+        return """
+            CASE WHEN length({value}) > {size} THEN json_object(
+                '__truncated__', substr({value}, 1, {size}),
+                'md5', history_md5({value}),
+                'size', length({value})
+            ) ELSE {value} END
+        """.format(value=value, size=int(conf.MAX_VALUE_SIZE))
     else:
         return '{}."{}"'.format(ref, field.column)
 
 
 class SQLiteHistorySession(HistorySession):
     def start(self):
+        conn = self.backend.register_functions()
+        conn.history_values = self.fields
+        # History recording is enabled by default.
+        conn.history_enabled = True
+        conn.history_paused = frozenset()
+
+    def stop(self):
+        self.backend.conn.history_values = {}
+
+    def pause(self, models=None):
+        self.set_paused(self.update_paused(models, True))
+
+    def resume(self, models=None):
+        self.set_paused(self.update_paused(models, False))
+
+    def set_paused(self, paused):
+        conn = self.backend.register_functions()
+        conn.history_enabled = paused is not True
+        conn.history_paused = frozenset(() if paused is True else paused)
+
+
+class SQLiteHistoryBackend(HistoryBackend):
+    session_class = SQLiteHistorySession
+    json_separators = (",", ":")
+
+    def __init__(self, alias):
+        super().__init__(alias)
+        self._connection_triggers = None
+
+    @property
+    def attached(self):
+        """
+        The alias of the database history is recorded in, if it is attached to this
+        backend's connections (see `HISTORY_SQLITE_ATTACH`).
+        """
+        if conf.SQLITE_ATTACH in (None, self.alias):
+            return None
+        return conf.SQLITE_ATTACH
+
+    def attach(self, conn):
+        """
+        Attaches the history database to a connection, which must not be in a
+        transaction. Called when connections are created.
+        """
+        if getattr(conn, "history_attached", None) is conn.connection:
+            return
+        path = str(connections[self.attached].settings_dict["NAME"])
+        conn.connection.execute(
+            'ATTACH DATABASE ? AS "{}"'.format(self.attached), [path]
+        )
+        conn.history_attached = conn.connection
+
+    def register_functions(self):
+        """
+        Creates the functions the triggers call, once per connection (and set of session
+        fields). Session functions return values from `conn.history_values`, which is
+        set when a session starts. When the history database is attached, this also
+        creates the (temporary) triggers for the connection.
+        """
+        conn = self.conn
+        names = tuple(f.name for f in self.session_fields())
+        key = (conn.connection, names, self.attached)
+        if getattr(conn, "history_functions", None) == key:
+            return conn
+
         # This is to bind "name" since it's in a loop.
         def getter(name):
-            return lambda: self.fields.get(name)
+            return lambda: conn.history_values.get(name)
 
-        # Create a function for every session field, named "history_{column}".
-        for field in self.backend.session_fields():
-            self.backend.conn.connection.create_function(
+        # Create a function for every session field, named "history_{column}". Update
+        # triggers check history_statement_id, even if no history model records it.
+        conn.connection.create_function(
+            "history_statement_id", 0, getter("statement_id")
+        )
+        for field in self.session_fields():
+            conn.connection.create_function(
                 "history_{}".format(field.column), 0, getter(field.name)
             )
-
-        # History recording is enabled by default.
-        self.backend.conn.connection.create_function(
-            "_history_enabled", 0, lambda: True
+        conn.connection.create_function(
+            "history_md5",
+            1,
+            lambda value: hashlib.md5(value.encode()).hexdigest(),
+            deterministic=True,
         )
-
-    def stop(self):
-        for field in self.backend.session_fields():
-            self.backend.conn.connection.create_function(
-                "history_{}".format(field.column), 0, lambda: None
-            )
-
-    def pause(self):
-        self.backend.conn.connection.create_function(
-            "_history_enabled", 0, lambda: False
+        conn.connection.create_function(
+            "_history_enabled", 0, lambda: conn.history_enabled
         )
-
-    def resume(self):
-        self.backend.conn.connection.create_function(
-            "_history_enabled", 0, lambda: True
+        conn.connection.create_function(
+            "_history_enabled",
+            1,
+            lambda ct_id: conn.history_enabled and ct_id not in conn.history_paused,
         )
+        conn.history_values = {}
+        conn.history_enabled = True
+        conn.history_paused = frozenset()
+        # Set first, since building the triggers may create content types, which
+        # starts the current session (see `HistorySession.start_on_write`).
+        conn.history_functions = key
+        if self.attached:
+            try:
+                self.attach(conn)
+                with conn.cursor() as cursor:
+                    for sql in self.connection_triggers():
+                        cursor.execute(sql)
+            except Exception:
+                conn.history_functions = None
+                raise
+        return conn
 
+    def connection_triggers(self):
+        """
+        Returns the SQL to create the temporary triggers for each connection, which is
+        only built once per backend.
+        """
+        if self._connection_triggers is None:
+            self._connection_triggers = []
+            for model in self.get_models():
+                for trigger_type in TriggerType:
+                    name, fields, sql = self.trigger_sql(model, trigger_type)
+                    if sql:
+                        self._connection_triggers.append(sql)
+        return self._connection_triggers
 
-class SQLiteHistoryBackend(HistoryBackend):
-    session_class = SQLiteHistorySession
+    def install(self):
+        if self.attached:
+            tables = self.conn.introspection.table_names()
+            for HistoryModel in get_history_models():
+                if HistoryModel._meta.db_table in tables:
+                    raise ImproperlyConfigured(
+                        "{} should only be created in the {!r} database, which is "
+                        "attached for recording history.".format(
+                            HistoryModel._meta.db_table, self.attached
+                        )
+                    )
+                if HistoryModel._meta.get_field("content_type").db_constraint:
+                    raise ImproperlyConfigured(
+                        "{} has a foreign key constraint on content_type, which can't "
+                        "be checked in the attached history database; use a history "
+                        "model based on AbstractAppendOnlyObjectHistory.".format(
+                            HistoryModel._meta.label
+                        )
+                    )
+            if self.captured is not None:
+                # Planned (see `capture`), the temporary triggers are output instead of
+                # attaching the history database and creating them.
+                for sql in self.connection_triggers():
+                    self.execute(sql)
+            else:
+                self.register_functions()
+        super().install()
+
+    def create_statement_index(self, HistoryModel):
+        if not self.attached or not has_field(HistoryModel, "statement_id"):
+            return super().create_statement_index(HistoryModel)
+        # Indexes are created in the schema of their table, which can't be qualified.
+        table = HistoryModel._meta.db_table
+        self.execute(
+            'CREATE INDEX IF NOT EXISTS "{schema}".{name} ON {table} ({column}) '
+            "WHERE {column} IS NOT NULL;".format(
+                schema=self.attached,
+                name=truncate_name("{}_statement".format(table)),
+                table=table,
+                column=HistoryModel._meta.get_field("statement_id").column,
+            )
+        )
 
     def _json_object(self, fields, ref):
-        parts = []
-        for f in fields:
-            parts.append("'{}'".format(f.column))
-            parts.append(column(f, ref))
-        return "json_object({})".format(", ".join(parts))
+        # Concatenated rather than built with json_object, which is limited to
+        # SQLITE_MAX_FUNCTION_ARG arguments (127 by default, so 63 columns).
+        parts = [
+            "{} || json_quote({})".format(json_key(f), column(f, ref)) for f in fields
+        ]
+        return "'{{' || {} || '}}'".format(" || ',' || ".join(parts))
+
+    def _jsonb(self, sql):
+        """
+        Wraps a (text) JSON SQL fragment to store it as binary JSONB, if enabled.
+        """
+        if sqlite_jsonb(self.conn):
+            return "jsonb({})".format(sql)
+        return sql
 
     def _json_snapshot(self, fields, trigger_type):
         """
@@ -68,51 +238,197 @@ class SQLiteHistoryBackend(HistoryBackend):
         """
         if not conf.SNAPSHOTS:
             return "NULL"
-        return self._json_object(fields, trigger_type.snapshot_of)
+        snapshot = self._jsonb(self._json_object(fields, trigger_type.snapshot_of))
+        if trigger_type == TriggerType.UPDATE:
+            # Updates from a bulk statement only record their changes.
+            return "CASE WHEN history_statement_id() IS NULL THEN {} END".format(
+                snapshot
+            )
+        return snapshot
 
     def _json_changes(self, fields, trigger_type):
         """
-        Returns a sub-select that generates a JSON object of changed fields between OLD
-        and NEW, in the format:
+        Returns an SQL fragment that generates a JSON object of changed fields between
+        OLD and NEW (or NULL if nothing changed), in the format:
 
             `{"field": [oldval, newval]}`
+
+        Each column is compared directly, and only changed columns are formatted, so
+        this is linear in the number of columns and doesn't parse any JSON.
         """
         if not trigger_type.changes:
             return "NULL"
-        return """
-            (
-                SELECT
-                    json_group_object(
-                        coalesce(n.key, o.key),
-                        json_array(o.value, n.value)
-                    ) AS changes
-                FROM
-                    json_each({oldvals}) o,
-                    json_each({newvals}) n
-                WHERE
-                    n.key = o.key AND n.value IS NOT o.value
+        parts = []
+        for f in fields:
+            parts.append(
+                """
+                coalesce(
+                    CASE WHEN OLD."{col}" IS NOT NEW."{col}" THEN
+                        {key} || json_array({old}, {new}) || ','
+                    END,
+                    ''
+                )
+                """.format(
+                    col=f.column,
+                    key=json_key(f),
+                    old=column(f, "OLD"),
+                    new=column(f, "NEW"),
+                )
             )
-        """.format(
-            oldvals=self._json_object(fields, "OLD"),
-            newvals=self._json_object(fields, "NEW"),
+        return self._jsonb(
+            "nullif('{{' || rtrim({}, ',') || '}}', '{{}}')".format(" || ".join(parts))
         )
 
-    def create_trigger(self, model, trigger_type):
-        HistoryModel = get_history_model()
+    def disable_triggers(self, models=None):
+        # Dropped and re-created, which is transactional, and other connections can't
+        # write in the meantime.
+        names = [
+            self.trigger_name(model, trigger_type)
+            for model in (self.get_models() if models is None else models)
+            for trigger_type in TriggerType
+        ]
+        restore = []
+        if not names:
+            return restore
+        with self.conn.cursor() as cursor:
+            for schema in ("main", "temp"):
+                cursor.execute(
+                    "SELECT name, sql FROM {}.sqlite_master "
+                    "WHERE type = 'trigger' AND name IN ({})".format(
+                        schema, ", ".join(["%s"] * len(names))
+                    ),
+                    names,
+                )
+                for name, sql in cursor.fetchall():
+                    self.execute("DROP TRIGGER {}.{};".format(schema, name))
+                    if schema == "temp":
+                        # The stored SQL of temporary triggers doesn't include TEMP.
+                        sql = sql.replace("CREATE", "CREATE TEMP", 1)
+                    restore.append((sql, None))
+        return restore
+
+    def create_archive_table(self, HistoryModel, table):
+        # Column types are copied, but not constraints or the primary key.
+        self.execute(
+            "CREATE TABLE IF NOT EXISTS {archive} AS "
+            "SELECT * FROM {table} WHERE 0;".format(
+                archive=table,
+                table=HistoryModel._meta.db_table,
+            )
+        )
+
+    def _object_id(self, model, trigger_type):
+        """
+        Returns an SQL fragment for the object_id of the changed row. Composite primary
+        keys are recorded as a JSON array of the key values.
+        """
+        columns = [
+            '{}."{}"'.format(trigger_type.pk_alias, f.column) for f in pk_fields(model)
+        ]
+        if len(columns) == 1:
+            return columns[0]
+        return "json_array({})".format(", ".join(columns))
+
+    def m2m_trigger_sql(self, model, trigger_type, field):
+        """
+        Returns `(name, fields, sql)` for a trigger on an auto-created through table,
+        which records the related IDs added or removed on the parent object of `field`.
+        SQLite only has row triggers, so each row is appended to the latest history row
+        if it is for the same parent and change (in the same session), instead of being
+        recorded on its own. Row triggers can't tell statements apart, so consecutive
+        statements that make the same kind of change to the same parent (such as two
+        `add()` calls) are merged, unlike on PostgreSQL.
+        """
+        HistoryModel = get_history_model(field.model)
+        self.check_object_id(field.model, HistoryModel)
+        ct = ContentType.objects.db_manager(self.alias).get_for_model(field.model)
+        tr_name = self.trigger_name(model, trigger_type)
+        fields = [f.column for f in self.model_fields(model, trigger_type)]
+        if trigger_type == TriggerType.UPDATE or not fields:
+            return tr_name, [], None
+        ref = trigger_type.snapshot_of
+        key = "added" if trigger_type == TriggerType.INSERT else "removed"
+        path = "$.{}.{}".format(json.dumps(field.name), key)
+        session_cols = []
+        session_values = []
+        for f in self.session_fields(HistoryModel):
+            session_cols.append('"' + f.column + '"')
+            session_values.append("history_{}()".format(f.column))
+        table = model._meta.db_table
+        if self.attached:
+            table = "main.{}".format(table)
+        sql = """
+            CREATE {temp}TRIGGER {trigger_name} AFTER {action} ON {table}
+            WHEN _history_enabled({ctid}) BEGIN
+                UPDATE {history_table}
+                SET changes = {json}_insert(changes, '{path}[#]', {target})
+                WHERE id = (SELECT max(id) FROM {history_table})
+                    AND content_type_id = {ctid}
+                    AND object_id = {source}
+                    AND session_id = history_session_id()
+                    AND json_type(changes, '{path}') = 'array';
+                INSERT INTO {history_table} (
+                    change_type,
+                    content_type_id,
+                    object_id,
+                    changes,
+                    {session_cols}
+                )
+                SELECT
+                    'U',
+                    {ctid},
+                    {source},
+                    {changes},
+                    {session_values}
+                WHERE changes() = 0;
+            END;
+            """.format(
+            temp="TEMP " if self.attached else "",
+            trigger_name=tr_name,
+            action=trigger_type.name,
+            table=table,
+            history_table=HistoryModel._meta.db_table,
+            ctid=ct.pk,
+            json="jsonb" if sqlite_jsonb(self.conn) else "json",
+            path=path.replace("'", "''"),
+            source='{}."{}"'.format(ref, field.m2m_column_name()),
+            target='{}."{}"'.format(ref, field.m2m_reverse_name()),
+            changes=self._jsonb(
+                "json_object('{}', json_object('{}', json_array({}.\"{}\")))".format(
+                    field.name, key, ref, field.m2m_reverse_name()
+                )
+            ),
+            session_cols=", ".join(session_cols),
+            session_values=", ".join(session_values),
+        )
+        return tr_name, fields, sql
+
+    def trigger_sql(self, model, trigger_type):
+        """
+        Returns `(name, fields, sql)` for a model's trigger, where `sql` is None if no
+        fields are tracked. When the history database is attached, the trigger is
+        temporary, since only those may write to other schemas.
+        """
+        field = self.m2m_field(model)
+        if field is not None:
+            return self.m2m_trigger_sql(model, trigger_type, field)
+        HistoryModel = get_history_model(model)
+        self.check_object_id(model, HistoryModel)
         ct = ContentType.objects.db_manager(self.alias).get_for_model(model)
         tr_name = self.trigger_name(model, trigger_type)
         session_cols = []
         session_values = []
-        for field in self.session_fields():
+        for field in self.session_fields(HistoryModel):
             session_cols.append('"' + field.column + '"')
             session_values.append("history_{}()".format(field.column))
-        self.drop_trigger(model, trigger_type)
         fields = list(self.model_fields(model, trigger_type))
         if not fields:
-            return tr_name, []
-        self.execute(
-            """
-            CREATE TRIGGER {trigger_name} AFTER {action} ON {table} BEGIN
+            return tr_name, [], None
+        table = model._meta.db_table
+        if self.attached:
+            table = "main.{}".format(table)
+        sql = """
+            CREATE {temp}TRIGGER {trigger_name} AFTER {action} ON {table} BEGIN
                 INSERT INTO {history_table} (
                     change_type,
                     content_type_id,
@@ -124,32 +440,44 @@ class SQLiteHistoryBackend(HistoryBackend):
                 SELECT
                     '{change_type}',
                     {ctid},
-                    {pk_ref}.{pk_col},
+                    {object_id},
                     {snapshot},
                     {changes},
                     {session_values}
-                WHERE _history_enabled();
+                WHERE _history_enabled({ctid});
             END;
             """.format(
-                trigger_name=tr_name,
-                action=trigger_type.name,
-                table=model._meta.db_table,
-                history_table=HistoryModel._meta.db_table,
-                change_type=trigger_type.value,
-                ctid=ct.pk,
-                pk_ref=trigger_type.pk_alias,
-                pk_col=model._meta.pk.column,
-                snapshot=self._json_snapshot(fields, trigger_type),
-                changes=self._json_changes(fields, trigger_type),
-                session_cols=", ".join(session_cols),
-                session_values=", ".join(session_values),
-            )
+            temp="TEMP " if self.attached else "",
+            trigger_name=tr_name,
+            action=trigger_type.name,
+            table=table,
+            # Not qualified (which triggers don't allow), so a temporary trigger inserts
+            # into the attached table, as long as there isn't one in the main database.
+            history_table=HistoryModel._meta.db_table,
+            change_type=trigger_type.value,
+            ctid=ct.pk,
+            object_id=self._object_id(model, trigger_type),
+            snapshot=self._json_snapshot(fields, trigger_type),
+            changes=self._json_changes(fields, trigger_type),
+            session_cols=", ".join(session_cols),
+            session_values=", ".join(session_values),
         )
-        return tr_name, [f.column for f in fields]
+        return tr_name, [f.column for f in fields], sql
+
+    def create_trigger(self, model, trigger_type):
+        tr_name, fields, sql = self.trigger_sql(model, trigger_type)
+        self.drop_trigger(model, trigger_type)
+        if sql:
+            self.execute(sql)
+        return tr_name, fields
 
     def drop_trigger(self, model, trigger_type):
-        self.execute(
-            "DROP TRIGGER IF EXISTS {trigger_name};".format(
-                trigger_name=self.trigger_name(model, trigger_type),
+        # Also drops triggers created before the history database was attached.
+        schemas = ["temp.", "main."] if self.attached else [""]
+        for schema in schemas:
+            self.execute(
+                "DROP TRIGGER IF EXISTS {schema}{trigger_name};".format(
+                    schema=schema,
+                    trigger_name=self.trigger_name(model, trigger_type),
+                )
             )
-        )
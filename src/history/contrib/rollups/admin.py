@@ -0,0 +1,28 @@
+from django.contrib import admin
+
+from .models import HistoryRollup
+
+
+class HistoryRollupAdmin(admin.ModelAdmin):
+    list_display = ["day", "content_type", "change_type", "user", "count"]
+    list_filter = ["change_type", "content_type", "history_model"]
+    date_hierarchy = "day"
+    ordering = ["-day", "content_type", "change_type", "user"]
+
+    def has_add_permission(self, request, obj=None):
+        return False
+
+    def has_change_permission(self, request, obj=None):
+        return False
+
+    def has_delete_permission(self, request, obj=None):
+        return False
+
+
+def register(site=admin.site):
+    """
+    Registers `HistoryRollupAdmin`. Like `history.admin.register`, this is called once
+    the app registry is ready (if `HISTORY_ADMIN_ENABLED`).
+    """
+    if not site.is_registered(HistoryRollup):
+        site.register(HistoryRollup, HistoryRollupAdmin)
@@ -0,0 +1,14 @@
+from django.apps import AppConfig, apps
+
+
+class HistoryRollupsConfig(AppConfig):
+    name = "history.contrib.rollups"
+    label = "history_rollups"
+
+    def ready(self):
+        from history import conf
+
+        if conf.ADMIN_ENABLED and apps.is_installed("django.contrib.admin"):
+            from .admin import register
+
+            register()
@@ -0,0 +1,78 @@
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+    initial = True
+
+    dependencies = [
+        ("contenttypes", "0002_remove_content_type_name"),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name="HistoryRollup",
+            fields=[
+                ("id", models.BigAutoField(primary_key=True, serialize=False)),
+                ("history_model", models.CharField(editable=False, max_length=100)),
+                ("day", models.DateField(editable=False)),
+                (
+                    "change_type",
+                    models.CharField(
+                        choices=[("I", "Insert"), ("D", "Delete"), ("U", "Update")],
+                        editable=False,
+                        max_length=1,
+                    ),
+                ),
+                (
+                    "user",
+                    models.CharField(
+                        blank=True, default="", editable=False, max_length=255
+                    ),
+                ),
+                (
+                    "count",
+                    models.PositiveBigIntegerField(default=0, editable=False),
+                ),
+                (
+                    "content_type",
+                    models.ForeignKey(
+                        editable=False,
+                        on_delete=django.db.models.deletion.CASCADE,
+                        related_name="+",
+                        to="contenttypes.contenttype",
+                    ),
+                ),
+            ],
+            options={
+                "db_table": "history_rollup",
+                "constraints": [
+                    models.UniqueConstraint(
+                        fields=(
+                            "history_model",
+                            "day",
+                            "content_type",
+                            "change_type",
+                            "user",
+                        ),
+                        name="history_rollup_key",
+                    )
+                ],
+            },
+        ),
+        migrations.CreateModel(
+            name="HistoryRollupPosition",
+            fields=[
+                (
+                    "history_model",
+                    models.CharField(max_length=100, primary_key=True, serialize=False),
+                ),
+                ("transaction_id", models.BigIntegerField(default=0)),
+                ("history_id", models.BigIntegerField(default=0)),
+                ("updated", models.DateTimeField(auto_now=True)),
+            ],
+            options={
+                "db_table": "history_rollup_position",
+            },
+        ),
+    ]
@@ -0,0 +1,80 @@
+from django.contrib.contenttypes.models import ContentType
+from django.db import models
+
+from history.models import TriggerType
+
+
+class HistoryRollupQuerySet(models.QuerySet):
+    def for_model(self, model):
+        """
+        Returns the counts for a single tracked model.
+        """
+        ct = ContentType.objects.db_manager(self.db).get_for_model(model)
+        return self.filter(content_type=ct)
+
+    def totals(self, *fields):
+        """
+        Returns the `total` number of changes grouped by `fields`, e.g.
+        `HistoryRollup.objects.filter(day__gte=start).totals("day", "change_type")`.
+        """
+        return (
+            self.values(*fields).annotate(total=models.Sum("count")).order_by(*fields)
+        )
+
+
+class HistoryRollup(models.Model):
+    """
+    The number of changes recorded per day, model, change type, and user, maintained by
+    `manage.py history rollup` (see `history.contrib.rollups.utils.rollup`).
+    """
+
+    id = models.BigAutoField(primary_key=True)
+    history_model = models.CharField(max_length=100, editable=False)
+    day = models.DateField(editable=False)
+    content_type = models.ForeignKey(
+        ContentType,
+        related_name="+",
+        on_delete=models.CASCADE,
+        editable=False,
+    )
+    change_type = models.CharField(
+        max_length=1, choices=TriggerType.choices, editable=False
+    )
+    user = models.CharField(max_length=255, blank=True, default="", editable=False)
+    count = models.PositiveBigIntegerField(default=0, editable=False)
+
+    objects = HistoryRollupQuerySet.as_manager()
+
+    class Meta:
+        db_table = "history_rollup"
+        constraints = [
+            models.UniqueConstraint(
+                fields=["history_model", "day", "content_type", "change_type", "user"],
+                name="history_rollup_key",
+            ),
+        ]
+
+    def __str__(self):
+        return "{} {} {}".format(
+            self.day, self.get_change_type_display(), self.content_type_id
+        )
+
+
+class HistoryRollupPosition(models.Model):
+    """
+    The feed position (see `HistoryBackend.feed`) each history model has been rolled up
+    to.
+    """
+
+    history_model = models.CharField(max_length=100, primary_key=True)
+    transaction_id = models.BigIntegerField(default=0)
+    history_id = models.BigIntegerField(default=0)
+    updated = models.DateTimeField(auto_now=True)
+
+    class Meta:
+        db_table = "history_rollup_position"
+
+    def __str__(self):
+        return "{} ({}:{})".format(
+            self.history_model, self.transaction_id, self.history_id
+        )
@@ -0,0 +1,110 @@
+from django.db import DEFAULT_DB_ALIAS, models, transaction
+from django.utils import timezone
+
+from history import get_history_model
+from history.backends import get_backend
+from history.backends.base import has_field
+from history.models import session_relation
+
+from .models import HistoryRollup, HistoryRollupPosition
+
+
+def rollup_user(HistoryModel):
+    """
+    Returns the lookup for the user of `HistoryModel` rows, or None.
+    """
+    if HistoryModel.USER_FIELD:
+        return HistoryModel.USER_FIELD
+    relation = session_relation(HistoryModel)
+    if relation is not None and relation.related_model.USER_FIELD:
+        return "{}__{}".format(relation.name, relation.related_model.USER_FIELD)
+    return None
+
+
+def rollup(HistoryModel=None, using=DEFAULT_DB_ALIAS, batch_size=1000):
+    """
+    Adds the `HistoryModel` rows recorded since the last rollup to the `HistoryRollup`
+    counts, following the history feed (see `HistoryBackend.feed`) in batches, each in
+    its own transaction along with the new position. Returns the number of rows counted.
+    """
+    backend = get_backend(using)
+    HistoryModel = HistoryModel or get_history_model()
+    label = HistoryModel._meta.label_lower
+    user = rollup_user(HistoryModel)
+    feed_fields = [
+        name for name in ("id", "transaction_id") if has_field(HistoryModel, name)
+    ]
+    rollups = HistoryRollup.objects.using(backend.alias)
+    total = 0
+    while True:
+        with transaction.atomic(using=backend.alias):
+            # Locking the position keeps concurrent rollups from double counting.
+            mark, _created = (
+                HistoryRollupPosition.objects.using(backend.alias)
+                .select_for_update()
+                .get_or_create(history_model=label)
+            )
+            position = (mark.transaction_id, mark.history_id)
+            feed = backend.feed_queryset(HistoryModel, position).only(*feed_fields)
+            entries = list(feed[:batch_size])
+            if not entries:
+                break
+            counts = (
+                HistoryModel.objects.using(backend.alias)
+                .filter(id__in=[entry.id for entry in entries])
+                .values(
+                    "content_type_id",
+                    "change_type",
+                    "session_date",
+                    rollup_user=(
+                        models.F(user)
+                        if user
+                        else models.Value(None, output_field=models.CharField())
+                    ),
+                )
+                .annotate(count=models.Count("id"))
+                .order_by()
+            )
+            added = {}
+            for row in counts:
+                # Grouped by session_date (one per session) rather than truncated in
+                # the database, since SQLite triggers record ISO 8601 dates.
+                day = row["session_date"]
+                if timezone.is_aware(day):
+                    day = timezone.localtime(day)
+                key = (
+                    day.date(),
+                    row["content_type_id"],
+                    row["change_type"],
+                    "" if row["rollup_user"] is None else str(row["rollup_user"]),
+                )
+                added[key] = added.get(key, 0) + row["count"]
+            existing = rollups.filter(
+                history_model=label,
+                day__in={key[0] for key in added},
+                content_type_id__in={key[1] for key in added},
+            )
+            updated = []
+            for row in existing:
+                key = (row.day, row.content_type_id, row.change_type, row.user)
+                if key in added:
+                    row.count += added.pop(key)
+                    updated.append(row)
+            rollups.bulk_update(updated, ["count"])
+            rollups.bulk_create(
+                HistoryRollup(
+                    history_model=label,
+                    day=day,
+                    content_type_id=ct_id,
+                    change_type=change_type,
+                    user=user_key,
+                    count=count,
+                )
+                for (day, ct_id, change_type, user_key), count in added.items()
+            )
+            mark.transaction_id, mark.history_id = backend.feed_position(entries[-1])
+            mark.save()
+            total += len(entries)
+        if len(entries) < batch_size:
+            break
+    return total
@@ -0,0 +1,284 @@
+import datetime
+import gzip
+import json
+import time
+
+from django.apps import apps
+from django.core.management.base import BaseCommand, CommandError
+from django.core.serializers.json import DjangoJSONEncoder
+from django.db import DEFAULT_DB_ALIAS, transaction
+from django.utils import dateparse, timezone
+
+from history import backends, get_history_models
+
+
+def parse_cutoff(value):
+    dt = dateparse.parse_datetime(value)
+    if dt is None:
+        date = dateparse.parse_date(value)
+        if date is None:
+            raise CommandError("Invalid date: {}".format(value))
+        dt = datetime.datetime.combine(date, datetime.time.min)
+    if timezone.is_naive(dt):
+        dt = timezone.make_aware(dt)
+    return dt
+
+
+def parse_position(value):
+    try:
+        txid, _sep, after_id = value.rpartition(":")
+        return (int(txid or 0), int(after_id))
+    except ValueError:
+        raise CommandError("Invalid position: {}".format(value))
+
+
+class Command(BaseCommand):
+    help = (
+        "Archives or compacts old history, in chunks, streams new history, or updates "
+        "history rollups."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "-q",
+            "--quiet",
+            action="store_true",
+            help="Suppresses all output.",
+        )
+        parser.add_argument(
+            "-d",
+            "--database",
+            default=DEFAULT_DB_ALIAS,
+            help="Which database to operate on. Defaults to `default`.",
+        )
+        subs = parser.add_subparsers(dest="action", required=True)
+        archive = subs.add_parser("archive")
+        archive.add_argument(
+            "--table",
+            help="Table to move history into (created if needed). Defaults to the "
+            "history table name with an `_archive` suffix.",
+        )
+        archive.add_argument(
+            "--file",
+            help="Gzipped JSON lines file to append history to, instead of a table.",
+        )
+        compact = subs.add_parser("compact")
+        feed = subs.add_parser("feed")
+        feed.add_argument(
+            "--model",
+            help="History model to stream (app_label.ModelName). Defaults to "
+            "HISTORY_MODEL.",
+        )
+        feed.add_argument(
+            "--after",
+            type=parse_position,
+            help="Resume after this position (TRANSACTION_ID:ID of the last entry).",
+        )
+        feed.add_argument(
+            "--batch-size",
+            type=int,
+            default=1000,
+            help="Number of history rows per query. Defaults to 1000.",
+        )
+        feed.add_argument(
+            "--follow",
+            action="store_true",
+            help="Keep waiting for new history instead of stopping when caught up.",
+        )
+        feed.add_argument(
+            "--interval",
+            type=float,
+            default=5,
+            help="Seconds between polls (or the longest wait for a notification) "
+            "with --follow. Defaults to 5.",
+        )
+        rollup = subs.add_parser("rollup")
+        rollup.add_argument(
+            "--model",
+            action="append",
+            help="History model to roll up (app_label.ModelName). Defaults to all "
+            "history models.",
+        )
+        rollup.add_argument(
+            "--batch-size",
+            type=int,
+            default=1000,
+            help="Number of history rows per transaction. Defaults to 1000.",
+        )
+        for sub in (archive, compact):
+            cutoff = sub.add_mutually_exclusive_group(required=True)
+            cutoff.add_argument(
+                "--before",
+                type=parse_cutoff,
+                help="Only process history recorded before this date or datetime.",
+            )
+            cutoff.add_argument(
+                "--days",
+                type=int,
+                help="Only process history older than this number of days.",
+            )
+            sub.add_argument(
+                "--model",
+                action="append",
+                help="History model to process (app_label.ModelName). Defaults to all "
+                "history models.",
+            )
+            sub.add_argument(
+                "--chunk-size",
+                type=int,
+                default=1000,
+                help="Number of history rows per transaction. Defaults to 1000.",
+            )
+            sub.add_argument(
+                "--after-id",
+                type=int,
+                default=0,
+                help="Resume after this history ID.",
+            )
+            sub.add_argument(
+                "--max-lag",
+                type=float,
+                help="Pause between chunks while replica replay lag is over this many "
+                "seconds (PostgreSQL only).",
+            )
+            sub.add_argument(
+                "--sleep",
+                type=float,
+                default=0,
+                help="Seconds to sleep between chunks. Defaults to 0.",
+            )
+
+    def log(self, options, message, verbosity=1):
+        if not options["quiet"] and options["verbosity"] >= verbosity:
+            self.stdout.write(message)
+
+    def throttle(self, backend, **options):
+        if options["sleep"]:
+            time.sleep(options["sleep"])
+        if options["max_lag"] is None:
+            return
+        while True:
+            lag = backend.replication_lag()
+            if lag is None or lag <= options["max_lag"]:
+                break
+            self.log(options, "Replication lag is {:.1f}s, waiting".format(lag), 2)
+            time.sleep(min(lag, 10))
+
+    def process(self, backend, HistoryModel, func, **options):
+        """
+        Calls `func(ids)` for each chunk of old history, each in its own transaction.
+        Returns the total of the values returned by `func`.
+        """
+        before = options["before"] or (
+            timezone.now() - datetime.timedelta(days=options["days"])
+        )
+        after_id = options["after_id"]
+        total = 0
+        while True:
+            with transaction.atomic(using=backend.alias):
+                ids = backend.history_chunk(
+                    HistoryModel, before, after_id, options["chunk_size"]
+                )
+                if not ids:
+                    break
+                total += func(ids, before)
+            after_id = ids[-1]
+            self.log(
+                options,
+                "  {} through ID {}".format(HistoryModel._meta.db_table, after_id),
+                2,
+            )
+            self.throttle(backend, **options)
+        return total
+
+    def get_history_models(self, **options):
+        if not options["model"]:
+            return get_history_models()
+        return [apps.get_model(label) for label in options["model"]]
+
+    def handle_archive(self, backend, **options):
+        if options["table"] and options["file"]:
+            raise CommandError("Specify either --table or --file, not both.")
+        file = gzip.open(options["file"], "at") if options["file"] else None
+        try:
+            for HistoryModel in self.get_history_models(**options):
+                table = None
+                if not file:
+                    table = options["table"] or "{}_archive".format(
+                        HistoryModel._meta.db_table
+                    )
+                    backend.create_archive_table(HistoryModel, table)
+
+                def archive(ids, before):
+                    backend.archive_chunk(HistoryModel, ids, table=table, file=file)
+                    if file:
+                        # Written before the rows are deleted, so nothing is lost (but
+                        # a chunk may be written twice) if the transaction fails.
+                        file.flush()
+                    return len(ids)
+
+                count = self.process(backend, HistoryModel, archive, **options)
+                self.log(
+                    options,
+                    "Archived {} history entries from {}".format(
+                        count, HistoryModel._meta.db_table
+                    ),
+                )
+        finally:
+            if file:
+                file.close()
+
+    def handle_compact(self, backend, **options):
+        for HistoryModel in self.get_history_models(**options):
+
+            def compact(ids, before):
+                return backend.compact_chunk(HistoryModel, ids, before)
+
+            count = self.process(backend, HistoryModel, compact, **options)
+            self.log(
+                options,
+                "Removed {} history entries from {}".format(
+                    count, HistoryModel._meta.db_table
+                ),
+            )
+
+    def handle_feed(self, backend, **options):
+        HistoryModel = apps.get_model(options["model"]) if options["model"] else None
+        batches = backend.feed(
+            HistoryModel,
+            position=options["after"],
+            batch_size=options["batch_size"],
+            wait=options["interval"] if options["follow"] else None,
+        )
+        try:
+            for entries, _position in batches:
+                for entry in entries:
+                    row = {
+                        f.attname: getattr(entry, f.attname)
+                        for f in entry._meta.concrete_fields
+                    }
+                    row["model"] = entry._meta.label_lower
+                    self.stdout.write(json.dumps(row, cls=DjangoJSONEncoder))
+                self.stdout.flush()
+        except KeyboardInterrupt:
+            pass
+
+    def handle_rollup(self, backend, **options):
+        if not apps.is_installed("history.contrib.rollups"):
+            raise CommandError("History rollups require history.contrib.rollups.")
+        from history.contrib.rollups.utils import rollup
+
+        for HistoryModel in self.get_history_models(**options):
+            count = rollup(
+                HistoryModel, using=backend.alias, batch_size=options["batch_size"]
+            )
+            self.log(
+                options,
+                "Rolled up {} history entries from {}".format(
+                    count, HistoryModel._meta.db_table
+                ),
+            )
+
+    def handle(self, **options):
+        backend = backends.get_backend(options["database"], cache=False)
+        getattr(self, "handle_{}".format(options["action"]))(backend, **options)
@@ -1,7 +1,13 @@
-from django.core.management.base import BaseCommand
-from django.db import DEFAULT_DB_ALIAS
+import textwrap
+import time
+import warnings
 
-from history import backends
+from django.contrib.contenttypes.models import ContentType
+from django.core.management.base import BaseCommand, CommandError
+from django.db import DEFAULT_DB_ALIAS, transaction
+from django.template.defaultfilters import filesizeformat
+
+from history import backends, conf
 from history.models import TriggerType
 
 
@@ -28,10 +34,39 @@ class Command(BaseCommand):
         subs.add_parser("enable")
         subs.add_parser("disable")
         subs.add_parser("session")
+        plan = subs.add_parser("plan")
+        plan.add_argument(
+            "--no-sql",
+            action="store_true",
+            help="Only output the estimates, not the SQL.",
+        )
+        consume = subs.add_parser("consume")
+        consume.add_argument(
+            "--batch-size",
+            type=int,
+            default=1000,
+            help="Number of changes to decode per batch. Defaults to 1000.",
+        )
+        consume.add_argument(
+            "--interval",
+            type=float,
+            default=1.0,
+            help="Seconds to wait when there are no changes. Defaults to 1.",
+        )
+        consume.add_argument(
+            "--once",
+            action="store_true",
+            help="Exit once all available changes have been consumed.",
+        )
+
+    def warn_skipped(self, backend):
+        for model, error in backend.skipped_models():
+            warnings.warn("Skipping {}: {}".format(model._meta.label, error))
 
     def handle_enable(self, backend, **options):
         if options["clear"]:
             backend.clear()
+        self.warn_skipped(backend)
         backend.install()
         for model in backend.get_models():
             if not options["quiet"]:
@@ -53,11 +88,80 @@ class Command(BaseCommand):
         if options["clear"]:
             backend.clear()
 
+    def write_sql(self, statements, **options):
+        if options["quiet"] or options["no_sql"]:
+            return
+        for sql, params in statements:
+            if params:
+                sql = sql % tuple("'{}'".format(p) for p in params)
+            print(textwrap.dedent(sql).strip().rstrip(";") + ";")
+
+    def handle_plan(self, backend, **options):
+        # Building triggers may create content types, which are rolled back along with
+        # anything else that isn't captured.
+        with transaction.atomic(using=backend.alias):
+            try:
+                self.plan(backend, **options)
+            finally:
+                transaction.set_rollback(True, using=backend.alias)
+                ContentType.objects.clear_cache()
+
+    def plan(self, backend, **options):
+        self.warn_skipped(backend)
+        with backend.capture() as statements:
+            backend.install()
+        self.write_sql(statements, **options)
+        total_rows = total_bytes = 0
+        for model in backend.get_models():
+            columns = set()
+            with backend.capture() as statements:
+                for trigger_type in TriggerType:
+                    _name, fields = backend.create_trigger(model, trigger_type)
+                    if fields:
+                        columns.update(fields)
+            snapshot_size, writes = backend.table_stats(model, columns)
+            if not conf.SNAPSHOTS:
+                snapshot_size = None
+            if not options["quiet"]:
+                print(
+                    "-- {} ({}): {} columns".format(
+                        model._meta.label, model._meta.db_table, len(columns)
+                    )
+                )
+                if snapshot_size is not None:
+                    print("--   ~{} bytes per snapshot".format(snapshot_size))
+            if writes is not None:
+                rows = sum(writes.values())
+                size = rows * (backend.history_row_size + (snapshot_size or 0))
+                total_rows += rows
+                total_bytes += size
+                if not options["quiet"]:
+                    print(
+                        "--   {:.0f} inserts, {:.0f} updates, "
+                        "{:.0f} deletes/day".format(
+                            writes[TriggerType.INSERT],
+                            writes[TriggerType.UPDATE],
+                            writes[TriggerType.DELETE],
+                        )
+                    )
+                    print(
+                        "--   ~{:.0f} history rows ({})/day".format(
+                            rows, filesizeformat(size)
+                        )
+                    )
+            self.write_sql(statements, **options)
+        if total_rows and not options["quiet"]:
+            print(
+                "-- Total: ~{:.0f} history rows ({})/day".format(
+                    total_rows, filesizeformat(total_bytes)
+                )
+            )
+
     def handle_session(self, backend, **options):
         conn = backend.conn
         fields = {}
         for f in backend.session_fields():
-            if f.name in ("session_id", "session_date"):
+            if f.name in ("session_id", "session_date", "statement_id"):
                 continue
             value = input("{} [{}]: ".format(f.name, f.db_type(conn)))
             fields[f.name] = value
@@ -65,6 +169,22 @@ class Command(BaseCommand):
         sql, params = s.start_sql()
         print(sql % tuple("'{}'".format(p) for p in params))
 
+    def handle_consume(self, backend, **options):
+        if not hasattr(backend, "consume"):
+            raise CommandError(
+                "{} does not support consuming changes.".format(
+                    backend.__class__.__name__
+                )
+            )
+        while True:
+            count = backend.consume(options["batch_size"])
+            if count and not options["quiet"]:
+                print("Recorded {} history entries".format(count))
+            if not count:
+                if options["once"]:
+                    break
+                time.sleep(options["interval"])
+
     def handle(self, **options):
         backend = backends.get_backend(options["database"], cache=False)
         action = options.get("action") or "enable"
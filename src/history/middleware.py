@@ -1,3 +1,8 @@
+import contextlib
+import uuid
+
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction
+from django.utils import timezone
 from django.utils.module_loading import import_string
 
 from . import backends, conf
@@ -5,10 +10,18 @@ from . import backends, conf
 
 class HistoryMiddleware:
     """
-    Middleware that creates a temporary table for a connection and puts the current
-    User ID in there.
+    Middleware that starts a history session for each request, with context from
+    `HISTORY_REQUEST_CONTEXT`. Under ASGI, the session is only started (in a thread)
+    if the request writes to the database.
+
+    If `HISTORY_MIDDLEWARE_DATABASES` is set, a session (sharing the same session_id
+    and session_date) is entered for each of those database aliases instead, and each
+    is only started if the request writes to that database.
     """
 
+    sync_capable = True
+    async_capable = True
+
     def __init__(self, get_response=None):
         self.get_response = get_response
         self.get_context = (
@@ -16,13 +29,50 @@ class HistoryMiddleware:
             if callable(conf.REQUEST_CONTEXT)
             else import_string(conf.REQUEST_CONTEXT)
         )
+        self.async_mode = iscoroutinefunction(self.get_response)
+        if self.async_mode:
+            markcoroutinefunction(self)
 
-    def __call__(self, request):
-        for prefix in conf.MIDDLEWARE_IGNORE:
-            if prefix and request.path.startswith(prefix):
-                return self.get_response(request)
+    def ignored(self, request):
+        return any(
+            prefix and request.path.startswith(prefix)
+            for prefix in conf.MIDDLEWARE_IGNORE
+        )
 
-        backend = backends.get_backend()
+    def sessions(self, request):
         context = self.get_context(request) or {}
-        with backend.session(**context):
+        if conf.MIDDLEWARE_DATABASES is None:
+            return [backends.get_backend().session(**context)]
+        context = {
+            "session_id": uuid.uuid4().hex,
+            "session_date": timezone.now().isoformat(),
+            **context,
+        }
+        return [
+            backends.get_backend(alias).session(**context)
+            for alias in conf.MIDDLEWARE_DATABASES
+        ]
+
+    def __call__(self, request):
+        if self.async_mode:
+            return self.__acall__(request)
+
+        if self.ignored(request):
+            return self.get_response(request)
+
+        with contextlib.ExitStack() as stack:
+            for session in self.sessions(request):
+                if conf.MIDDLEWARE_DATABASES is None:
+                    stack.enter_context(session)
+                else:
+                    stack.enter_context(session.lazily())
             return self.get_response(request)
+
+    async def __acall__(self, request):
+        if self.ignored(request):
+            return await self.get_response(request)
+
+        async with contextlib.AsyncExitStack() as stack:
+            for session in self.sessions(request):
+                await stack.enter_async_context(session)
+            return await self.get_response(request)
@@ -0,0 +1,26 @@
+from django.db import migrations
+
+import history.models
+
+
+class Migration(migrations.Migration):
+    dependencies = [
+        ("history", "0001_initial"),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name="objecthistory",
+            name="snapshot",
+            field=history.models.HistoryJSONField(
+                blank=True, editable=False, null=True
+            ),
+        ),
+        migrations.AlterField(
+            model_name="objecthistory",
+            name="changes",
+            field=history.models.HistoryJSONField(
+                blank=True, editable=False, null=True
+            ),
+        ),
+    ]
@@ -0,0 +1,15 @@
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+    dependencies = [
+        ("history", "0002_history_json_fields"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="objecthistory",
+            name="statement_id",
+            field=models.UUIDField(blank=True, editable=False, null=True),
+        ),
+    ]
@@ -0,0 +1,15 @@
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+    dependencies = [
+        ("history", "0003_objecthistory_statement_id"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="objecthistory",
+            name="transaction_id",
+            field=models.BigIntegerField(blank=True, editable=False, null=True),
+        ),
+    ]
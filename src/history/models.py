@@ -1,10 +1,14 @@
+import hashlib
+
 from django.conf import settings
 from django.contrib.contenttypes.fields import GenericForeignKey
 from django.contrib.contenttypes.models import ContentType
-from django.db import models
+from django.db import DEFAULT_DB_ALIAS, NotSupportedError, connections, models
+from django.db.models.fields.json import KeyTransform
 from django.utils.translation import gettext_lazy as _
 
-from .utils import get_history_model
+from . import conf
+from .utils import get_history_model, sqlite_jsonb, sqlite_supports_jsonb
 
 
 class TriggerType(models.TextChoices):
@@ -25,6 +29,221 @@ class TriggerType(models.TextChoices):
         return "OLD" if self in (TriggerType.UPDATE, TriggerType.DELETE) else "NEW"
 
 
+def truncate_value(value, size):
+    """
+    Returns the marker that a string longer than `size` characters is recorded as when
+    `HISTORY_MAX_VALUE_SIZE` is set, matching the one built by the database triggers.
+    """
+    if not isinstance(value, str) or len(value) <= size:
+        return value
+    return {
+        "__truncated__": value[:size],
+        "md5": hashlib.md5(value.encode()).hexdigest(),
+        "size": len(value),
+    }
+
+
+class TruncatedValue(str):
+    """
+    A string value that was truncated when it was recorded (see
+    `HISTORY_MAX_VALUE_SIZE`). Compares equal to the full value (using its md5 digest)
+    and to other truncated values of it, but not to the prefix it holds. Truncated
+    values hash their md5 digest, so they can be used in sets and as keys alongside
+    other truncated values; since the full value isn't known, they don't hash like it.
+    """
+
+    def __new__(cls, prefix, md5, size):
+        value = super().__new__(cls, prefix)
+        value.md5 = md5
+        value.size = size
+        return value
+
+    def __eq__(self, other):
+        if isinstance(other, TruncatedValue):
+            return self.md5 == other.md5
+        if isinstance(other, str):
+            return hashlib.md5(other.encode()).hexdigest() == self.md5
+        return NotImplemented
+
+    def __ne__(self, other):
+        equal = self.__eq__(other)
+        return equal if equal is NotImplemented else not equal
+
+    def __hash__(self):
+        return hash(self.md5)
+
+    def __repr__(self):
+        return "<TruncatedValue {}... ({} characters)>".format(
+            str.__repr__(self), self.size
+        )
+
+
+def _decode(value):
+    if isinstance(value, dict) and "__truncated__" in value:
+        return TruncatedValue(value["__truncated__"], value["md5"], value["size"])
+    return value
+
+
+def _encode(value):
+    if isinstance(value, TruncatedValue):
+        return {"__truncated__": str(value), "md5": value.md5, "size": value.size}
+    return value
+
+
+def _map_values(data, func):
+    # Snapshots are {column: value}, and changes are {column: [old, new]}.
+    if not isinstance(data, dict):
+        return data
+    return {
+        key: [func(v) for v in value] if isinstance(value, list) else func(value)
+        for key, value in data.items()
+    }
+
+
+class HistoryJSONField(models.JSONField):
+    """
+    A JSONField for snapshots and changes that decodes truncated values into
+    `TruncatedValue` instances, and SQLite JSONB (see `HISTORY_SQLITE_JSONB`).
+    """
+
+    def db_check(self, connection):
+        if sqlite_supports_jsonb(connection):
+            # Also allow JSONB blobs (flag 4), not only RFC 8259 text (flag 1).
+            return '(JSON_VALID("{col}", 5) OR "{col}" IS NULL)'.format(col=self.column)
+        return super().db_check(connection)
+
+    def select_format(self, compiler, sql, params):
+        sql, params = super().select_format(compiler, sql, params)
+        if sqlite_jsonb(compiler.connection):
+            # Key transforms (and rows recorded before JSONB was enabled) are not blobs.
+            sql = "CASE WHEN typeof({0}) = 'blob' THEN json({0}) ELSE {0} END".format(
+                sql
+            )
+            return sql, (*params, *params, *params)
+        return sql, params
+
+    def from_db_value(self, value, expression, connection):
+        if isinstance(value, (str, bytes)):
+            value = super().from_db_value(value, expression, connection)
+        # Other values were already decoded (e.g. numbers extracted by SQLite).
+        return _map_values(value, _decode)
+
+    def get_prep_value(self, value):
+        return super().get_prep_value(_map_values(value, _encode))
+
+
+@HistoryJSONField.register_lookup
+class PathExists(models.Lookup):
+    """
+    Whether a JSON path matches anything, using the PostgreSQL `@?` operator (which can
+    use GIN indexes with either the `jsonb_ops` or `jsonb_path_ops` operator class).
+    """
+
+    lookup_name = "path_exists"
+    prepare_rhs = False
+
+    def as_sql(self, compiler, connection):
+        raise NotSupportedError("path_exists is only supported on PostgreSQL.")
+
+    def as_postgresql(self, compiler, connection):
+        lhs, lhs_params = self.process_lhs(compiler, connection)
+        rhs, rhs_params = self.process_rhs(compiler, connection)
+        return "{} @? {}::jsonpath".format(lhs, rhs), (*lhs_params, *rhs_params)
+
+
+class HistoryQuerySet(models.QuerySet):
+    def for_object(self, obj):
+        """
+        Returns history for a single object.
+        """
+        using = obj._state.db or self.db
+        ct = ContentType.objects.db_manager(using).get_for_model(obj.__class__)
+        object_id = obj.pk
+        if getattr(obj._meta, "is_composite_pk", False):
+            # Composite keys are formatted as JSON by the database.
+            from history.backends import get_backend
+
+            object_id = get_backend(using).object_id(obj)
+        return self.filter(content_type=ct, object_id=object_id)
+
+    def for_statement(self, statement_id):
+        """
+        Returns the history recorded by a single statement (see
+        `HistorySession.statement`).
+        """
+        return self.filter(statement_id=statement_id)
+
+    def revert(self, **context):
+        """
+        Reverts the objects changed by this history to their state before the earliest
+        of these changes, and returns the (new) session the changes were made in.
+        """
+        from history.backends import get_backend
+
+        return get_backend(self.db).revert(self, **context)
+
+    def _is_postgres(self):
+        return connections[self.db].vendor == "postgresql"
+
+    def _changed_q(self, fields):
+        if not self._is_postgres():
+            return models.Q(changes__has_any_keys=list(fields))
+        q = models.Q()
+        for field in fields:
+            field = field.replace("\\", "\\\\").replace('"', '\\"')
+            q |= models.Q(changes__path_exists='$."{}"'.format(field))
+        return q
+
+    def changed_field(self, *fields):
+        """
+        Returns updates that changed any of the specified fields (columns).
+        """
+        return self.filter(self._changed_q(fields))
+
+    def _changed_value(self, field, index, value):
+        qs = self
+        if self._is_postgres():
+            # Containment can use a GIN index on changes to narrow down the rows, but
+            # matches either the old or new value.
+            qs = qs.filter(changes__contains={field: [value]})
+        return qs.alias(
+            _changed_value=KeyTransform(str(index), KeyTransform(field, "changes"))
+        ).filter(_changed_value=value)
+
+    def changed_from(self, field, value):
+        """
+        Returns updates that changed `field` from `value`.
+        """
+        return self._changed_value(field, 0, value)
+
+    def changed_to(self, field, value):
+        """
+        Returns updates that changed `field` to `value`.
+        """
+        return self._changed_value(field, 1, value)
+
+    def field_timeline(self, obj, field):
+        """
+        Returns the history of `obj` where `field` was set (the insert, and updates
+        that changed it), in order, annotated with the new `value` of the field.
+        """
+        return (
+            self.for_object(obj)
+            .filter(models.Q(change_type=TriggerType.INSERT) | self._changed_q([field]))
+            .annotate(
+                value=models.Case(
+                    models.When(
+                        change_type=TriggerType.INSERT,
+                        then=KeyTransform(field, "snapshot"),
+                    ),
+                    default=KeyTransform("1", KeyTransform(field, "changes")),
+                    output_field=HistoryJSONField(),
+                )
+            )
+            .order_by("session_date", "id")
+        )
+
+
 class AbstractObjectHistory(models.Model):
     id = models.BigAutoField(primary_key=True)
     session_id = models.UUIDField(editable=False)
@@ -39,11 +258,13 @@ class AbstractObjectHistory(models.Model):
         editable=False,
     )
     object_id = models.BigIntegerField(editable=False)
-    snapshot = models.JSONField(null=True, blank=True, editable=False)
-    changes = models.JSONField(null=True, blank=True, editable=False)
+    snapshot = HistoryJSONField(null=True, blank=True, editable=False)
+    changes = HistoryJSONField(null=True, blank=True, editable=False)
 
     source = GenericForeignKey("content_type", "object_id")
 
+    objects = HistoryQuerySet.as_manager()
+
     USER_FIELD = None
 
     class Meta:
@@ -54,7 +275,13 @@ class AbstractObjectHistory(models.Model):
         get_latest_by = ["session_date", "id"]
 
     def get_user(self):
-        return getattr(self, self.USER_FIELD) if self.USER_FIELD else None
+        if self.USER_FIELD:
+            return getattr(self, self.USER_FIELD)
+        relation = session_relation(self.__class__)
+        if relation is not None:
+            session = getattr(self, relation.name)
+            return session.get_user() if session else None
+        return None
 
     def __str__(self):
         # Use the ContentType cache instead of FK lookups every time.
@@ -68,7 +295,101 @@ class AbstractObjectHistory(models.Model):
         )
 
 
-class ObjectHistory(AbstractObjectHistory):
+class AbstractHistorySession(models.Model):
+    """
+    Session context (such as the user), stored once per session instead of on every
+    history row, for history models with a `SessionRelation` to it. A row is inserted
+    when a session is started.
+    """
+
+    id = models.UUIDField(primary_key=True, editable=False)
+    session_date = models.DateTimeField(editable=False)
+
+    USER_FIELD = None
+
+    class Meta:
+        abstract = True
+        get_latest_by = "session_date"
+
+    def get_user(self):
+        return getattr(self, self.USER_FIELD) if self.USER_FIELD else None
+
+    def __str__(self):
+        return str(self.id)
+
+
+class SessionRelation(models.ForeignObject):
+    """
+    Relates history rows to a session model (see `AbstractHistorySession`) through the
+    `session_id` column, without a database constraint, e.g.
+    `session = SessionRelation("myapp.HistorySession")`.
+    """
+
+    def __init__(self, to, **kwargs):
+        kwargs.setdefault("on_delete", models.DO_NOTHING)
+        kwargs.setdefault("from_fields", ["session_id"])
+        kwargs.setdefault("to_fields", ["id"])
+        kwargs.setdefault("null", True)
+        kwargs.setdefault("editable", False)
+        super().__init__(to, **kwargs)
+
+
+def session_relation(HistoryModel):
+    """
+    Returns the `SessionRelation` of a history model, if its session context is stored
+    in a session model.
+    """
+    for field in HistoryModel._meta.get_fields():
+        if isinstance(field, SessionRelation):
+            return field
+    return None
+
+
+class AbstractAppendOnlyObjectHistory(AbstractObjectHistory):
+    """
+    An object history model without a foreign key constraint on `content_type`, so
+    trigger inserts don't need to check (and lock) `django_content_type` rows. Pair with
+    `HISTORY_STORAGE_PROFILE = "append"` on PostgreSQL.
+    """
+
+    content_type = models.ForeignKey(
+        ContentType,
+        related_name="+",
+        on_delete=models.DO_NOTHING,
+        db_constraint=False,
+        editable=False,
+    )
+
+    class Meta(AbstractObjectHistory.Meta):
+        abstract = True
+
+
+class StatementHistoryMixIn(models.Model):
+    """
+    Adds the `statement_id` that tags history recorded in a statement (see
+    `HistorySession.statement`) to a history model. Without it, history recorded in a
+    statement can't be told apart from the rest of its session.
+    """
+
+    statement_id = models.UUIDField(null=True, blank=True, editable=False)
+
+    class Meta:
+        abstract = True
+
+
+class FeedHistoryMixIn(models.Model):
+    """
+    Adds the `transaction_id` that orders the history feed on PostgreSQL (see
+    `HistoryBackend.feed` and `HISTORY_FEED`) to a history model.
+    """
+
+    transaction_id = models.BigIntegerField(null=True, blank=True, editable=False)
+
+    class Meta:
+        abstract = True
+
+
+class ObjectHistory(StatementHistoryMixIn, FeedHistoryMixIn, AbstractObjectHistory):
     user = models.ForeignKey(
         settings.AUTH_USER_MODEL,
         null=True,
@@ -90,12 +411,102 @@ class ObjectHistory(AbstractObjectHistory):
 class HistoryDescriptor:
     def __get__(self, instance, owner=None):
         using = instance._state.db if instance else None
-        ct = ContentType.objects.db_manager(using).get_for_model(instance or owner)
-        qs = get_history_model().objects.filter(content_type=ct)
+        model = owner if owner is not None else instance.__class__
+        ct = ContentType.objects.db_manager(using).get_for_model(model)
+        qs = get_history_model(model).objects.filter(content_type=ct)
         if instance:
-            qs = qs.filter(object_id=instance.pk)
+            object_id = instance.pk
+            if getattr(model._meta, "is_composite_pk", False):
+                # Composite keys are formatted as JSON by the database.
+                from history.backends import get_backend
+
+                backend = get_backend(using or DEFAULT_DB_ALIAS)
+                object_id = backend.object_id(instance)
+            qs = qs.filter(object_id=object_id)
         return qs
 
 
+class ContentTypeID(models.Expression):
+    """
+    The content type ID of `model`, looked up in the database the query is run on.
+    """
+
+    output_field = models.IntegerField()
+
+    def __init__(self, model):
+        super().__init__()
+        self.model = model
+
+    def as_sql(self, compiler, connection):
+        ct = ContentType.objects.db_manager(connection.alias).get_for_model(self.model)
+        return "%s", [ct.pk]
+
+
+class LatestHistory(models.Expression):
+    """
+    A field of each object's latest history entry, for annotating querysets of tracked
+    models, e.g. `Author.objects.annotate(modified=LatestHistory("session_date"))`.
+    Reads the `HISTORY_LATEST` summary table where enabled, otherwise the history table.
+    """
+
+    def __init__(self, field_name):
+        super().__init__()
+        self.field_name = field_name
+        self.pk = self.fallback = None
+
+    def get_source_expressions(self):
+        return [self.pk, self.fallback] if self.pk is not None else []
+
+    def set_source_expressions(self, exprs):
+        if exprs:
+            self.pk, self.fallback = exprs
+
+    def resolve_expression(
+        self, query=None, allow_joins=True, reuse=None, summarize=False, for_save=False
+    ):
+        c = self.copy()
+        c.is_summary = summarize
+        HistoryModel = get_history_model(query.model)
+        field = HistoryModel._meta.get_field(self.field_name)
+        c.output_field = field.target_field if field.is_relation else field
+        c.column = field.column
+        c.table = "{}_latest".format(HistoryModel._meta.db_table)
+        c.ct_id = ContentTypeID(query.model)
+        c.pk = models.F("pk").resolve_expression(query, allow_joins, reuse, summarize)
+        c.fallback = models.Subquery(
+            HistoryModel.objects.filter(
+                content_type_id=c.ct_id, object_id=models.OuterRef("pk")
+            )
+            .order_by("-id")
+            .values(self.field_name)[:1]
+        ).resolve_expression(query, allow_joins, reuse, summarize)
+        return c
+
+    def as_sql(self, compiler, connection):
+        if not (conf.LATEST and connection.vendor == "postgresql"):
+            return compiler.compile(self.fallback)
+        ct_sql, ct_params = compiler.compile(self.ct_id)
+        pk_sql, pk_params = compiler.compile(self.pk)
+        sql = (
+            "(SELECT {column} FROM {table} "
+            "WHERE content_type_id = {ct_id} AND object_id = {pk})"
+        )
+        return (
+            sql.format(column=self.column, table=self.table, ct_id=ct_sql, pk=pk_sql),
+            [*ct_params, *pk_params],
+        )
+
+
 class HistoryMixIn:
     history = HistoryDescriptor()
+
+    @property
+    def latest_history(self):
+        """
+        The latest history entry for this object, or None. With `HISTORY_LATEST`, this
+        is read from the summary table, and the snapshot and changes are only loaded
+        if accessed.
+        """
+        from history.backends import get_backend
+
+        return get_backend(self._state.db or DEFAULT_DB_ALIAS).latest_history(self)
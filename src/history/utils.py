@@ -1,18 +1,50 @@
 from django.apps import apps
-from django.conf import settings
 from django.db import models
 
+from history import conf
 
-def get_history_model():
-    return apps.get_model(
-        getattr(settings, "HISTORY_MODEL", "history.ObjectHistory"),
-        require_ready=False,
-    )
+
+def get_history_model(model=None):
+    """
+    Returns the object history model. If `model` is specified, `HISTORY_ROUTES` is
+    checked for a history model specific to that model (or its app).
+    """
+    label = conf.MODEL
+    if model is not None:
+        routes = conf.ROUTES
+        opts = model._meta
+        label = routes.get(opts.label_lower, routes.get(opts.app_label, label))
+    return apps.get_model(label, require_ready=False)
+
+
+def get_history_models():
+    """
+    Returns a list of all object history models in use, starting with the default.
+    """
+    history_models = [get_history_model()]
+    for label in conf.ROUTES.values():
+        HistoryModel = apps.get_model(label, require_ready=False)
+        if HistoryModel not in history_models:
+            history_models.append(HistoryModel)
+    return history_models
+
+
+def get_user_field(HistoryModel):
+    """
+    Returns the name of the session context field that records the user, which is on
+    the session model for history models with a `SessionRelation`.
+    """
+    from history.models import session_relation
+
+    if HistoryModel.USER_FIELD:
+        return HistoryModel.USER_FIELD
+    relation = session_relation(HistoryModel)
+    return relation.related_model.USER_FIELD if relation is not None else None
 
 
 def get_request_context(request):
     try:
-        field = get_history_model().USER_FIELD
+        field = get_user_field(get_history_model())
         return {field: request.user} if field else {}
     except AttributeError:
         return {}
@@ -20,3 +52,21 @@ def get_request_context(request):
 
 def default_filter(model, field, trigger_type):
     return not isinstance(field, models.BinaryField)
+
+
+def sqlite_supports_jsonb(connection):
+    """
+    Whether the connection is to an SQLite database that supports JSONB (3.45+).
+    """
+    return (
+        connection.vendor == "sqlite"
+        and connection.Database.sqlite_version_info >= (3, 45, 0)
+    )
+
+
+def sqlite_jsonb(connection):
+    """
+    Whether history on this connection is stored as SQLite JSONB, which is enabled by
+    `HISTORY_SQLITE_JSONB`. Older SQLite versions store text JSON.
+    """
+    return conf.SQLITE_JSONB and sqlite_supports_jsonb(connection)
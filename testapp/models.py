@@ -1,9 +1,18 @@
 import uuid
 
+import django
 from django.db import models
 from django.utils import timezone
 
-from history.models import AbstractObjectHistory, HistoryMixIn
+from history.models import (
+    AbstractAppendOnlyObjectHistory,
+    AbstractHistorySession,
+    AbstractObjectHistory,
+    FeedHistoryMixIn,
+    HistoryMixIn,
+    SessionRelation,
+    StatementHistoryMixIn,
+)
 
 
 class CustomHistory(AbstractObjectHistory):
@@ -16,6 +25,55 @@ class CustomHistory(AbstractObjectHistory):
         db_table = "custom_history"
 
 
+class AppendHistory(AbstractAppendOnlyObjectHistory):
+    username = models.TextField()
+
+    USER_FIELD = "username"
+
+    class Meta(AbstractAppendOnlyObjectHistory.Meta):
+        db_table = "append_history"
+
+
+class AttachedHistory(AbstractAppendOnlyObjectHistory):
+    username = models.TextField()
+
+    USER_FIELD = "username"
+
+    class Meta(AbstractAppendOnlyObjectHistory.Meta):
+        db_table = "attached_history"
+
+
+class UUIDHistory(FeedHistoryMixIn, AbstractObjectHistory):
+    object_id = models.UUIDField()
+
+    class Meta(AbstractObjectHistory.Meta):
+        db_table = "uuid_history"
+
+
+class KeyedHistory(FeedHistoryMixIn, AbstractObjectHistory):
+    object_id = models.TextField()
+
+    class Meta(AbstractObjectHistory.Meta):
+        db_table = "keyed_history"
+
+
+class HistorySessionRecord(AbstractHistorySession):
+    username = models.TextField()
+    extra = models.TextField(null=True, blank=True)
+
+    USER_FIELD = "username"
+
+    class Meta(AbstractHistorySession.Meta):
+        db_table = "history_session"
+
+
+class SessionHistory(StatementHistoryMixIn, AbstractObjectHistory):
+    session = SessionRelation(HistorySessionRecord)
+
+    class Meta(AbstractObjectHistory.Meta):
+        db_table = "session_history"
+
+
 class Author(models.Model, HistoryMixIn):
     name = models.CharField(max_length=100)
     picture = models.BinaryField(null=True, blank=True)
@@ -46,3 +104,17 @@ class UnmanagedHistory(AbstractObjectHistory):
 
 class Untracked(models.Model):
     name = models.CharField(max_length=100)
+
+
+class Document(models.Model, HistoryMixIn):
+    id = models.UUIDField(primary_key=True, default=uuid.uuid4)
+    title = models.CharField(max_length=100)
+
+
+if django.VERSION >= (5, 2):
+
+    class Shelf(models.Model, HistoryMixIn):
+        pk = models.CompositePrimaryKey("room", "number")
+        room = models.CharField(max_length=20)
+        number = models.IntegerField()
+        label = models.CharField(max_length=100)
@@ -0,0 +1,14 @@
+from django.conf import settings
+
+
+class AttachedHistoryRouter:
+    """
+    Creates the `AttachedHistory` table only in the "history" database (and nothing
+    else there), which is attached to SQLite connections by `HISTORY_SQLITE_ATTACH`.
+    """
+
+    def allow_migrate(self, db, app_label, model_name=None, **hints):
+        if "history" not in settings.DATABASES:
+            return None
+        attached = app_label == "testapp" and model_name == "attachedhistory"
+        return attached == (db == "history")
@@ -14,6 +14,7 @@ INSTALLED_APPS = [
     "django.contrib.messages",
     "django.contrib.staticfiles",
     "history",
+    "history.contrib.rollups",
     "testapp",
 ]
 
@@ -53,8 +54,18 @@ if os.getenv("TEST_ENGINE") == "sqlite":
         "default": {
             "ENGINE": "django.db.backends.sqlite3",
             "NAME": ":memory:",
-        }
+        },
+        "other": {
+            "ENGINE": "django.db.backends.sqlite3",
+            "NAME": ":memory:",
+        },
+        # Attached to the other databases when HISTORY_SQLITE_ATTACH = "history".
+        "history": {
+            "ENGINE": "django.db.backends.sqlite3",
+            "NAME": ":memory:",
+        },
     }
+    DATABASE_ROUTERS = ["testapp.routers.AttachedHistoryRouter"]
 else:
     DATABASES = {
         "default": {
@@ -64,14 +75,16 @@ else:
             "PASSWORD": os.getenv("POSTGRES_PASSWORD", "secret"),
             "HOST": os.getenv("POSTGRES_HOST", "localhost"),
             "PORT": os.getenv("POSTGRES_PORT", 5432),
-        }
+        },
     }
+    DATABASES["other"] = {**DATABASES["default"], "NAME": "history_other"}
 
 MIGRATION_MODULES = {
     "auth": None,
     "contenttypes": None,
     "sessions": None,
     "history": None,
+    "history_rollups": None,
 }
 
 LANGUAGE_CODE = "en-us"
@@ -83,3 +96,9 @@ USE_TZ = True
 STATIC_URL = "/static/"
 
 DEFAULT_AUTO_FIELD = "django.db.models.AutoField"
+
+# Models whose primary keys can't be stored in the default (integer) object_id.
+HISTORY_ROUTES = {
+    "testapp.document": "testapp.UUIDHistory",
+    "testapp.shelf": "testapp.KeyedHistory",
+}
@@ -1,22 +1,60 @@
+import asyncio
 import binascii
+import contextlib
 import datetime
+import gzip
+import io
+import json
 import os
+import tempfile
+import threading
+import time
 import unittest
 import uuid
+import warnings
 
+import django
+from asgiref.sync import async_to_sync, sync_to_async
+from django.conf import settings
+from django.contrib import admin
 from django.contrib.auth import get_user_model
-from django.core.management import call_command
-from django.db import connection
+from django.contrib.contenttypes.models import ContentType
+from django.core.exceptions import ImproperlyConfigured
+from django.core.management import CommandError, call_command
+from django.db import connection, connections, transaction
+from django.db.models import F
 from django.db.utils import IntegrityError
-from django.test import TestCase
-from django.test.utils import override_settings
+from django.test import TestCase, TransactionTestCase
+from django.test.utils import (
+    CaptureQueriesContext,
+    modify_settings,
+    override_settings,
+)
 from django.utils import timezone
 
-from history import backends, get_history_model
-from history.models import TriggerType
+import history
+from history import backends, conf, get_history_model
+from history.contrib.rollups.admin import register as register_rollup_admin
+from history.contrib.rollups.models import HistoryRollup
+from history.contrib.rollups.utils import rollup
+from history.models import LatestHistory, TriggerType, TruncatedValue
 from history.templatetags.history import json_format
+from history.utils import default_filter
 
-from .models import Author, Book, CustomHistory, RandomData, UnmanagedHistory, Untracked
+from .models import (
+    AppendHistory,
+    AttachedHistory,
+    Author,
+    Book,
+    CustomHistory,
+    Document,
+    HistorySessionRecord,
+    RandomData,
+    SessionHistory,
+    UnmanagedHistory,
+    Untracked,
+    UUIDHistory,
+)
 
 
 def nofilter(model, field, trigger):
@@ -29,6 +67,12 @@ def replace(d, **kwargs):
     return new_dict
 
 
+def no_update_order(model, field, trigger_type):
+    if trigger_type == TriggerType.UPDATE and field.name == "order":
+        return False
+    return default_filter(model, field, trigger_type)
+
+
 def test_request_context(request):
     return {"username": "webuser"}
 
@@ -37,6 +81,9 @@ class TriggersTestCase(TestCase):
     @classmethod
     def setUpClass(cls):
         super().setUpClass()
+        # Content types for auto-created (m2m through) models are created lazily, and
+        # may be cached from a previous test class whose transaction was rolled back.
+        ContentType.objects.clear_cache()
         call_command("triggers", "--quiet", "enable")
 
     @classmethod
@@ -58,6 +105,14 @@ class BasicTests(TriggersTestCase):
         b2 = backends.get_backend()
         self.assertIs(b1, b2)
 
+    def test_configuration(self):
+        self.assertTrue(conf.SNAPSHOTS)
+        with override_settings(HISTORY_SNAPSHOTS=False):
+            self.assertFalse(conf.SNAPSHOTS)
+        self.assertTrue(conf.SNAPSHOTS)
+        self.assertEqual(conf.MODEL, "testapp.CustomHistory")
+        self.assertTrue(admin.site.is_registered(UUIDHistory))
+
     def test_basics(self):
         with self.backend.session(username="nobody") as session:
             a = Author.objects.create(name="Nobody")
@@ -87,6 +142,14 @@ class BasicTests(TriggersTestCase):
         self.assertEqual(delete.snapshot, {"id": pk, "name": "Somebody"})
         self.assertIsNone(delete.changes)
 
+    def test_unchanged_update(self):
+        with self.backend.session(username="nobody") as session:
+            a = Author.objects.create(name="Nobody")
+            a.save()
+        update = session.history.get(change_type=TriggerType.UPDATE)
+        self.assertEqual(update.snapshot, {"id": a.pk, "name": "Nobody"})
+        self.assertIsNone(update.changes)
+
     def test_no_session(self):
         with self.assertRaises(IntegrityError):
             Author.objects.create(name="Error")
@@ -180,6 +243,72 @@ class BasicTests(TriggersTestCase):
             Author.objects.create(name="Fifth Author")
         self.assertEqual(session.history.count(), 3)
 
+    def test_pause_models(self):
+        with self.backend.session(username="fixer") as session:
+            with session.paused(models=[Book]):
+                Author.objects.create(name="Recorded")
+                Book.objects.create(title="Not recorded")
+                with session.paused():
+                    Author.objects.create(name="Not recorded")
+            Book.objects.create(title="Recorded")
+        self.assertEqual(
+            [h.source.__class__ for h in session.history.order_by("id")], [Author, Book]
+        )
+
+    def test_bypass(self):
+        with self.backend.session(username="bulk") as session:
+            with session.bypass():
+                Author.objects.create(name="Bypassed")
+                Book.objects.create(title="Bypassed")
+            with session.bypass(models=[Author]):
+                Author.objects.create(name="Bypassed")
+                Book.objects.create(title="Recorded")
+            with self.assertRaises(ValueError), session.bypass(models=[Author]):
+                raise ValueError()
+            Author.objects.create(name="Recorded")
+        self.assertEqual(
+            [h.source.__class__ for h in session.history.order_by("id")], [Book, Author]
+        )
+
+    async def test_async_session(self):
+        backend = await sync_to_async(backends.get_backend)()
+        async with backend.session(username="nobody") as session:
+            self.assertFalse(session.active)
+        self.assertFalse(session.active)
+
+        async def write(username):
+            async with backend.session(username=username) as session:
+                for _ in range(3):
+                    await RandomData.objects.acreate()
+                    await asyncio.sleep(0)
+            return session
+
+        # The tasks share a connection, but each write is recorded in its own session.
+        sessions = await asyncio.gather(write("one"), write("two"))
+        for session, username in zip(sessions, ["one", "two"]):
+            usernames = [h.username async for h in session.history]
+            self.assertEqual(usernames, [username] * 3)
+        self.assertIsNone(backend.current_session)
+
+    def test_lazy_session(self):
+        with self.backend.session(username="nobody"):
+            Author.objects.create(name="Before")
+        self.assertNotIn(backends.start_session_on_write, connection.execute_wrappers)
+        with self.backend.session(username="lazy").lazily() as session:
+            self.assertIn(session.start_on_write, connection.execute_wrappers)
+            list(Author.objects.all())
+            self.assertFalse(session.active)
+            # Any statement that isn't a SELECT starts the session.
+            with connection.cursor() as cursor:
+                cursor.execute(
+                    "WITH renamed AS (SELECT %s AS name) "
+                    "UPDATE testapp_author SET name = (SELECT name FROM renamed)",
+                    ["After"],
+                )
+            self.assertTrue(session.active)
+        self.assertNotIn(session.start_on_write, connection.execute_wrappers)
+        self.assertEqual(session.history.get().get_user(), "lazy")
+
     @override_settings(HISTORY_IGNORE_MODELS=["testapp.untracked"])
     def test_untracked_model(self):
         self.assertNotIn(Untracked, self.backend.get_models())
@@ -254,6 +383,51 @@ class MiddlewareTests(TriggersTestCase):
         self.assertEqual(RandomData.history.count(), 1)
         self.assertIsNone(RandomData.history.get().user)
 
+    def test_async_lifecycle(self):
+        UserModel = get_user_model()
+        with self.backend.session():
+            user = UserModel.objects.create_user("testuser")
+            self.async_client.force_login(user)
+        async_to_sync(self.async_client.get)("/async/lifecycle/")
+        insert = Author.history.get()
+        self.assertEqual(insert.get_user(), user)
+        self.assertIsNone(backends.get_backend().current_session)
+
+    def test_async_read(self):
+        # Nothing is written, so the session is never started.
+        response = async_to_sync(self.async_client.get)("/async/read/")
+        self.assertEqual(response.json(), {"authors": 0})
+        self.assertIsNone(getattr(connection, "history_session", None))
+
+
+@override_settings(HISTORY_MIDDLEWARE_DATABASES=["default", "other"])
+class MultipleDatabaseTests(TriggersTestCase):
+    databases = {"default", "other"}
+
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        call_command("triggers", "--quiet", "--database", "other", "enable")
+
+    @classmethod
+    def tearDownClass(cls):
+        call_command("triggers", "--quiet", "--database", "other", "disable")
+        super().tearDownClass()
+
+    def test_unused_database(self):
+        with CaptureQueriesContext(connections["other"]) as queries:
+            self.client.get("/databases/")
+        self.assertEqual(len(queries), 0)
+        self.assertEqual(Author.history.count(), 1)
+
+    def test_used_databases(self):
+        self.client.get("/databases/?other")
+        entry = Author.history.get()
+        other = Author.history.using("other").get()
+        self.assertEqual(entry.session_id, other.session_id)
+        self.assertEqual(entry.session_date, other.session_date)
+        self.assertIsNone(backends.get_backend("other").current_session)
+
 
 class TemplateTagTests(TestCase):
     def test_json_format(self):
@@ -336,3 +510,1022 @@ class PartitionTests(TriggersTestCase):
             c.execute("SELECT count(*) FROM {}".format(self.partition_name))
             count = c.fetchone()[0]
             self.assertEqual(count, 2)
+
+
+@unittest.skipIf(
+    os.getenv("TEST_ENGINE") == "sqlite",
+    "Deferred history is only available on PostgreSQL",
+)
+@override_settings(
+    HISTORY_MODEL="testapp.CustomHistory",
+    HISTORY_DEFERRED=True,
+)
+class DeferredTests(TriggersTestCase):
+    def test_collapse_insert(self):
+        with self.backend.session(username="batch") as session:
+            author = Author.objects.create(name="First")
+            author.name = "Second"
+            author.save()
+            author.name = "Third"
+            author.save()
+            transient = Author.objects.create(name="Transient")
+            transient.delete()
+        # Nothing is recorded until the transaction commits (or is flushed).
+        self.assertEqual(session.history.count(), 0)
+        self.backend.flush()
+        insert = session.history.get()
+        self.assertEqual(insert.change_type, TriggerType.INSERT)
+        self.assertEqual(insert.object_id, author.pk)
+        self.assertEqual(insert.get_user(), "batch")
+        self.assertEqual(insert.snapshot, {"id": author.pk, "name": "Third"})
+        self.assertIsNone(insert.changes)
+
+    def test_collapse_update(self):
+        with self.backend.session(username="setup"):
+            author = Author.objects.create(name="Original")
+        self.backend.flush()
+        with self.backend.session(username="batch") as session:
+            for name in ("One", "Two", "Three"):
+                author.name = name
+                author.save()
+        self.backend.flush()
+        update = session.history.get()
+        self.assertEqual(update.change_type, TriggerType.UPDATE)
+        self.assertEqual(update.snapshot, {"id": author.pk, "name": "Three"})
+        self.assertEqual(update.changes, {"name": ["Original", "Three"]})
+        with self.backend.session(username="cleanup") as session:
+            pk = author.pk
+            author.name = "Four"
+            author.save()
+            author.delete()
+        self.backend.flush()
+        delete = session.history.get()
+        self.assertEqual(delete.change_type, TriggerType.DELETE)
+        self.assertEqual(delete.snapshot, {"id": pk, "name": "Four"})
+        self.assertEqual(Author.history.count(), 3)
+
+    @override_settings(HISTORY_FILTER=no_update_order)
+    def test_collapse_fields(self):
+        call_command("triggers", "--quiet", "enable")
+        with self.backend.session(username="batch") as session:
+            book = Book.objects.create(title="First", order=1)
+            book.title = "Second"
+            book.save()
+        self.backend.flush()
+        # Collapsed into an insert, the snapshot has the insert trigger's fields.
+        insert = session.history.get()
+        self.assertEqual(insert.snapshot["order"], 1)
+        self.assertEqual(insert.snapshot["title"], "Second")
+
+
+@unittest.skipIf(
+    os.getenv("TEST_ENGINE") == "sqlite",
+    "Storage profiles are only available on PostgreSQL",
+)
+@override_settings(
+    HISTORY_MODEL="testapp.AppendHistory",
+    HISTORY_STORAGE_PROFILE="append",
+)
+class AppendOnlyTests(TriggersTestCase):
+    def test_storage_profile(self):
+        table = AppendHistory._meta.db_table
+        with connection.cursor() as c:
+            c.execute("SELECT reloptions FROM pg_class WHERE relname = %s", [table])
+            self.assertIn("fillfactor=100", c.fetchone()[0])
+            c.execute(
+                "SELECT count(*) FROM pg_constraint "
+                "WHERE conrelid = %s::regclass AND contype = 'f'",
+                [table],
+            )
+            self.assertEqual(c.fetchone()[0], 0)
+            c.execute(
+                "SELECT s.cache_size FROM pg_sequences s "
+                "WHERE format('%%I.%%I', s.schemaname, s.sequencename)::regclass = "
+                "pg_get_serial_sequence(%s, 'id')::regclass",
+                [table],
+            )
+            self.assertEqual(c.fetchone()[0], 64)
+        with self.backend.session(username="appender") as session:
+            Author.objects.create(name="Appended")
+        self.assertEqual(session.history.get().get_user(), "appender")
+
+
+@override_settings(
+    HISTORY_MODEL="testapp.CustomHistory",
+    HISTORY_ROUTES={**settings.HISTORY_ROUTES, "testapp.book": "testapp.AppendHistory"},
+)
+class RoutingTests(TriggersTestCase):
+    def test_routes(self):
+        with self.backend.session(username="router") as session:
+            author = Author.objects.create(name="Routed Author")
+            book = Book.objects.create(title="Routed Book")
+            book.authors.add(author)
+        # The author and the (unrouted) m2m through table use the default model.
+        self.assertEqual(session.history.count(), 2)
+        self.assertEqual(author.history.get().get_user(), "router")
+        self.assertIs(book.history.model, AppendHistory)
+        self.assertEqual(book.history.get().get_user(), "router")
+        self.assertEqual(Book.history.count(), 1)
+        self.assertEqual(session.history_for(Book).get().object_id, book.pk)
+        self.assertEqual(session.history_for(Author).get().object_id, author.pk)
+        self.assertEqual(AppendHistory.objects.count(), 1)
+
+
+@override_settings(HISTORY_MAX_VALUE_SIZE=10)
+class LargeValueTests(TriggersTestCase):
+    def test_truncated_values(self):
+        with self.backend.session():
+            author = Author.objects.create(name="x" * 50)
+            author.name = "y" * 50
+            author.save()
+            author.name = "short"
+            author.save()
+        insert, update, short = author.history.order_by("id")
+        name = insert.snapshot["name"]
+        self.assertIsInstance(name, TruncatedValue)
+        self.assertEqual(str(name), "x" * 10)
+        self.assertEqual(name.size, 50)
+        self.assertEqual(name, "x" * 50)
+        self.assertEqual("x" * 50, name)
+        self.assertNotEqual(name, "x" * 49)
+        self.assertNotEqual(name, "x" * 10)
+        self.assertNotEqual(name, 50)
+        self.assertEqual(name, TruncatedValue("x" * 10, name.md5, 50))
+        self.assertEqual(
+            {name, TruncatedValue("x" * 20, name.md5, 50)},
+            {TruncatedValue("x" * 10, name.md5, 50)},
+        )
+        self.assertEqual(update.changes, {"name": ["x" * 50, "y" * 50]})
+        self.assertEqual(short.changes, {"name": ["y" * 50, "short"]})
+        self.assertIsInstance(short.changes["name"][0], TruncatedValue)
+        # Saving keeps the stored marker.
+        insert.save()
+        insert.refresh_from_db()
+        self.assertIsInstance(insert.snapshot["name"], TruncatedValue)
+
+
+@unittest.skipIf(
+    os.getenv("TEST_ENGINE") == "sqlite",
+    "Column compression is only available on PostgreSQL",
+)
+@override_settings(HISTORY_COMPRESSION="pglz")
+class CompressionTests(TriggersTestCase):
+    def test_compression(self):
+        with connection.cursor() as c:
+            c.execute(
+                "SELECT attname, attcompression FROM pg_attribute "
+                "WHERE attrelid = 'object_history'::regclass "
+                "AND attname IN ('snapshot', 'changes') ORDER BY attname"
+            )
+            self.assertEqual(c.fetchall(), [("changes", "p"), ("snapshot", "p")])
+
+
+@unittest.skipIf(
+    os.getenv("TEST_ENGINE") != "sqlite", "JSONB storage is only used on SQLite"
+)
+@override_settings(HISTORY_SQLITE_JSONB=True)
+class SQLiteJSONBTests(TriggersTestCase):
+    def test_jsonb(self):
+        with self.backend.session():
+            author = Author.objects.create(name="Dan")
+            author.name = "Daniel"
+            author.save()
+        insert, update = author.history.order_by("id")
+        self.assertEqual(insert.snapshot["name"], "Dan")
+        self.assertEqual(update.changes, {"name": ["Dan", "Daniel"]})
+        self.assertEqual(author.history.filter(snapshot__name="Daniel").count(), 1)
+        self.assertEqual(
+            list(
+                author.history.order_by("id").values_list("snapshot__name", flat=True)
+            ),
+            ["Dan", "Daniel"],
+        )
+        # Falls back to text JSON on SQLite versions before 3.45.
+        supported = connection.Database.sqlite_version_info >= (3, 45, 0)
+        with connection.cursor() as c:
+            c.execute(
+                "SELECT DISTINCT typeof(snapshot) FROM {}".format(
+                    get_history_model()._meta.db_table
+                )
+            )
+            self.assertEqual(c.fetchall(), [("blob" if supported else "text",)])
+
+
+@override_settings(HISTORY_MODEL="testapp.CustomHistory", HISTORY_M2M="parent")
+class ManyToManyTests(TriggersTestCase):
+    def test_parent_changes(self):
+        with self.backend.session(username="editor") as session:
+            a1, a2, a3 = [Author.objects.create(name=str(n)) for n in range(3)]
+            book = Book.objects.create(title="Book")
+            book.authors.set([a1, a2])
+            book.authors.set([a2, a3])
+        updates = book.history.filter(change_type=TriggerType.UPDATE).order_by("id")
+        self.assertEqual(
+            [entry.changes for entry in updates],
+            [
+                {"authors": {"added": [a1.pk, a2.pk]}},
+                {"authors": {"removed": [a1.pk]}},
+                {"authors": {"added": [a3.pk]}},
+            ],
+        )
+        through = ContentType.objects.get_for_model(Book.authors.through)
+        self.assertFalse(session.history.filter(content_type=through).exists())
+        # Reverting the second set() restores the first authors.
+        updates.exclude(pk=updates[0].pk).revert(username="editor")
+        self.assertEqual(set(book.authors.all()), {a1, a2})
+
+    def test_separate_statements(self):
+        with self.backend.session(username="editor"):
+            a1, a2 = [Author.objects.create(name=str(n)) for n in range(2)]
+            book = Book.objects.create(title="Book")
+            book.authors.add(a1)
+            book.authors.add(a2)
+        updates = book.history.filter(change_type=TriggerType.UPDATE).order_by("id")
+        # SQLite's row triggers can't tell the statements apart, so they are merged.
+        if os.getenv("TEST_ENGINE") == "sqlite":
+            expected = [{"authors": {"added": [a1.pk, a2.pk]}}]
+        else:
+            expected = [
+                {"authors": {"added": [a1.pk]}},
+                {"authors": {"added": [a2.pk]}},
+            ]
+        self.assertEqual([entry.changes for entry in updates], expected)
+
+    def test_revert_delete(self):
+        with self.backend.session(username="editor"):
+            author = Author.objects.create(name="Author")
+            book = Book.objects.create(title="Book")
+            book.authors.add(author)
+        with self.backend.session(username="editor") as session:
+            Book.objects.get(pk=book.pk).delete()
+        session.revert(username="editor")
+        self.assertEqual(list(Book.objects.get(pk=book.pk).authors.all()), [author])
+
+
+@override_settings(HISTORY_MODEL="testapp.CustomHistory", HISTORY_LATEST=True)
+class LatestTests(TriggersTestCase):
+    databases = {"default", "other"}
+
+    def test_latest(self):
+        with self.backend.session(username="creator"):
+            first = Author.objects.create(name="First")
+            second = Author.objects.create(name="Second")
+        with self.backend.session(username="editor"):
+            first.name = "Edited"
+            first.save()
+        latest = first.latest_history
+        self.assertEqual(latest.pk, first.history.latest("id").pk)
+        self.assertEqual(latest.change_type, TriggerType.UPDATE)
+        self.assertEqual(latest.get_user(), "editor")
+        self.assertEqual(latest.changes, {"name": ["First", "Edited"]})
+        self.assertEqual(second.latest_history.get_user(), "creator")
+        self.assertIsNone(Author(name="Unsaved").latest_history)
+        authors = Author.objects.annotate(
+            modified_by=LatestHistory("username"),
+            change_type=LatestHistory("change_type"),
+        ).order_by("pk")
+        self.assertEqual(
+            list(authors.values_list("modified_by", "change_type")),
+            [("editor", "U"), ("creator", "I")],
+        )
+        if connection.vendor == "postgresql":
+            with connection.cursor() as c:
+                c.execute("SELECT count(*) FROM custom_history_latest")
+                self.assertEqual(c.fetchone()[0], 2)
+
+    @unittest.skipIf(
+        os.getenv("TEST_ENGINE") == "sqlite", "The summary table is PostgreSQL only"
+    )
+    def test_latest_out_of_order(self):
+        with self.backend.session(username="creator"):
+            author = Author.objects.create(name="First")
+        # A newer change, recorded by a transaction that committed first.
+        with connection.cursor() as c:
+            c.execute(
+                "UPDATE custom_history_latest SET id = id + 1000, username = 'newer'"
+            )
+        with self.backend.session(username="editor"):
+            author.name = "Edited"
+            author.save()
+        self.assertEqual(author.latest_history.get_user(), "newer")
+
+    def test_latest_using(self):
+        authors = Author.objects.using("other").annotate(
+            change_type=LatestHistory("change_type")
+        )
+        ContentType.objects.clear_cache()
+        with CaptureQueriesContext(connections["other"]) as queries:
+            with self.assertNumQueries(0):
+                authors.query.get_compiler("other").as_sql()
+        self.assertIn("django_content_type", queries[0]["sql"])
+
+    def test_latest_archive_compact(self):
+        with self.backend.session(username="creator"):
+            first = Author.objects.create(name="First")
+            second = Author.objects.create(name="Second")
+            for name in ("Edited", "Final"):
+                first.name = name
+                first.save()
+        CustomHistory.objects.update(
+            session_date=timezone.now() - datetime.timedelta(days=60)
+        )
+        call_command("history", "--quiet", "compact", "--days=30")
+        latest = first.latest_history
+        self.assertEqual(latest.pk, first.history.get().pk)
+        self.assertEqual(latest.change_type, TriggerType.INSERT)
+        self.assertEqual(latest.snapshot, {"id": first.pk, "name": "Final"})
+        with tempfile.TemporaryDirectory() as tmp:
+            path = os.path.join(tmp, "history.jsonl.gz")
+            call_command("history", "--quiet", "archive", "--days=30", "--file", path)
+        self.assertIsNone(first.latest_history)
+        self.assertIsNone(second.latest_history)
+        self.assertEqual(
+            list(
+                Author.objects.annotate(
+                    change_type=LatestHistory("change_type")
+                ).values_list("change_type", flat=True)
+            ),
+            [None, None],
+        )
+
+
+@override_settings(HISTORY_MODEL="testapp.SessionHistory")
+class SessionModelTests(TriggersTestCase):
+    def test_session_model(self):
+        with self.backend.session(username="editor", extra="context") as session:
+            author = Author.objects.create(name="First")
+            with session.statement():
+                Author.objects.update(name="Second")
+        with self.backend.session(username="reader").lazily():
+            list(Author.objects.all())
+        # Sessions are recorded once, when started, so lazy sessions that only read
+        # are not recorded.
+        record = HistorySessionRecord.objects.get()
+        self.assertEqual(record.pk, session.session_id)
+        self.assertEqual(record.username, "editor")
+        self.assertEqual(record.extra, "context")
+        self.assertEqual(record.session_date, author.history.first().session_date)
+        entries = session.history.select_related("session").order_by("id")
+        with self.assertNumQueries(1):
+            self.assertEqual([e.get_user() for e in entries], ["editor", "editor"])
+        self.assertEqual(
+            SessionHistory.objects.filter(session__username="editor").count(), 2
+        )
+        self.assertEqual(
+            [f.name for f in self.backend.session_fields(SessionHistory)],
+            ["session_id", "session_date", "statement_id"],
+        )
+
+    def test_session_error(self):
+        ident = uuid.uuid4()
+        # The session is recorded when it starts, so the error isn't hidden by a failed
+        # insert when it ends.
+        with self.assertRaises(IntegrityError), transaction.atomic():
+            with self.backend.session(username="failed"):
+                RandomData.objects.create(ident=ident)
+                RandomData.objects.create(ident=ident)
+        self.assertFalse(HistorySessionRecord.objects.exists())
+
+    def test_middleware(self):
+        with self.backend.session():
+            user = get_user_model().objects.create_user("testuser")
+            self.client.force_login(user)
+        self.client.get("/lifecycle/")
+        insert = Author.history.select_related("session").get()
+        self.assertEqual(insert.session.username, str(user.pk))
+        self.assertEqual(insert.get_user(), str(user.pk))
+
+
+@override_settings(HISTORY_CHANGES_INDEX="jsonb_path_ops")
+class QueryTests(TriggersTestCase):
+    def setUp(self):
+        super().setUp()
+        with self.backend.session():
+            self.book = Book.objects.create(title="Draft", year=2000)
+            self.book.year = 2001
+            self.book.save()
+            self.book.title = "Final"
+            self.book.save()
+            self.book.title = "Draft"
+            self.book.save()
+            Book.objects.create(title="Other", year=2001)
+
+    def test_changed_field(self):
+        HistoryModel = get_history_model()
+        self.assertEqual(HistoryModel.objects.changed_field("year").count(), 1)
+        self.assertEqual(HistoryModel.objects.changed_field("title").count(), 2)
+        self.assertEqual(HistoryModel.objects.changed_field("title", "year").count(), 3)
+        self.assertEqual(HistoryModel.objects.changed_field("order").count(), 0)
+
+    def test_changed_value(self):
+        HistoryModel = get_history_model()
+        self.assertEqual(HistoryModel.objects.changed_to("year", 2001).count(), 1)
+        self.assertEqual(HistoryModel.objects.changed_to("year", 2000).count(), 0)
+        self.assertEqual(HistoryModel.objects.changed_from("year", 2000).count(), 1)
+        entry = HistoryModel.objects.changed_to("title", "Draft").get()
+        self.assertEqual(entry.changes, {"title": ["Final", "Draft"]})
+        self.assertEqual(
+            self.book.history.changed_from("title", "Draft").get().changes,
+            {"title": ["Draft", "Final"]},
+        )
+
+    def test_field_timeline(self):
+        HistoryModel = get_history_model()
+        timeline = HistoryModel.objects.field_timeline(self.book, "title")
+        self.assertEqual(
+            [(h.change_type, h.value) for h in timeline],
+            [("I", "Draft"), ("U", "Final"), ("U", "Draft")],
+        )
+        timeline = HistoryModel.objects.field_timeline(self.book, "year")
+        self.assertEqual([h.value for h in timeline], [2000, 2001])
+
+    @unittest.skipIf(
+        os.getenv("TEST_ENGINE") == "sqlite", "GIN indexes are only on PostgreSQL"
+    )
+    def test_changes_index(self):
+        with connection.cursor() as c:
+            c.execute(
+                "SELECT indexdef FROM pg_indexes WHERE indexname = %s",
+                ["object_history_changes_gin"],
+            )
+            self.assertIn("jsonb_path_ops", c.fetchone()[0])
+
+
+class StatementTests(TriggersTestCase):
+    def test_statement(self):
+        with self.backend.session() as session:
+            books = [Book.objects.create(title=str(i)) for i in range(3)]
+            with session.statement() as statement:
+                Book.objects.update(order=F("order") + 1)
+            for book in books:
+                book.year = 2000
+            with history.statement() as bulk:
+                Book.objects.bulk_update(books, ["year"])
+            books[0].delete()
+        self.assertEqual(session.history.count(), 10)
+        self.assertEqual(statement.history.count(), 3)
+        self.assertEqual(statement.session_id, session.session_id)
+        for entry in statement.history:
+            self.assertEqual(entry.session_id, session.session_id)
+            self.assertIsNone(entry.snapshot)
+            self.assertEqual(entry.changes, {"order": [0, 1]})
+        HistoryModel = get_history_model()
+        bulk_history = HistoryModel.objects.for_statement(bulk.statement_id)
+        self.assertEqual(bulk_history.count(), 3)
+        for entry in bulk_history:
+            self.assertEqual(entry.changes, {"year": [None, 2000]})
+        # History after a statement is no longer tagged, and has snapshots.
+        delete = session.history.get(change_type=TriggerType.DELETE)
+        self.assertIsNone(delete.statement_id)
+        self.assertEqual(delete.snapshot["year"], 2000)
+
+    def test_no_session(self):
+        with self.assertRaises(RuntimeError):
+            history.statement()
+
+
+@override_settings(HISTORY_MODEL="testapp.CustomHistory")
+class OptionalFieldTests(TriggersTestCase):
+    def test_no_statement_id(self):
+        with self.backend.session(username="editor") as session:
+            Author.objects.create(name="First")
+            with session.statement() as statement:
+                Author.objects.update(name="Second")
+        # Without a statement_id field, statements are recorded but not tagged.
+        self.assertEqual(session.history.count(), 2)
+        with self.assertRaises(ImproperlyConfigured):
+            statement.history.count()
+
+    @override_settings(HISTORY_FEED=True)
+    def test_no_transaction_id(self):
+        # HISTORY_FEED skips history models without a transaction_id field.
+        call_command("triggers", "--quiet", "enable")
+        with self.backend.session(username="editor"):
+            Author.objects.create(name="First")
+        if os.getenv("TEST_ENGINE") == "sqlite":
+            [(entries, _position)] = self.backend.feed()
+            self.assertEqual(len(entries), 1)
+        else:
+            with self.assertRaises(ImproperlyConfigured):
+                list(self.backend.feed())
+
+
+class RevertTests(TriggersTestCase):
+    def test_revert_session(self):
+        now = timezone.now()
+        with self.backend.session():
+            kept = Book.objects.create(title="Kept", year=2000)
+            deleted = Book.objects.create(title="Deleted", year=2001, order=3)
+            data = RandomData.objects.create(data={"answer": 42}, date=now)
+        with self.backend.session() as session:
+            kept.title = "Changed"
+            kept.save()
+            Book.objects.update(order=F("order") + 1)
+            deleted.delete()
+            data.delete()
+            Book.objects.create(title="Created")
+        reverting = session.revert()
+        self.assertEqual(
+            list(Book.objects.order_by("id").values_list("title", "year", "order")),
+            [("Kept", 2000, 0), ("Deleted", 2001, 3)],
+        )
+        restored = RandomData.objects.get()
+        self.assertEqual(restored.ident, data.ident)
+        self.assertEqual(restored.data, {"answer": 42})
+        self.assertEqual(restored.date, now)
+        # The revert is recorded in its own session.
+        self.assertEqual(reverting.history.count(), 4)
+        self.assertEqual(
+            set(reverting.history.values_list("change_type", flat=True)),
+            {TriggerType.INSERT, TriggerType.UPDATE, TriggerType.DELETE},
+        )
+
+    def test_revert_queryset(self):
+        with self.backend.session() as session:
+            book = Book.objects.create(title="First")
+            book.title = "Second"
+            book.save()
+            book.year = 2000
+            book.save()
+            book.title = "Third"
+            book.save()
+        # Only revert the last two changes.
+        entries = book.history.filter(change_type=TriggerType.UPDATE).order_by("id")
+        get_history_model().objects.filter(pk__in=[e.pk for e in entries[1:]]).revert()
+        book.refresh_from_db()
+        self.assertEqual((book.title, book.year), ("Second", None))
+        self.assertEqual(session.history.count(), 4)
+
+
+class PlanTests(TestCase):
+    def test_plan(self):
+        output = io.StringIO()
+        with contextlib.redirect_stdout(output):
+            call_command("triggers", "plan")
+        output = output.getvalue()
+        self.assertIn("-- testapp.Book (testapp_book): 4 columns", output)
+        self.assertIn("CREATE TRIGGER", output)
+        if connection.vendor == "postgresql":
+            self.assertIn("deletes/day", output)
+        # Nothing was actually installed.
+        Author.objects.create(name="No triggers")
+
+    def schema(self):
+        with connection.cursor() as cursor:
+            if connection.vendor == "postgresql":
+                cursor.execute(
+                    "SELECT tgname FROM pg_trigger UNION ALL "
+                    "SELECT proname FROM pg_proc UNION ALL SELECT relname FROM pg_class"
+                )
+            else:
+                cursor.execute(
+                    "SELECT name FROM sqlite_master UNION ALL "
+                    "SELECT name FROM sqlite_temp_master"
+                )
+            return sorted(row[0] for row in cursor.fetchall())
+
+    def test_plan_unchanged(self):
+        # Content types for through models are created when building their triggers.
+        through = ContentType.objects.get_for_model(Book.authors.through)
+        with connection.cursor() as cursor:
+            # Without cascading to the history models, which may not all have tables.
+            cursor.execute(
+                "DELETE FROM django_content_type WHERE id = %s", [through.pk]
+            )
+        ContentType.objects.clear_cache()
+        schema = self.schema()
+        content_types = set(ContentType.objects.values_list("pk", flat=True))
+        call_command("triggers", "--quiet", "plan")
+        self.assertEqual(self.schema(), schema)
+        self.assertEqual(
+            set(ContentType.objects.values_list("pk", flat=True)), content_types
+        )
+        # The content types cached while planning were cleared.
+        ct = ContentType.objects.get_for_model(Book.authors.through)
+        self.assertTrue(ContentType.objects.filter(pk=ct.pk).exists())
+
+
+class HistoryCommandTests(TriggersTestCase):
+    def setUp(self):
+        super().setUp()
+        HistoryModel = get_history_model()
+        with self.backend.session():
+            self.old = Author.objects.create(name="Old")
+            self.old.name = "Older"
+            self.old.save()
+            self.old.name = "Oldest"
+            self.old.save()
+        HistoryModel.objects.update(
+            session_date=timezone.now() - datetime.timedelta(days=60)
+        )
+        with self.backend.session():
+            self.old.name = "New"
+            self.old.save()
+
+    def test_archive_table(self):
+        HistoryModel = get_history_model()
+        call_command(
+            "history",
+            "--quiet",
+            "archive",
+            "--days=30",
+            "--chunk-size=2",
+            "--table=history_archive",
+        )
+        self.assertEqual(
+            HistoryModel.objects.get().changes, {"name": ["Oldest", "New"]}
+        )
+        with connection.cursor() as c:
+            c.execute("SELECT change_type FROM history_archive ORDER BY id")
+            self.assertEqual([r[0] for r in c.fetchall()], ["I", "U", "U"])
+
+    def test_archive_file(self):
+        with tempfile.TemporaryDirectory() as tmp:
+            path = os.path.join(tmp, "history.jsonl.gz")
+            for _ in range(2):
+                call_command(
+                    "history", "--quiet", "archive", "--days=30", "--file", path
+                )
+            with gzip.open(path, "rt") as f:
+                rows = [json.loads(line) for line in f]
+        self.assertEqual([r["change_type"] for r in rows], ["I", "U", "U"])
+        self.assertEqual(rows[0]["snapshot"], {"id": self.old.pk, "name": "Old"})
+        self.assertEqual(get_history_model().objects.count(), 1)
+
+    def test_compact(self):
+        call_command("history", "--quiet", "compact", "--days=30", "--chunk-size=1")
+        old, new = self.old.history.order_by("id")
+        self.assertEqual(old.change_type, TriggerType.INSERT)
+        self.assertEqual(old.snapshot, {"id": self.old.pk, "name": "Oldest"})
+        self.assertIsNone(old.changes)
+        self.assertEqual(new.changes, {"name": ["Oldest", "New"]})
+
+    def test_compact_statement(self):
+        HistoryModel = get_history_model()
+        with self.backend.session() as session:
+            author = Author.objects.create(name="a")
+            with session.statement():
+                Author.objects.filter(pk=author.pk).update(name="b")
+            with session.statement():
+                Author.objects.filter(pk=author.pk).update(name="c")
+        self.assertIsNone(author.history.order_by("id").last().snapshot)
+        HistoryModel.objects.filter(object_id=author.pk).update(
+            session_date=timezone.now() - datetime.timedelta(days=60)
+        )
+        call_command("history", "--quiet", "compact", "--days=30")
+        compacted = author.history.get()
+        self.assertEqual(compacted.change_type, TriggerType.INSERT)
+        self.assertEqual(compacted.snapshot, {"id": author.pk, "name": "c"})
+
+
+class KeyTests(TriggersTestCase):
+    def test_uuid_pk(self):
+        with self.backend.session() as session:
+            doc = Document.objects.create(title="Draft")
+            doc.title = "Final"
+            doc.save()
+            self.assertEqual(doc.history.count(), 2)
+            pk = doc.pk
+            doc.delete()
+        history = session.history_for(Document).order_by("id")
+        self.assertIs(history.model, UUIDHistory)
+        self.assertEqual([h.object_id for h in history], [pk] * 3)
+        self.assertEqual(history.last().change_type, TriggerType.DELETE)
+
+    @unittest.skipIf(django.VERSION < (5, 2), "Composite primary keys need Django 5.2")
+    def test_composite_pk(self):
+        from .models import Shelf
+
+        with self.backend.session() as session:
+            shelf = Shelf.objects.create(room="A", number=1, label="Fiction")
+            shelf.label = "Mystery"
+            shelf.save()
+            Shelf.objects.create(room="A", number=2, label="Poetry")
+        self.assertEqual(session.history.count(), 0)
+        self.assertEqual(session.history_for(Shelf).count(), 3)
+        update = shelf.history.get(change_type=TriggerType.UPDATE)
+        self.assertEqual(update.changes, {"label": ["Fiction", "Mystery"]})
+        self.assertEqual(json.loads(update.object_id), ["A", 1])
+
+    @unittest.skipIf(
+        os.getenv("TEST_ENGINE") == "sqlite", "Trigger functions are PostgreSQL only"
+    )
+    def test_trigger_object_id(self):
+        # Each primary key gets a trigger function that reads it directly from the row.
+        functions = {
+            "history_record": 'NEW."id"',
+            "history_record_uuid_history": 'NEW."id"',
+        }
+        if django.VERSION >= (5, 2):
+            functions["history_record_keyed_history__room_number"] = (
+                'jsonb_build_array(NEW."room", NEW."number")::text'
+            )
+        with connection.cursor() as cursor:
+            for name, expression in functions.items():
+                cursor.execute("SELECT prosrc FROM pg_proc WHERE proname = %s", [name])
+                source = cursor.fetchone()[0]
+                self.assertIn("_object_id := {};".format(expression), source)
+
+    @override_settings(HISTORY_ROUTES={})
+    def test_incompatible_pk(self):
+        with self.assertRaises(ImproperlyConfigured):
+            self.backend.create_trigger(Document, TriggerType.INSERT)
+        # Enabling triggers skips the model, and still installs the others.
+        with self.assertWarnsRegex(UserWarning, "Skipping testapp.Document"):
+            call_command("triggers", "--quiet", "enable")
+        # The models are only checked once per backend, without warnings.
+        with warnings.catch_warnings():
+            warnings.simplefilter("error")
+            self.assertNotIn(Document, self.backend.get_models())
+            self.assertIs(self.backend.get_models(), self.backend.get_models())
+        self.assertIn(
+            Document, [model for model, _error in self.backend.skipped_models()]
+        )
+        with self.backend.session() as session:
+            Author.objects.create(name="Compatible")
+        self.assertEqual(session.history.count(), 1)
+
+
+@unittest.skipIf(
+    os.getenv("TEST_ENGINE") != "sqlite",
+    "Attached history databases are only used on SQLite",
+)
+@override_settings(
+    HISTORY_MODEL="testapp.AttachedHistory",
+    HISTORY_ROUTES={},
+    HISTORY_IGNORE_MODELS=["testapp.document", "testapp.shelf"],
+    HISTORY_SQLITE_ATTACH="history",
+)
+class AttachedDatabaseTests(TransactionTestCase):
+    # The "history" database is only configured for SQLite.
+    databases = {"default", "history"} if "history" in settings.DATABASES else set()
+
+    def setUp(self):
+        call_command("triggers", "--quiet", "enable")
+        self.backend = backends.get_backend(cache=False)
+
+    def tearDown(self):
+        # Before the tables are flushed, outside of a session.
+        call_command("triggers", "--clear", "--quiet", "disable")
+
+    def test_attached(self):
+        with self.backend.session(username="attached") as session:
+            author = Author.objects.create(name="Attached")
+            author.name = "Detached"
+            author.save()
+            with session.bypass():
+                Author.objects.create(name="Bypassed")
+        self.assertEqual(session.history.count(), 2)
+        update = author.history.latest()
+        self.assertEqual(update.changes, {"name": ["Attached", "Detached"]})
+        self.assertEqual(update.get_user(), "attached")
+        # History is only stored in the attached database, by temporary triggers.
+        self.assertEqual(AttachedHistory.objects.using("history").count(), 2)
+        self.assertNotIn("attached_history", connection.introspection.table_names())
+        with connection.cursor() as c:
+            c.execute(
+                "SELECT count(*) FROM sqlite_temp_master "
+                "WHERE type = 'trigger' AND tbl_name = 'testapp_author'"
+            )
+            self.assertEqual(c.fetchone()[0], 3)
+
+    def test_plan(self):
+        call_command("triggers", "--quiet", "disable")
+        # As on a new connection, which has no temporary triggers yet (closing the
+        # in-memory test database is a no-op).
+        connection.history_functions = None
+        output = io.StringIO()
+        with contextlib.redirect_stdout(output):
+            call_command("triggers", "plan")
+        self.assertIn("CREATE TEMP TRIGGER", output.getvalue())
+        with connection.cursor() as c:
+            c.execute("SELECT count(*) FROM sqlite_temp_master WHERE type = 'trigger'")
+            self.assertEqual(c.fetchone()[0], 0)
+
+
+@override_settings(
+    HISTORY_FEED=True,
+    HISTORY_FEED_NOTIFY=True,
+    # Database flushes between tests re-create permissions outside of any session.
+    HISTORY_IGNORE_APPS=["admin", "auth", "contenttypes", "sessions"],
+)
+class FeedTests(TransactionTestCase):
+    def setUp(self):
+        call_command("triggers", "--quiet", "enable")
+        self.backend = backends.get_backend(cache=False)
+
+    def tearDown(self):
+        call_command("triggers", "--clear", "--quiet", "disable")
+
+    def test_feed(self):
+        with self.backend.session(user=1) as session:
+            authors = [Author.objects.create(name=str(n)) for n in range(3)]
+            authors[0].delete()
+        batches = list(self.backend.feed(batch_size=2))
+        self.assertEqual([len(entries) for entries, _position in batches], [2, 2])
+        entries = [entry for batch, _position in batches for entry in batch]
+        self.assertEqual(
+            [e.pk for e in entries], list(session.history.values_list("pk", flat=True))
+        )
+        # Resuming from any position returns the rest.
+        position = batches[0][1]
+        self.assertEqual(list(self.backend.feed(position=position))[0][0], entries[2:])
+        self.assertEqual(list(self.backend.feed(position=batches[-1][1])), [])
+        out = io.StringIO()
+        call_command(
+            "history", "feed", "--after", "{}:{}".format(*position), stdout=out
+        )
+        rows = [json.loads(line) for line in out.getvalue().splitlines()]
+        self.assertEqual([row["id"] for row in rows], [e.pk for e in entries[2:]])
+        self.assertEqual(rows[-1]["change_type"], "D")
+
+    @unittest.skipIf(
+        os.getenv("TEST_ENGINE") == "sqlite",
+        "Concurrent writers are only possible on PostgreSQL",
+    )
+    def test_concurrent(self):
+        written = threading.Event()
+        done = threading.Event()
+
+        def write():
+            try:
+                backend = backends.get_backend(cache=False)
+                with transaction.atomic(), backend.session(user=1):
+                    Author.objects.create(name="Slow")
+                    written.set()
+                    done.wait(10)
+            finally:
+                connections.close_all()
+
+        self.backend.listen()
+        thread = threading.Thread(target=write)
+        thread.start()
+        written.wait(10)
+        with self.backend.session(user=2):
+            Author.objects.create(name="Fast")
+        # The later ID is committed first, but is held back until the earlier
+        # transaction finishes.
+        self.assertEqual(list(self.backend.feed()), [])
+        done.set()
+        thread.join()
+        start = time.monotonic()
+        self.backend.wait_for_history(10)
+        self.assertLess(time.monotonic() - start, 5)
+        [(entries, _position)] = self.backend.feed()
+        self.assertEqual([e.user_id for e in entries], [1, 2])
+        self.assertLess(entries[0].pk, entries[1].pk)
+
+
+@override_settings(
+    HISTORY_FEED=True,
+    # Database flushes between tests re-create permissions outside of any session.
+    HISTORY_IGNORE_APPS=["admin", "auth", "contenttypes", "sessions"],
+)
+class RollupTests(TransactionTestCase):
+    def setUp(self):
+        call_command("triggers", "--quiet", "enable")
+
+    def tearDown(self):
+        call_command("triggers", "--clear", "--quiet", "disable")
+
+    def totals(self):
+        return {
+            (row["change_type"], row["user"]): row["total"]
+            for row in HistoryRollup.objects.for_model(Author).totals(
+                "change_type", "user"
+            )
+        }
+
+    def test_rollup(self):
+        with history.session(user=1):
+            authors = [Author.objects.create(name=str(n)) for n in range(3)]
+            Author.objects.filter(pk=authors[0].pk).update(name="First")
+        with history.session(user=2):
+            authors[1].delete()
+        call_command("history", "--quiet", "rollup", "--batch-size", "2")
+        expected = {("I", "1"): 3, ("U", "1"): 1, ("D", "2"): 1}
+        self.assertEqual(self.totals(), expected)
+        # Only history recorded since the last rollup is counted.
+        call_command("history", "--quiet", "rollup")
+        self.assertEqual(self.totals(), expected)
+        with history.session(user=1):
+            Author.objects.create(name="Another")
+        self.assertEqual(rollup(), 1)
+        self.assertEqual(self.totals(), {**expected, ("I", "1"): 4})
+        self.assertEqual(
+            list(HistoryRollup.objects.totals("day")),
+            [{"day": timezone.localdate(), "total": 6}],
+        )
+        site = admin.AdminSite()
+        register_rollup_admin(site)
+        self.assertTrue(site.is_registered(HistoryRollup))
+        with modify_settings(INSTALLED_APPS={"remove": ["history.contrib.rollups"]}):
+            with self.assertRaises(CommandError):
+                call_command("history", "--quiet", "rollup")
+
+
+@unittest.skipIf(
+    os.getenv("TEST_ENGINE") == "sqlite",
+    "Logical decoding is only available on PostgreSQL",
+)
+@override_settings(
+    HISTORY_BACKEND="history.backends.logical.LogicalHistoryBackend",
+    # Database flushes between tests re-create permissions outside of any session.
+    HISTORY_IGNORE_APPS=["admin", "auth", "contenttypes", "sessions"],
+)
+class LogicalDecodingTests(TransactionTestCase):
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        with connection.cursor() as c:
+            c.execute("SHOW wal_level")
+            if c.fetchone()[0] != "logical":
+                raise unittest.SkipTest("Logical decoding requires wal_level=logical")
+        call_command("triggers", "--quiet", "enable")
+
+    @classmethod
+    def tearDownClass(cls):
+        call_command("triggers", "--clear", "--quiet", "disable")
+        super().tearDownClass()
+
+    def setUp(self):
+        self.backend = backends.get_backend(cache=False)
+
+    def test_consume(self):
+        data = {"hello": "world", "answer": 42}
+        with self.backend.session(user=42) as session:
+            author = Author.objects.create(name="Logical")
+            author.name = "Decoded"
+            author.save()
+            obj = RandomData.objects.create(data=data)
+            with session.paused():
+                Author.objects.create(name="Paused")
+            author.delete()
+        # Nothing is recorded until the changes are consumed.
+        self.assertEqual(session.history.count(), 0)
+        self.assertEqual(self.backend.consume(), 4)
+        self.assertEqual(self.backend.consume(), 0)
+        self.assertEqual(session.history.count(), 4)
+        insert = session.history.filter(content_type__model="author").earliest("id")
+        update = session.history.get(change_type=TriggerType.UPDATE)
+        delete = session.history.get(change_type=TriggerType.DELETE)
+        self.assertEqual(insert.change_type, TriggerType.INSERT)
+        self.assertEqual(insert.user_id, 42)
+        self.assertEqual(insert.session_date, session.history.first().session_date)
+        self.assertEqual(insert.snapshot, {"id": update.object_id, "name": "Logical"})
+        self.assertEqual(update.changes, {"name": ["Logical", "Decoded"]})
+        self.assertEqual(delete.snapshot, {"id": update.object_id, "name": "Decoded"})
+        self.assertEqual(obj.history.get().snapshot["data"], data)
+
+    def test_no_commit(self):
+        def slot_lsn():
+            with connection.cursor() as c:
+                c.execute(
+                    "SELECT confirmed_flush_lsn FROM pg_replication_slots "
+                    "WHERE slot_name = %s",
+                    [self.backend.slot_name],
+                )
+                return c.fetchone()[0]
+
+        lsn = slot_lsn()
+        # A Begin message (final LSN, timestamp, and xid) without a Commit.
+        self.assertIsNone(self.backend.record_changes([(lsn, b"B" + bytes(20))]))
+        self.assertEqual(slot_lsn(), lsn)
+
+    def test_drop_triggers(self):
+        # The table stays published until its last trigger is dropped, in any order.
+        try:
+            for trigger_type in (TriggerType.DELETE, TriggerType.INSERT):
+                self.backend.drop_trigger(Author, trigger_type)
+                self.assertTrue(self.backend.is_published(Author))
+            self.backend.drop_trigger(Author, TriggerType.UPDATE)
+            self.assertFalse(self.backend.is_published(Author))
+        finally:
+            for trigger_type in TriggerType:
+                self.backend.create_trigger(Author, trigger_type)
+
+    def test_history_table_setup(self):
+        indexes = ["object_history_changes_gin", "object_history_statement"]
+        with connection.cursor() as c:
+            for name in indexes:
+                c.execute("DROP INDEX IF EXISTS {};".format(name))
+        with override_settings(
+            HISTORY_CHANGES_INDEX="jsonb_path_ops", HISTORY_COMPRESSION="pglz"
+        ):
+            backends.get_backend(cache=False).install()
+        with connection.cursor() as c:
+            c.execute(
+                "SELECT indexname FROM pg_indexes WHERE indexname = ANY(%s) "
+                "ORDER BY indexname",
+                [indexes],
+            )
+            self.assertEqual([row[0] for row in c.fetchall()], indexes)
+            c.execute(
+                "SELECT attcompression FROM pg_attribute "
+                "WHERE attrelid = 'object_history'::regclass AND attname = 'changes'"
+            )
+            self.assertEqual(c.fetchone()[0], "p")
+
+    def test_no_session(self):
+        with self.assertRaises(IntegrityError):
+            Author.objects.create(name="Error")
@@ -4,5 +4,8 @@ from . import views
 
 urlpatterns = [
     path("lifecycle/", views.lifecycle),
+    path("databases/", views.multiple_databases),
+    path("async/lifecycle/", views.async_lifecycle),
+    path("async/read/", views.async_read),
     path("ignored/", views.ignore),
 ]
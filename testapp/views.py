@@ -10,6 +10,22 @@ def lifecycle(request):
     return JsonResponse({})
 
 
+def multiple_databases(request):
+    Author.objects.create(name="Default")
+    if "other" in request.GET:
+        Author.objects.using("other").create(name="Other")
+    return JsonResponse({})
+
+
+async def async_lifecycle(request):
+    await Author.objects.acreate(name="Dan Watson")
+    return JsonResponse({})
+
+
+async def async_read(request):
+    return JsonResponse({"authors": await Author.objects.acount()})
+
+
 @session(user=None)
 def ignore(request):
     RandomData.objects.create()